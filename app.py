@@ -1,8 +1,8 @@
 # app.py - Flask Web 服务器主文件
-from scripts.main import run_etl_process_for_file, DB_CONFIG
+from scripts.main import run_etl_process_for_file, relink_processed_file, DB_CONFIG
 from scripts.error_handler import ETLError, format_error_for_frontend
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS 
 import logging
 import json
@@ -11,7 +11,12 @@ import pandas as pd
 from werkzeug.utils import secure_filename
 import time
 import re
-from scripts.db_queries import get_data_from_db
+from scripts.db_queries import get_data_from_db, get_data_page_from_db, count_user_rows, MINDMAP_TABLES
+from scripts.db_queries import iter_user_records, get_source_files_metadata, parse_fields_param
+from scripts.job_queue import ETLJobQueue
+from scripts.query_classifier import classify_search_query
+from scripts.read_cache import READ_CACHE, SEARCH_TAG, user_tag, file_tag
+from scripts.file_metadata import save_stream_with_hash, insert_file_metadata, find_processed_file_by_hash
 
 # 配置日志
 logging.basicConfig(level=logging.INFO) 
@@ -30,6 +35,40 @@ if not os.path.exists(UPLOAD_FOLDER):
 # 配置CORS，允许跨域访问
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+def format_job_error(result):
+    """将后台ETL任务的失败结果转换为与上传接口一致的错误格式"""
+    if isinstance(result, ETLError):
+        return format_error_for_frontend(result)
+    return {
+        "success": False,
+        "error": {
+            "type": "PROCESSING_ERROR",
+            "title": "处理失败",
+            "user_message": str(result),
+            "suggestions": ["请检查文件格式和内容", "联系技术支持"]
+        }
+    }
+
+# ETL后台任务队列：上传请求立即返回任务ID，ETL在有界线程池中执行，
+# 避免大文件长时间占用Flask工作线程，查询接口保持响应
+ETL_MAX_WORKERS = int(os.environ.get('ETL_MAX_WORKERS', 2))
+etl_jobs = ETLJobQueue(max_workers=ETL_MAX_WORKERS, error_formatter=format_job_error)
+
+# 上传内容与已处理文件完全相同时的处理方式（上传表单的 on_duplicate 字段）：
+#   skip      跳过ETL，直接返回已处理文件的信息（默认）
+#   relink    不重新解析，把已有数据转移到新文件名下
+#   reprocess 照常完整处理
+DUPLICATE_UPLOAD_ACTIONS = ('skip', 'relink', 'reprocess')
+
+# 导入方式（上传表单的 import_mode 字段）：
+#   replace     删除该文件名的旧数据后完整写入（默认）
+#   incremental 与被取代的旧文件（supersedes 字段，可重复）中同一账户的记录比较指纹，
+#               只插入新记录、删除不再出现的记录
+IMPORT_MODES = ('replace', 'incremental')
+
+# /api/mindmap_data 分页时每张表每页的最大条数
+MINDMAP_MAX_PAGE_SIZE = int(os.environ.get('MINDMAP_MAX_PAGE_SIZE', 5000))
+
 def secure_filename_custom(filename):
     """
     自定义安全文件名处理，允许中文、字母、数字、下划线、点和连字符
@@ -51,38 +90,70 @@ def company_shortname(company_full):
 
 @app.route('/api/search_uid', methods=['GET'])
 def search_uid():
-    """通过模糊查找获取用户ID列表"""
+    """
+    查找用户ID列表：先识别搜索词类型（IP、邮箱、手机号、交易哈希、钱包地址等），
+    识别成功时只在搜索索引中按对应字段做一次等值/前缀查找；自由文本在索引中做通用前缀匹配，
+    fuzzy=1 时索引无结果再退回到各表的包含匹配（LIKE '%词%'，全表扫描，较慢）。
+    """
     search_term = request.args.get('query')
     if not search_term:
         return jsonify({"status": "error", "message": "缺少查询参数"}), 400
+    fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes')
 
-    logging.info(f"收到模糊查找请求: {search_term}")
+    logging.info(f"收到用户查找请求: {search_term} (fuzzy={fuzzy})")
+    
+    query_type = classify_search_query(search_term)
+    # 按规范化后的查询缓存：识别出类型的用规范化值，自由文本用小写形式
+    cache_key = ('search', query_type.kind if query_type else 'text',
+                 query_type.values if query_type else search_term.strip().lower(), fuzzy)
+    hit, cached = READ_CACHE.get(cache_key)
+    if hit:
+        payload, status_code = cached
+        return jsonify(payload), status_code
+    cache_generation = READ_CACHE.generation()
     
     try:
-        from scripts.db_queries import search_users_by_fuzzy_term
-        results = search_users_by_fuzzy_term(DB_CONFIG, search_term)
+        from scripts.db_queries import search_users_by_index, search_users_by_fuzzy_term
+        results = search_users_by_index(DB_CONFIG, search_term, query_type=query_type)
+        match_mode = 'index'
+        # 识别出类型的标识只做索引查找；索引不可用（如尚未执行迁移）时返回None，此时退回包含匹配
+        if results is None or (not results and fuzzy and query_type is None):
+            results = search_users_by_fuzzy_term(DB_CONFIG, search_term)
+            match_mode = 'fuzzy'
+        
+        if results is None:
+            # 查询失败，不缓存
+            return jsonify({"status": "error", "message": f"未找到匹配 '{search_term}' 的用户信息"}), 404
         
-        if results and len(results) > 0:
+        if len(results) > 0:
             logging.info(f"找到 {len(results)} 个匹配的用户")
-            return jsonify({
+            payload, status_code = {
                 "status": "success", 
                 "users": results,  # 修改为 users 以匹配前端期望
-                "count": len(results)
-            })
+                "count": len(results),
+                "match_mode": match_mode,
+                "query_type": query_type.kind if query_type else 'text'
+            }, 200
         else:
             logging.warning(f"未找到匹配的用户: {search_term}")
-            return jsonify({
+            message = f"未找到匹配 '{search_term}' 的用户信息"
+            if not fuzzy and query_type is None:
+                message += "（可使用 fuzzy=1 进行包含匹配）"
+            payload, status_code = {
                 "status": "error", 
-                "message": f"未找到匹配 '{search_term}' 的用户信息"
-            }), 404
+                "message": message
+            }, 404
+        # 搜索结果（包括未找到）在任何数据写入后整体失效
+        READ_CACHE.set(cache_key, (payload, status_code), tags=[SEARCH_TAG], generation=cache_generation)
+        return jsonify(payload), status_code
             
     except Exception as e:
-        logging.error(f"模糊查找时出错: {e}")
+        logging.error(f"用户查找时出错: {e}")
         return jsonify({"status": "error", "message": "服务器内部错误"}), 500
 
 @app.route('/api/upload', methods=['POST'])
 def handle_upload():
-    """处理文件上传并执行ETL流程，带有完整的错误处理"""
+    """处理文件上传并提交后台ETL任务，带有完整的错误处理"""
     print("\n" + "+"*80)
     print("📥 收到新的文件上传请求")
     print("+"*80)
@@ -130,6 +201,40 @@ def handle_upload():
                 }
             }), 400
 
+        on_duplicate = request.form.get('on_duplicate', 'skip')
+        if on_duplicate not in DUPLICATE_UPLOAD_ACTIONS:
+            return jsonify({
+                "success": False,
+                "error": {
+                    "type": "INVALID_REQUEST",
+                    "title": "请求参数错误",
+                    "user_message": f"on_duplicate 不支持 '{on_duplicate}'",
+                    "suggestions": [f"可选值: {', '.join(DUPLICATE_UPLOAD_ACTIONS)}"]
+                }
+            }), 400
+        import_mode = request.form.get('import_mode', 'replace')
+        if import_mode not in IMPORT_MODES:
+            return jsonify({
+                "success": False,
+                "error": {
+                    "type": "INVALID_REQUEST",
+                    "title": "请求参数错误",
+                    "user_message": f"import_mode 不支持 '{import_mode}'",
+                    "suggestions": [f"可选值: {', '.join(IMPORT_MODES)}"]
+                }
+            }), 400
+        superseded_files = [name.strip() for name in request.form.getlist('supersedes') if name.strip()]
+        if import_mode == 'incremental' and not superseded_files:
+            return jsonify({
+                "success": False,
+                "error": {
+                    "type": "INVALID_REQUEST",
+                    "title": "请求参数错误",
+                    "user_message": "增量导入需要指定被取代的旧文件（supersedes）",
+                    "suggestions": ["supersedes 填写旧文件上传后的文件名，多个旧文件时重复该字段"]
+                }
+            }), 400
+
         print(f"📋 原始文件名: {original_filename}")
         print(f"🏢 选择平台: {company_full}")
         
@@ -169,43 +274,83 @@ def handle_upload():
                     }
                 }), 400
             
-            file.save(upload_file_path)
+            # 边写入磁盘边计算内容哈希，只读一遍上传数据
+            content_hash = save_stream_with_hash(file.stream, upload_file_path)
             print(f"✅ 文件已保存到: {upload_file_path}")
+            print(f"🔑 内容哈希: {content_hash}")
 
-            # 执行ETL流程
-            print("\n" + "~"*60)
-            print("🚀 开始ETL数据处理")
-            print("~"*60)
-            
-            success, result = run_etl_process_for_file(Path(upload_file_path), company_full)
-            
-            if success:
+            # 相同内容的文件已经成功处理过时，不再重复解析和写库
+            duplicate = None
+            if on_duplicate != 'reprocess':
+                duplicate = find_processed_file_by_hash(DB_CONFIG, content_hash,
+                                                        exclude_file_name=final_filename_for_upload)
+            if duplicate and on_duplicate == 'skip':
+                os.remove(upload_file_path)
+                print(f"⏭️ 与已处理文件 {duplicate['file_name']} 内容相同，跳过ETL")
                 return jsonify({
                     "success": True,
-                    "message": result,
+                    "message": f"相同内容的文件已处理过（{duplicate['record_count']} 条记录），已跳过重复处理",
                     "data": {
-                        "filename": final_filename_for_upload,
+                        "duplicate": True,
+                        "duplicate_of": duplicate['file_name'],
+                        "filename": duplicate['file_name'],
                         "original_filename": original_filename,
-                        "platform": company_full,
-                        "processed_at": timestamp_prefix
+                        "platform": duplicate['platform'] or company_full,
+                        "record_count": duplicate['record_count'],
+                        "content_hash": content_hash
                     }
-                })
+                }), 200
+
+            insert_file_metadata(DB_CONFIG, upload_file_path, original_filename, company_full,
+                                 content_hash=content_hash)
+
+            # 提交ETL任务到后台队列，立即返回任务ID
+            print("\n" + "~"*60)
+            print("🚀 提交ETL后台任务")
+            print("~"*60)
+            
+            job_metadata = {
+                "filename": final_filename_for_upload,
+                "original_filename": original_filename,
+                "platform": company_full,
+                "import_mode": import_mode
+            }
+            if import_mode == 'incremental':
+                job_metadata["supersedes"] = superseded_files
+            if duplicate:
+                # on_duplicate=relink：只把已有数据转移到新文件名
+                job_metadata["duplicate_of"] = duplicate['file_name']
+                job_id = etl_jobs.submit(
+                    relink_processed_file,
+                    Path(upload_file_path),
+                    duplicate['file_name'],
+                    metadata=job_metadata
+                )
             else:
-                # result是ETLError对象
-                if isinstance(result, ETLError):
-                    error_response = format_error_for_frontend(result)
-                    return jsonify(error_response), 500
-                else:
-                    # 兼容旧格式
-                    return jsonify({
-                        "success": False,
-                        "error": {
-                            "type": "PROCESSING_ERROR",
-                            "title": "处理失败",
-                            "user_message": str(result),
-                            "suggestions": ["请检查文件格式和内容", "联系技术支持"]
-                        }
-                    }), 500
+                job_id = etl_jobs.submit(
+                    run_etl_process_for_file,
+                    Path(upload_file_path),
+                    company_full,
+                    metadata=job_metadata,
+                    incremental=(import_mode == 'incremental'),
+                    superseded_files=superseded_files
+                )
+            print(f"📌 任务已提交: {job_id}")
+            
+            return jsonify({
+                "success": True,
+                "message": "文件与已处理的文件内容相同，正在转移已有数据" if duplicate else "文件已上传，正在后台处理",
+                "data": {
+                    "job_id": job_id,
+                    "status_url": f"/api/jobs/{job_id}",
+                    "filename": final_filename_for_upload,
+                    "original_filename": original_filename,
+                    "platform": company_full,
+                    "processed_at": timestamp_prefix,
+                    "content_hash": content_hash,
+                    "duplicate_of": duplicate['file_name'] if duplicate else None
+                }
+            }), 202
 
         except ETLError as e:
             # 处理我们自定义的ETL错误
@@ -247,6 +392,14 @@ def handle_upload():
             }
         }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """查询后台ETL任务的状态、当前阶段和行数统计"""
+    job = etl_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "任务不存在或已过期"}), 404
+    return jsonify({"status": "success", "job": job})
+
 @app.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     """安全的文件下载接口"""
@@ -278,19 +431,121 @@ def download_file(filename):
         logging.error(f"文件下载失败: {e}")
         return jsonify({"status": "error", "message": "下载失败"}), 500
 
+def _parse_non_negative_int(name: str):
+    """解析非负整数查询参数，未提供时返回None，格式错误时抛出ValueError"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    number = int(value)
+    if number < 0:
+        raise ValueError(f"{name} 不能为负数")
+    return number
+
+def _stream_mindmap_ndjson(user_id: str, tables: list, after_id: int = None, projection: dict = None):
+    """
+    以 NDJSON 逐行输出用户的全部记录，每行一个JSON对象：
+      {"table": "login_logs", "record": {...}}     各表的记录
+      {"table": "source_files", "record": {...}}   涉及的源文件元信息
+      {"end": true, "counts": {...}}               结束行（各表输出的条数）
+    读取出错时输出 {"end": true, "error": "..."} 作为最后一行。
+    """
+    counts = {table_name: 0 for table_name in tables}
+    source_files = set()
+    try:
+        for table_name, record in iter_user_records(DB_CONFIG, user_id, tables, after_id, projection):
+            counts[table_name] += 1
+            if record.get('source_file_name'):
+                source_files.add(record['source_file_name'])
+            yield app.json.dumps({"table": table_name, "record": record}) + "\n"
+        for metadata in get_source_files_metadata(DB_CONFIG, source_files):
+            yield app.json.dumps({"table": "source_files", "record": metadata}) + "\n"
+        yield app.json.dumps({"end": True, "counts": counts}) + "\n"
+    except Exception as e:
+        logging.error(f"流式输出用户数据失败: {e}")
+        yield app.json.dumps({"end": True, "error": "读取数据失败", "counts": counts}) + "\n"
+
 @app.route('/api/mindmap_data', methods=['GET'])
 def get_mindmap_data():
-    """获取指定用户的思维导图数据 - 返回所有5个表的数据"""
+    """
+    获取指定用户的思维导图数据 - 默认返回所有5个表的全部数据。
+    可选参数：
+      tables       逗号分隔的表名，只返回这些表（默认全部5个表）
+      limit        每张表每页的条数，提供时启用键集分页，响应中带 pagination
+      after_id     只返回 id 大于该值的记录（上一页的 next_after_id）
+      counts_only  1/true 时只返回各表的记录数
+      format       ndjson 时以换行分隔的JSON流式返回全部记录（支持 tables、after_id、fields）
+      fields       只返回指定的列，如 transactions:id,transaction_time;login_logs:login_ip，
+                   id 和 user_id 总是返回；extra_data 只在显式指定或 limit=1 时返回
+    """
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({"status": "error", "message": "缺少 user_id 参数"}), 400
     
-    # 获取包含所有表数据的字典
-    all_data = get_data_from_db(DB_CONFIG, user_id)
+    tables_param = request.args.get('tables')
+    tables = [name.strip() for name in tables_param.split(',') if name.strip()] if tables_param else list(MINDMAP_TABLES)
+    unknown_tables = [name for name in tables if name not in MINDMAP_TABLES]
+    if unknown_tables or not tables:
+        return jsonify({"status": "error",
+                        "message": f"不支持的表: {', '.join(unknown_tables)}，可选: {', '.join(MINDMAP_TABLES)}"}), 400
+    try:
+        limit = _parse_non_negative_int('limit')
+        after_id = _parse_non_negative_int('after_id')
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit 和 after_id 必须是非负整数"}), 400
+    if limit is not None and not 1 <= limit <= MINDMAP_MAX_PAGE_SIZE:
+        return jsonify({"status": "error", "message": f"limit 必须在 1 到 {MINDMAP_MAX_PAGE_SIZE} 之间"}), 400
+    try:
+        projection = parse_fields_param(request.args.get('fields'), tables, single_row=(limit == 1))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(_stream_mindmap_ndjson(user_id, tables, after_id, projection)),
+                        mimetype='application/x-ndjson')
+    
+    # 只统计各表记录数（走 user_id 索引，不传输记录内容）
+    if request.args.get('counts_only', '').lower() in ('1', 'true', 'yes'):
+        counts = count_user_rows(DB_CONFIG, user_id, tables)
+        if counts is None:
+            return jsonify({"status": "error", "message": "无法从数据库获取数据"}), 500
+        return jsonify({"status": "success", "counts": counts, "total": sum(counts.values())})
+    
+    # 分页、部分表或列投影：每页都是一次索引范围查询，不缓存（其他文件的增删会改变页的边界）
+    if limit is not None or after_id is not None or tables != list(MINDMAP_TABLES) or projection is not None:
+        page_data, pagination = get_data_page_from_db(
+            DB_CONFIG, user_id, tables, limit or MINDMAP_MAX_PAGE_SIZE, after_id, projection
+        )
+        if page_data is None:
+            return jsonify({"status": "error", "message": "无法从数据库获取数据或数据为空"}), 404
+        return jsonify({"status": "success", "data": page_data, "pagination": pagination})
+    
+    cache_key = ('mindmap', user_id)
+    hit, all_data = READ_CACHE.get(cache_key)
+    if not hit:
+        # 读库前取得缓存代数：读取期间该用户或相关文件的数据被失效时，不缓存本次结果
+        cache_generation = READ_CACHE.generation()
+        # 获取包含所有表数据的字典
+        all_data = get_data_from_db(DB_CONFIG, user_id)
+        if all_data is not None:
+            # 标签：该用户 + 数据来源的每个文件，写入/删除时按用户或文件精确失效
+            source_files = {
+                record['source_file_name']
+                for table_name, records in all_data.items() if table_name != 'source_files'
+                for record in records if record.get('source_file_name')
+            }
+            READ_CACHE.set(cache_key, all_data,
+                           tags=[user_tag(user_id)] + [file_tag(name) for name in source_files],
+                           generation=cache_generation)
+    
     if all_data is not None:
         return jsonify({"status": "success", "data": all_data})
     else:
         return jsonify({"status": "error", "message": "无法从数据库获取数据或数据为空"}), 404
 
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """查询结果缓存的命中/未命中统计"""
+    return jsonify({"status": "success", "cache": READ_CACHE.stats()})
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
@@ -17,12 +17,15 @@ CREATE TABLE IF NOT EXISTS file_metadata (
     record_count INT DEFAULT 0,
     processed_time TIMESTAMP NULL,
     status ENUM('uploaded', 'processing', 'processed', 'error') DEFAULT 'uploaded',
+    content_hash CHAR(64) NULL,
+    error_message TEXT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_file_name (file_name),
     INDEX idx_platform (platform),
     INDEX idx_status (status),
-    INDEX idx_upload_time (upload_time)
+    INDEX idx_upload_time (upload_time),
+    INDEX idx_content_hash (content_hash)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
 """
 
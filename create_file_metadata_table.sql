@@ -11,6 +11,8 @@ CREATE TABLE IF NOT EXISTS file_metadata (
     processed_time TIMESTAMP NULL,
     record_count INT DEFAULT 0,
     status ENUM('uploaded', 'processing', 'processed', 'error') DEFAULT 'uploaded',
+    content_hash CHAR(64) NULL,
+    error_message TEXT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
@@ -19,3 +21,4 @@ CREATE TABLE IF NOT EXISTS file_metadata (
 CREATE INDEX idx_file_name ON file_metadata(file_name);
 CREATE INDEX idx_upload_time ON file_metadata(upload_time);
 CREATE INDEX idx_platform ON file_metadata(platform);
+CREATE INDEX idx_content_hash ON file_metadata(content_hash);
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史调证数据批量导入脚本
+
+遍历目录（如 141数据调证数据/、uploads/），对每个 Excel/CSV 文件识别平台后执行完整ETL，
+多个文件在进程池中并行处理，结束时输出吞吐汇总（文件/分钟、行/秒、失败列表）。
+
+平台识别顺序：
+1. --platform 指定
+2. 文件名（utils.determine_company_from_filename）
+3. Excel 工作表目录与模板签名比对（template_index.detect_platform_by_sheet_names）
+4. 以上都无法识别时，依次尝试各平台的模板（所在目录名中包含平台标识的优先；
+   模板不匹配发生在写库之前，不会留下数据）
+
+内容完全相同的文件（SHA-256 相同）只处理一次；已成功处理过的文件默认跳过。
+同名但内容不同的文件会写入同一个 source_file_name，互相覆盖，因此只处理第一个并报告冲突。
+
+用法：
+    python scripts/backfill.py 141数据调证数据 uploads --workers 4
+    python scripts/backfill.py uploads --dry-run
+    python scripts/backfill.py uploads --incremental --reprocess
+"""
+import os
+import sys
+import io
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+# 模板路径是相对项目根目录的，加载模板前切换工作目录；命令行中的相对目录按调用时的目录解析
+invocation_dir = os.getcwd()
+os.chdir(project_root)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    # 启动时加载并预编译全部模板（输出较多，这里不显示）；fork 出的子进程直接继承
+    from scripts.main import run_etl_process_for_file, DB_CONFIG, TEMPLATE_REGISTRY, TEMPLATE_SIGNATURE_INDEX
+from scripts.error_handler import ETLError, ErrorType
+from scripts.file_metadata import compute_file_hash, insert_file_metadata, find_processed_file_by_hash, update_file_status
+from scripts.sheet_cache import SheetCache
+from scripts.template_index import detect_platform_by_sheet_names
+from scripts.utils import determine_company_from_filename
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def find_input_files(directories: list) -> list:
+    """递归查找待导入的文件，跳过 Excel 临时文件（~$ 开头）和隐藏文件"""
+    files = []
+    for directory in directories:
+        for path in sorted(Path(invocation_dir, directory).resolve().rglob('*')):
+            if not path.is_file() or path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            if path.name.startswith(('~$', '.')):
+                continue
+            files.append(path)
+    return files
+
+
+def detect_platform(file_path: Path):
+    """
+    根据文件名、Excel 工作表目录识别平台，无法识别时返回None。
+    文件名中没有平台标识的CSV不直接归为通用CSV模板，交给 _fallback_platforms 先尝试各平台的专用模板。
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        platform = determine_company_from_filename(file_path, TEMPLATE_REGISTRY)
+    if platform == 'csv':
+        return None
+    if platform or file_path.suffix.lower() not in ('.xlsx', '.xls'):
+        return platform
+    sheet_cache = SheetCache(file_path)
+    try:
+        return detect_platform_by_sheet_names(TEMPLATE_SIGNATURE_INDEX, sheet_cache.sheet_names())
+    except Exception:
+        return None
+    finally:
+        sheet_cache.close()
+
+
+def _fallback_platforms(file_path: Path) -> list:
+    """
+    无法识别平台时依次尝试的平台：
+    所在目录名中包含平台标识的优先（调证数据通常按平台分目录存放，如 .../TokenPocket/xxx.csv），
+    CSV 最后尝试通用CSV模板，Excel 文件不尝试。
+    """
+    directory_names = str(file_path.parent).lower()
+    platforms = sorted(
+        (platform for platform in TEMPLATE_REGISTRY if platform != 'csv'),
+        key=lambda platform: platform not in directory_names
+    )
+    if file_path.suffix.lower() == '.csv' and 'csv' in TEMPLATE_REGISTRY:
+        platforms.append('csv')
+    return platforms
+
+
+def process_file(file_path: str, platform: str = None, incremental: bool = False, verbose: bool = False) -> dict:
+    """
+    在子进程中处理单个文件，返回可序列化的结果:
+    {file, platform, success, message, rows_extracted, rows_written, seconds}
+    """
+    file_path = Path(file_path)
+    counts = {'rows_extracted': 0, 'rows_written': 0}
+
+    def progress_callback(stage, **stage_counts):
+        for key in counts:
+            if key in stage_counts:
+                counts[key] = stage_counts[key]
+
+    start = time.perf_counter()
+    candidates = [platform] if platform else _fallback_platforms(file_path)
+    # 没有可尝试的平台时（如只注册了通用CSV模板、而文件是Excel）直接报告失败
+    success, result, candidate = False, "没有可尝试的平台模板", None
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        for candidate in candidates:
+            success, result = run_etl_process_for_file(file_path, progress_callback=progress_callback,
+                                                       incremental=incremental, platform=candidate)
+            # 模板不匹配时换下一个平台尝试，其他错误（数据库、数据内容等）直接报告
+            if success or not isinstance(result, ETLError) or result.error_type != ErrorType.TEMPLATE_MISMATCH:
+                break
+
+    if success:
+        message = result
+    elif isinstance(result, ETLError):
+        message = result.message
+        if len(candidates) > 1 and result.error_type == ErrorType.TEMPLATE_MISMATCH:
+            message = f"无法识别平台，尝试了 {len(candidates)} 个平台的模板均不匹配"
+    else:
+        message = str(result)
+    return {
+        'file': str(file_path),
+        'platform': candidate,
+        'success': success,
+        'message': message,
+        'rows_extracted': counts['rows_extracted'],
+        'rows_written': counts['rows_written'],
+        'seconds': time.perf_counter() - start
+    }
+
+
+def plan_backfill(files: list, forced_platform: str = None, reprocess: bool = False):
+    """
+    计算哈希、识别平台并排除重复文件。
+    返回 (待处理 [(路径, 平台, 哈希)], 跳过 [(路径, 原因)], 失败 [(路径, 原因)])
+    """
+    tasks, skipped, failed = [], [], []
+    seen_hashes = {}   # 哈希 -> 本批次中第一个文件
+    seen_names = {}    # 文件名 -> 本批次中第一个文件
+    for file_path in files:
+        content_hash = compute_file_hash(file_path)
+        if content_hash in seen_hashes:
+            skipped.append((file_path, f"与 {seen_hashes[content_hash]} 内容相同"))
+            continue
+        seen_hashes[content_hash] = file_path
+
+        if file_path.name in seen_names:
+            failed.append((file_path, f"与 {seen_names[file_path.name]} 同名但内容不同，会覆盖其数据"))
+            continue
+        seen_names[file_path.name] = file_path
+
+        if not reprocess:
+            duplicate = find_processed_file_by_hash(DB_CONFIG, content_hash)
+            if duplicate is not None:
+                skipped.append((file_path, f"已处理过（{duplicate['file_name']}，{duplicate['record_count']} 条记录）"))
+                continue
+
+        tasks.append((file_path, forced_platform or detect_platform(file_path), content_hash))
+    return tasks, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入目录中的历史调证数据')
+    parser.add_argument('directories', nargs='+', help='要导入的目录（递归查找 .xlsx/.xls/.csv）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'并行处理的进程数（默认 {DEFAULT_WORKERS}）')
+    parser.add_argument('--platform', choices=list(TEMPLATE_REGISTRY.keys()), help='指定所有文件的平台，不自动识别')
+    parser.add_argument('--incremental', action='store_true', help='增量导入：只与同名文件上次导入的数据比较（见 incremental.py）')
+    parser.add_argument('--reprocess', action='store_true', help='已成功处理过的文件也重新处理')
+    parser.add_argument('--dry-run', action='store_true', help='只列出识别结果，不导入')
+    parser.add_argument('--verbose', action='store_true', help='显示每个文件的完整ETL输出')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers 必须大于 0")
+
+    files = find_input_files(args.directories)
+    print(f"📂 找到 {len(files)} 个待导入文件")
+    tasks, skipped, failed = plan_backfill(files, args.platform, args.reprocess)
+    for file_path, reason in skipped:
+        print(f"  ⏭️ 跳过 {file_path}: {reason}")
+    for file_path, reason in failed:
+        print(f"  ❌ {file_path}: {reason}")
+    for file_path, platform, _ in tasks:
+        print(f"  📄 {file_path} → {platform or '未识别（将逐个平台尝试模板）'}")
+    if args.dry_run or not tasks:
+        return
+
+    for file_path, platform, content_hash in tasks:
+        insert_file_metadata(DB_CONFIG, file_path, platform=platform, content_hash=content_hash)
+
+    print(f"\n🚀 使用 {args.workers} 个进程导入 {len(tasks)} 个文件...")
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(process_file, str(file_path), platform, args.incremental, args.verbose): file_path
+            for file_path, platform, _ in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'file': str(futures[future]), 'platform': None, 'success': False, 'message': str(e),
+                          'rows_extracted': 0, 'rows_written': 0, 'seconds': 0.0}
+            results.append(result)
+            if not result['success']:
+                # ETL内部出错时已标记为 error；这里覆盖平台无法识别、进程异常等在ETL之外的失败
+                update_file_status(DB_CONFIG, Path(result['file']).name, 'error', result['message'])
+            status = "✅" if result['success'] else "❌"
+            print(f"  {status} [{len(results)}/{len(tasks)}] {result['file']} ({result['platform']}): "
+                  f"{result['rows_written']} 行, {result['seconds']:.1f} 秒")
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result['success']]
+    failures = [(result['file'], result['message']) for result in results if not result['success']]
+    failures += [(str(file_path), reason) for file_path, reason in failed]
+    rows_written = sum(result['rows_written'] for result in results)
+
+    print("\n" + "=" * 60)
+    print("📊 批量导入汇总")
+    print("=" * 60)
+    print(f"文件: 成功 {len(succeeded)}，失败 {len(failures)}，跳过 {len(skipped)}")
+    print(f"写入: {rows_written} 行，耗时 {elapsed:.1f} 秒")
+    if elapsed > 0:
+        print(f"吞吐: {len(results) / elapsed * 60:.1f} 文件/分钟，{rows_written / elapsed:.0f} 行/秒")
+    if failures:
+        print("\n失败文件:")
+        for file_name, message in failures:
+            print(f"  ❌ {file_name}: {message}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+写库方式吞吐对比脚本
+
+对 transactions / asset_movements 两张核心表，分别用 utils.WRITE_METHODS 中的各写库方式
+写入同样的模拟数据，输出每种方式的 行/秒。
+测试在临时表（CREATE TABLE ... LIKE 原表）中进行，结束后删除，不影响正式数据。
+
+用法：
+    python scripts/bench_db_write.py --rows 50000
+    python scripts/bench_db_write.py --rows 20000 --methods to_sql,multi
+"""
+import os
+import sys
+import time
+import argparse
+import json
+from decimal import Decimal
+
+import pandas as pd
+from sqlalchemy import text
+
+# 添加项目根目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from scripts.db_setup import DB_CONFIG
+from scripts.utils import WRITE_METHODS, get_db_engine, write_df_to_db
+
+BENCH_TABLES = ['transactions', 'asset_movements']
+BENCH_FILE_NAME = 'bench_db_write.csv'
+
+
+def build_transactions_frame(rows: int) -> pd.DataFrame:
+    """生成与ETL输出结构一致的模拟交易记录"""
+    times = pd.date_range('2024-01-01', periods=rows, freq='s')
+    return pd.DataFrame({
+        'source': 'Bench',
+        'user_id': [f"U{i % 500:06d}" for i in range(rows)],
+        'transaction_id': [f"T{i:012d}" for i in range(rows)],
+        'transaction_time': times,
+        'transaction_type': '现货',
+        'direction': ['买入' if i % 2 else '卖出' for i in range(rows)],
+        'base_asset': 'BTC',
+        'quote_asset': 'USDT',
+        'price': [Decimal('43000.12') + i % 100 for i in range(rows)],
+        'quantity': [Decimal('0.00123456') * (i % 7 + 1) for i in range(rows)],
+        'total_amount': [Decimal('53.0848') * (i % 7 + 1) for i in range(rows)],
+        'fee': Decimal('0.0001'),
+        'fee_asset': 'BNB',
+        'source_file_name': BENCH_FILE_NAME,
+        'extra_data': [json.dumps({'订单号': f"O{i}", '备注': '模拟\t数据'}, ensure_ascii=False) for i in range(rows)],
+    })
+
+
+def build_asset_movements_frame(rows: int) -> pd.DataFrame:
+    """生成与ETL输出结构一致的模拟充提记录"""
+    times = pd.date_range('2024-01-01', periods=rows, freq='s')
+    return pd.DataFrame({
+        'source': 'Bench',
+        'user_id': [f"U{i % 500:06d}" for i in range(rows)],
+        'direction': ['充值' if i % 3 else '提现' for i in range(rows)],
+        'asset': 'USDT',
+        'quantity': [Decimal('100.5') + i % 1000 for i in range(rows)],
+        'address': [f"T{i:033d}" for i in range(rows)],
+        'txid': [f"{i:064x}" for i in range(rows)],
+        'network': 'TRC20',
+        'transaction_time': times,
+        'status': [None if i % 10 == 0 else '成功' for i in range(rows)],
+        'source_file_name': BENCH_FILE_NAME,
+        'extra_data': [json.dumps({'备注': f"第{i}条"}, ensure_ascii=False) for i in range(rows)],
+    })
+
+
+FRAME_BUILDERS = {
+    'transactions': build_transactions_frame,
+    'asset_movements': build_asset_movements_frame,
+}
+
+
+def bench_one(engine, table: str, df: pd.DataFrame, method: str) -> float:
+    """在临时表中用指定方式写入一次，返回耗时（秒）"""
+    bench_table = f"bench_{table}"
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS `{bench_table}`"))
+        connection.execute(text(f"CREATE TABLE `{bench_table}` LIKE `{table}`"))
+    try:
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            write_df_to_db(df, bench_table, DB_CONFIG, connection=connection, method=method)
+        elapsed = time.perf_counter() - start
+
+        with engine.connect() as connection:
+            written = connection.execute(text(f"SELECT COUNT(*) FROM `{bench_table}`")).scalar()
+        if written != len(df):
+            print(f"    ⚠️ 写入行数不一致: 期望 {len(df)}，实际 {written}")
+        return elapsed
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS `{bench_table}`"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比各写库方式在核心表上的吞吐（行/秒）')
+    parser.add_argument('--rows', type=int, default=20000, help='每张表写入的模拟行数')
+    parser.add_argument('--methods', default=','.join(WRITE_METHODS),
+                        help=f"逗号分隔的写库方式，可选: {', '.join(WRITE_METHODS)}")
+    args = parser.parse_args()
+
+    methods = [method.strip() for method in args.methods.split(',') if method.strip()]
+    unknown = [method for method in methods if method not in WRITE_METHODS]
+    if unknown:
+        parser.error(f"不支持的写库方式: {', '.join(unknown)}")
+
+    engine = get_db_engine(DB_CONFIG, allow_local_infile='load_data' in methods)
+    results = []
+    for table in BENCH_TABLES:
+        df = FRAME_BUILDERS[table](args.rows)
+        for method in methods:
+            print(f"\n🚀 {table} / {method}: 写入 {len(df)} 行")
+            try:
+                elapsed = bench_one(engine, table, df, method)
+                results.append((table, method, elapsed, len(df) / elapsed if elapsed else float('inf')))
+            except Exception as e:
+                print(f"    ❌ 失败: {e}")
+                results.append((table, method, None, None))
+
+    print("\n" + "=" * 60)
+    print(f"📊 写库吞吐对比（每表 {args.rows} 行）")
+    print("=" * 60)
+    print(f"{'表':<18}{'方式':<12}{'耗时(秒)':>12}{'行/秒':>14}")
+    for table, method, elapsed, rate in results:
+        if elapsed is None:
+            print(f"{table:<18}{method:<12}{'失败':>12}{'-':>14}")
+        else:
+            print(f"{table:<18}{method:<12}{elapsed:>12.2f}{rate:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# scripts/csv_sniffer.py - CSV编码与格式（分隔符、引号）探测
+# 只读取文件开头的一小段字节，一次完成 BOM 检查、UTF-8/GBK 有效性判断和分隔符探测，
+# 结果按"前缀哈希 + 文件大小"缓存，直接作为 pd.read_csv 的参数使用。
+import csv
+import hashlib
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+# 探测时读取的字节数
+SNIFF_BYTES = 16 * 1024
+
+# 候选分隔符（按优先级）和默认分隔符
+CANDIDATE_DELIMITERS = ',\t;|'
+DEFAULT_DELIMITER = ','
+
+# BOM → 编码
+BOM_ENCODINGS = [
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+]
+
+# 无BOM时依次尝试的编码；latin1 可以解码任意字节，作为最后的兜底
+CANDIDATE_ENCODINGS = ['utf-8', 'gbk', 'latin1']
+
+# 最多缓存的探测结果数量
+MAX_CACHED_FORMATS = 256
+
+
+class CsvFormat(NamedTuple):
+    """CSV文件的编码和格式"""
+    encoding: str
+    delimiter: str
+    quotechar: str
+
+    def reader_kwargs(self) -> dict:
+        """转换为 pd.read_csv 的参数"""
+        return {'encoding': self.encoding, 'sep': self.delimiter, 'quotechar': self.quotechar}
+
+
+_format_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _decodes_cleanly(data: bytes, encoding: str, at_eof: bool) -> bool:
+    """判断字节串能否按指定编码严格解码；未读到文件末尾时，允许末尾被截断的多字节字符"""
+    max_cut = 0 if at_eof else 3
+    for cut in range(max_cut + 1):
+        try:
+            data[:len(data) - cut].decode(encoding)
+            return True
+        except UnicodeDecodeError as e:
+            # 只有错误出现在末尾几个字节时，才值得再截掉一个字节重试
+            if e.start < len(data) - max_cut:
+                return False
+    return False
+
+
+def _detect_encoding(prefix: bytes, at_eof: bool) -> str:
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    for encoding in CANDIDATE_ENCODINGS:
+        if _decodes_cleanly(prefix, encoding, at_eof):
+            return encoding
+    return 'utf-8'
+
+
+def _detect_dialect(text: str, at_eof: bool):
+    """用 csv.Sniffer 在完整的行上探测分隔符和引号，失败时使用默认值"""
+    lines = text.splitlines()
+    if not at_eof and len(lines) > 1:
+        lines = lines[:-1]  # 最后一行可能被截断
+    sample = '\n'.join(lines)
+    if not sample.strip():
+        return DEFAULT_DELIMITER, '"'
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=CANDIDATE_DELIMITERS)
+        return dialect.delimiter, dialect.quotechar or '"'
+    except csv.Error:
+        return DEFAULT_DELIMITER, '"'
+
+
+def sniff_csv_format(file_path: Path) -> CsvFormat:
+    """读取文件开头 SNIFF_BYTES 字节，探测编码、分隔符和引号；同一内容的文件只探测一次"""
+    file_path = Path(file_path)
+    file_size = file_path.stat().st_size
+    with open(file_path, 'rb') as f:
+        prefix = f.read(SNIFF_BYTES)
+    at_eof = len(prefix) >= file_size
+
+    cache_key = (hashlib.sha1(prefix).hexdigest(), file_size)
+    with _cache_lock:
+        cached = _format_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    encoding = _detect_encoding(prefix, at_eof)
+    text = prefix.decode(encoding, errors='ignore')
+    delimiter, quotechar = _detect_dialect(text, at_eof)
+    csv_format = CsvFormat(encoding=encoding, delimiter=delimiter, quotechar=quotechar)
+
+    with _cache_lock:
+        if len(_format_cache) >= MAX_CACHED_FORMATS:
+            _format_cache.clear()
+        _format_cache[cache_key] = csv_format
+    return csv_format
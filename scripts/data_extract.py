@@ -1,9 +1,20 @@
 # data_extract.py - 数据处理车间 (V8 - 完整支持CSV的4种识别方法)
 
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_integer_dtype
 import json
+import re
 from decimal import Decimal
+from typing import Any, NamedTuple
+from .sheet_cache import SheetCache, build_cell_value_index
+from .csv_sniffer import CsvFormat, sniff_csv_format
+
+# --- 可选数据源（为空或缺失时不导致整个处理失败） ---
+OPTIONAL_SOURCE_IDS = ['p2p_trade_raw', 'otc_trade_raw', 'margin_trade_raw', 'pay_trade_raw']
 
 # --- 辅助函数 (保持不变) ---
 def find_field_from_aliases(columns, aliases):
@@ -14,20 +25,25 @@ def find_field_from_aliases(columns, aliases):
 
 # --- 高级解析工具 (新增一个 + 优化一个) ---
 
-def _find_subtable_start_row(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int) -> int:
+def _find_subtable_start_row(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int,
+                             cell_index: dict = None) -> int:
     """
-    (V3 - "多路标"版) 
+    (V4 - "索引"版) 
     在工作表中，根据一个"路标"别名列表，依次尝试寻找，并返回第一个匹配到的子表的表头行号。
+    cell_index: 单元格值索引 {值: (行, 列)}（见 sheet_cache.build_cell_value_index），
+                未提供时现场构建一次；每个路标的查找只是一次字典命中。
     """
+    if cell_index is None:
+        cell_index = build_cell_value_index(sheet_df)
+
     # --- 核心升级：遍历"路标"列表 ---
     for header in section_header_aliases:
         print(f"  - 尝试定位路标: '{header}'...")
-        matches = sheet_df.stack() == header
-        true_matches = matches[matches].index
+        position = cell_index.get(header)
 
-        if len(true_matches) > 0:
+        if position is not None:
             # 只要找到了第一个，就立刻返回结果，不再继续寻找！
-            header_row_index = true_matches[0][0]
+            header_row_index = position[0]
             print(f"    ✅ 成功！在第 {header_row_index} 行找到了精确匹配的路标。")
             return header_row_index + header_offset
     
@@ -35,12 +51,13 @@ def _find_subtable_start_row(sheet_df: pd.DataFrame, section_header_aliases: lis
     print(f"  - 🟡 警告: 在工作表中未能找到任何一个指定的路标: {section_header_aliases}。")
     return None
 
-def _parse_tabular_subtable(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int) -> pd.DataFrame:
+def _parse_tabular_subtable(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int,
+                            cell_index: dict = None) -> pd.DataFrame:
     """
     (V2 - 智能结束版) 
     解析一个标准的多行子表。能够通过寻找全空行来智能判断子表的结束位置。
     """
-    header_row = _find_subtable_start_row(sheet_df, section_header_aliases, header_offset)
+    header_row = _find_subtable_start_row(sheet_df, section_header_aliases, header_offset, cell_index)
     if header_row is None:
         return pd.DataFrame()
     
@@ -61,15 +78,16 @@ def _parse_tabular_subtable(sheet_df: pd.DataFrame, section_header_aliases: list
     else:
         actual_data = potential_data
         
-    sub_table = actual_data.copy()
+    sub_table = actual_data.copy(deep=False)  # 只重新标记列名和行号，不复制数据
     sub_table.columns = sheet_df.iloc[header_row].values
     sub_table.reset_index(drop=True, inplace=True)
     sub_table.dropna(how='all', inplace=True)
     
     return sub_table
 
-def _parse_form_subtable(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int) -> dict:
-    header_row = _find_subtable_start_row(sheet_df, section_header_aliases, header_offset)
+def _parse_form_subtable(sheet_df: pd.DataFrame, section_header_aliases: list, header_offset: int,
+                         cell_index: dict = None) -> dict:
+    header_row = _find_subtable_start_row(sheet_df, section_header_aliases, header_offset, cell_index)
     if header_row is None: 
         return {}
     
@@ -82,59 +100,89 @@ def _parse_form_subtable(sheet_df: pd.DataFrame, section_header_aliases: list, h
     
     return form_data
 
+def _to_native(value):
+    """与 Series.to_dict() 对 object 列的处理一致：numpy 标量转为 Python 原生类型，pd.NA 转为 None"""
+    if isinstance(value, np.datetime64):
+        return pd.Timestamp(value)
+    if isinstance(value, np.timedelta64):
+        return pd.Timedelta(value)
+    if isinstance(value, (np.bool_, np.integer, np.floating)):
+        return value.item()
+    if value is pd.NA:
+        return None
+    return value
+
 def _parse_merged_key_value(sheet_df: pd.DataFrame, config: dict) -> pd.DataFrame:
+    """
+    (V2 - 一次分组版)
+    解析合并单元格+键值对的三维表：merged_columns 向下填充后作为分组键，
+    每组的 key_column/value_column 组成该记录的 extra_data 字典。
+    所有分组的 extra_data 在一次遍历中构建，结果与逐组 set_index(...).to_dict() 完全相同：
+    分组按键排序、含空值的分组被丢弃、重复的键以最后一次出现的值为准。
+    调用方需传入可修改的副本（浅拷贝即可，这里只替换整列）。
+    """
     merged_cols = config['merged_columns']
     key_col = config['key_column']
     value_col = config['value_column']
     
-    sheet_df[merged_cols] = sheet_df[merged_cols].fillna(method='ffill')
+    sheet_df[merged_cols] = sheet_df[merged_cols].ffill()
     sheet_df.dropna(subset=[merged_cols[0]], inplace=True)
+    if sheet_df.empty:
+        return pd.DataFrame()
     
-    output_records = []
-    for group_keys, group_df in sheet_df.groupby(merged_cols):
-        record = dict(zip(merged_cols, group_keys))
-        extra_data = group_df[[key_col, value_col]].dropna(subset=[key_col]).set_index(key_col).to_dict()[value_col]
-        
-        # print(f"\n--- [诊断探针#1A] 解析器为设备 '{record.get('Device Name 设备名称')}' 生成的 extra_data ---")
-        # print(extra_data)
-        
-        record['extra_data'] = extra_data
-        output_records.append(record)
-        
-    final_df = pd.DataFrame(output_records)
+    # 每行所属分组的序号（与 groupby 的迭代顺序一致），含空值的分组为 -1
+    group_ids = sheet_df.groupby(merged_cols).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    in_group = np.flatnonzero(group_ids >= 0)
+    if in_group.size == 0:
+        return pd.DataFrame()
     
-    # print(f"\n--- [诊断探针#1B] 解析器最终生成的DataFrame预览 (应包含extra_data列) ---")
-    # print(final_df.head().to_string())
+    # 每个分组第一行的合并列取值即为分组键
+    _, first_offsets = np.unique(group_ids[in_group], return_index=True)
+    first_rows = in_group[first_offsets]
+    group_keys = zip(*(sheet_df[col].iloc[first_rows].tolist() for col in merged_cols))
+    output_records = [dict(zip(merged_cols, keys)) for keys in group_keys]
     
-    return final_df
+    # 一次遍历构建所有分组的 extra_data
+    extra_data_list = [{} for _ in output_records]
+    has_key = (group_ids >= 0) & sheet_df[key_col].notna().to_numpy()
+    key_values = sheet_df[key_col][has_key].tolist()
+    value_series = sheet_df[value_col][has_key]
+    value_values = value_series.tolist()
+    if value_series.dtype == object:
+        value_values = [_to_native(value) for value in value_values]
+    for group_id, key, value in zip(group_ids[has_key].tolist(), key_values, value_values):
+        extra_data_list[group_id][key] = value
+    
+    for record, extra_data in zip(output_records, extra_data_list):
+        record['extra_data'] = extra_data
+        
+    return pd.DataFrame(output_records)
+
+# --- CSV专用解析函数 ---
 
-# --- CSV编码检测函数 ---
-def _detect_csv_encoding(file_path: Path) -> str:
+def _tabular_view_csv(csv_df: pd.DataFrame, header_row: int) -> pd.DataFrame:
     """
-    检测CSV文件的编码格式
+    标准表格数据源：以 header_row 行作为表头，返回其后各行的视图。
+    与原始数据共享底层数组（只重新标记列名和行号），只有存在全空行需要剔除时才产生副本。
+    多个数据源引用同一个CSV时，内存占用不随数据源数量增长。
     """
-    # 常见的编码列表，按优先级排序
-    encodings = ['utf-8', 'gbk', 'gb2312', 'latin1', 'cp1252']
-    
-    for encoding in encodings:
-        try:
-            # 尝试读取前几行来验证编码
-            with open(file_path, 'r', encoding=encoding) as f:
-                f.read(1000)  # 读取前1000个字符测试
-            return encoding
-        except (UnicodeDecodeError, UnicodeError):
-            continue
-    
-    # 如果都失败了，返回默认编码
-    return 'utf-8'
+    if header_row >= len(csv_df):
+        return pd.DataFrame()
 
-# --- CSV专用解析函数 ---
+    df = csv_df.iloc[header_row + 1:].copy(deep=False)
+    df.columns = csv_df.iloc[header_row].values  # 设置表头
+    df.index = pd.RangeIndex(len(df))            # 与 reset_index(drop=True) 相同
+    empty_rows = df.isna().all(axis=1)
+    if empty_rows.any():
+        df = df[~empty_rows]  # 清理空行
+    return df
 
-def _parse_form_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: list, header_offset: int) -> dict:
+def _parse_form_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: list, header_offset: int,
+                             cell_index: dict = None) -> dict:
     """
     CSV版本的表单解析函数
     """
-    header_row = _find_subtable_start_row(csv_df, section_header_aliases, header_offset)
+    header_row = _find_subtable_start_row(csv_df, section_header_aliases, header_offset, cell_index)
     if header_row is None: 
         return {}
     
@@ -149,11 +197,12 @@ def _parse_form_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: list,
     
     return form_data
 
-def _parse_tabular_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: list, header_offset: int) -> pd.DataFrame:
+def _parse_tabular_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: list, header_offset: int,
+                                cell_index: dict = None) -> pd.DataFrame:
     """
     CSV版本的动态子表解析函数
     """
-    header_row = _find_subtable_start_row(csv_df, section_header_aliases, header_offset)
+    header_row = _find_subtable_start_row(csv_df, section_header_aliases, header_offset, cell_index)
     if header_row is None:
         return pd.DataFrame()
     
@@ -173,7 +222,7 @@ def _parse_tabular_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: li
     else:
         actual_data = potential_data
         
-    sub_table = actual_data.copy()
+    sub_table = actual_data.copy(deep=False)  # 只重新标记列名和行号，不复制数据
     sub_table.columns = csv_df.iloc[header_row].values
     sub_table.reset_index(drop=True, inplace=True)
     sub_table.dropna(how='all', inplace=True)
@@ -182,46 +231,293 @@ def _parse_tabular_subtable_csv(csv_df: pd.DataFrame, section_header_aliases: li
 
 def _parse_merged_key_value_csv(csv_df: pd.DataFrame, config: dict) -> pd.DataFrame:
     """
-    CSV版本的复杂三维表解析函数
+    CSV版本的复杂三维表解析函数：先按 header_row 设置列名，再交给通用解析器
     """
-    merged_cols = config['merged_columns']
-    key_col = config['key_column']
-    value_col = config['value_column']
-    
     # 先设置正确的列名
     if 'header_row' in config:
         header_row = config['header_row'] - 1
         csv_df.columns = csv_df.iloc[header_row].values
         csv_df = csv_df.iloc[header_row + 1:].reset_index(drop=True)
     
-    csv_df[merged_cols] = csv_df[merged_cols].fillna(method='ffill')
-    csv_df.dropna(subset=[merged_cols[0]], inplace=True)
-    
-    output_records = []
-    for group_keys, group_df in csv_df.groupby(merged_cols):
-        record = dict(zip(merged_cols, group_keys))
-        extra_data = group_df[[key_col, value_col]].dropna(subset=[key_col]).set_index(key_col).to_dict()[value_col]
-        
-        # print(f"\n--- [CSV诊断探针#1A] 解析器为设备 '{record.get('Device Name 设备名称')}' 生成的 extra_data ---")
-        # print(extra_data)
-        
-        record['extra_data'] = extra_data
-        output_records.append(record)
-        
-    final_df = pd.DataFrame(output_records)
+    return _parse_merged_key_value(csv_df, config)
+
+# --- 大文件流式读取（仅限全部为 tabular 布局的数据源） ---
+
+def is_streamable_tabular_sources(sources_config: list) -> bool:
+    """所有数据源都是 tabular 布局且表头行相同时，才能按数据块流式处理"""
+    if not sources_config:
+        return False
+    layouts = {source.get('data_layout', 'tabular') for source in sources_config}
+    header_rows = {source.get('header_row', 1) for source in sources_config}
+    return layouts == {'tabular'} and len(header_rows) == 1
+
+def iter_tabular_csv_chunks(csv_path: Path, sources_config: list, chunk_rows: int, csv_format: CsvFormat = None):
+    """
+    流式读取 tabular 布局的CSV文件，每次产出 {source_id: 数据块DataFrame}。
+    表头、去除空行的规则与整表读取时相同；为了避免各数据块单独推断出不同的列类型，
+    所有单元格按字符串读取（整表读取时含表头的列本来也是字符串）。
+    同一数据块在各数据源之间共享，调用方不应原地修改。
+    """
+    if csv_format is None:
+        csv_format = sniff_csv_format(csv_path)
+    rows_before_header = sources_config[0].get('header_row', 1) - 1
+    source_ids = [source['source_id'] for source in sources_config]
+    header = None
+
+    with pd.read_csv(csv_path, header=None, dtype=str, chunksize=chunk_rows, **csv_format.reader_kwargs()) as reader:
+        for raw_chunk in reader:
+            if header is None:
+                # 表头可能不在第一个数据块中，跳过表头之前的行
+                if len(raw_chunk) <= rows_before_header:
+                    rows_before_header -= len(raw_chunk)
+                    continue
+                header = raw_chunk.iloc[rows_before_header].values
+                raw_chunk = raw_chunk.iloc[rows_before_header + 1:]
+
+            chunk = raw_chunk.reset_index(drop=True)
+            chunk.columns = header
+            chunk.dropna(how='all', inplace=True)  # 清理空行
+            if chunk.empty:
+                continue
+            yield {source_id: chunk for source_id in source_ids}
+
+def _convert_xlsx_value(value):
+    """与 pandas 的 openpyxl 读取器一致：空单元格为空字符串，整数值的浮点数转为int"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+# 指数超过 int32 范围的数字文本（如交易哈希 '6e7297327822e0d8…'），pandas 转换数字时会崩溃（段错误）
+_OVERFLOW_EXPONENT = re.compile(r'[eE][+-]?0*[1-9]\d{9}')
+
+def _parse_xlsx_rows(rows: list, header=None, dtype=None) -> pd.DataFrame:
+    """用 read_excel 内部相同的 TextParser 设置解析一批行（保留空行，缺失值规则一致）"""
+    if header is None:
+        # 这类文本不可能转为数字，整表读取时该列同样为 object，直接按原值读取，避免批次以它开头时崩溃
+        overflow_positions = {position for row in rows for position, value in enumerate(row)
+                              if isinstance(value, str) and _OVERFLOW_EXPONENT.search(value)}
+        if overflow_positions:
+            dtype = {**(dtype or {}), **{position: object for position in overflow_positions}}
+    return TextParser(rows, header=header, skip_blank_lines=False, dtype=dtype).read()
+
+def _iter_xlsx_raw_batches(xlsx_path: Path, source: dict, batch_rows: int):
+    """
+    逐行读取 tabular 工作表，产出 (表头行, 数据行) ：第一批的表头行为表头及其之前的行，之后的批次为None。
+    每批最多 batch_rows 个数据行；末尾的空行与 read_excel 一样被丢弃，nrows 的截取规则也相同。
+    """
+    header_rows_count = source.get('header_row', 1)
+    max_data_rows = source.get('nrows')
+    header_rows = None
+    data_rows_emitted = 0
+    pending_rows = []       # 当前批次的行（第一批包含表头及其之前的行）
+    blank_rows = []         # 暂存的空行，后面出现非空行时才计入（丢弃末尾空行）
+
+    def split(rows):
+        nonlocal header_rows
+        if header_rows is None:
+            header_rows = rows[:header_rows_count]
+            return header_rows, rows[header_rows_count:]
+        return None, rows
+
+    workbook = load_workbook(xlsx_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook[source['worksheet_name']]
+        sheet.reset_dimensions()
+        for values in sheet.iter_rows(values_only=True):
+            row = [_convert_xlsx_value(value) for value in values]
+            while row and row[-1] == "":
+                row.pop()
+            if not row:
+                blank_rows.append(row)
+                continue
+            if blank_rows:
+                pending_rows.extend(blank_rows)
+                blank_rows = []
+            pending_rows.append(row)
+
+            data_row_count = len(pending_rows) - (header_rows_count if header_rows is None else 0)
+            if max_data_rows is not None and data_rows_emitted + data_row_count >= max_data_rows:
+                pending_rows = pending_rows[:len(pending_rows) - (data_rows_emitted + data_row_count - max_data_rows)]
+                # 与 read_excel(nrows=...) 一致：截取范围末尾的空行同样丢弃
+                while pending_rows and not pending_rows[-1]:
+                    pending_rows.pop()
+                break
+            if data_row_count >= batch_rows:
+                data_rows_emitted += data_row_count
+                yield split(pending_rows)
+                pending_rows = []
+
+        if pending_rows:
+            data_row_count = len(pending_rows) - (header_rows_count if header_rows is None else 0)
+            if data_row_count > 0:
+                yield split(pending_rows)
+    finally:
+        workbook.close()
+
+def _pad_rows(rows: list, width: int) -> list:
+    return [row + [""] * (width - len(row)) for row in rows]
+
+def _is_uint64_overflow(values: pd.Series) -> bool:
+    """pandas 遇到超出 int64 的整数且有空值时不转换该列（空值保留为空字符串），批次推断为 object"""
+    if values.dtype == np.dtype('uint64'):
+        return True
+    if values.dtype != object:
+        return False
+    numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return len(numbers) == len(values) and any(isinstance(value, int) and value >= 2 ** 63 for value in numbers)
+
+def _scan_xlsx_column_types(xlsx_path: Path, source: dict, batch_rows: int):
+    """
+    第一遍扫描：返回 (最宽行的宽度, {列位置: 整表读取时的类型}, 空值保留为空字符串的列位置)。
+    read_excel 按整列推断类型（整列都能转为数字才转换，有空值的整数列为浮点数），
+    这里逐批推断后合并：任一批不是数字则为 object；有浮点数或空值则为浮点数。
+    """
+    width = 0
+    batch_widths = []
+    batch_dtypes = {}   # 列位置 -> 各批次（该列非全空时）推断出的类型
+    has_missing = {}    # 列位置 -> 是否有空值
+    has_negative = set()
+    for header_rows, data_rows in _iter_xlsx_raw_batches(xlsx_path, source, batch_rows):
+        width = max([width] + [len(row) for row in (header_rows or []) + data_rows])
+        batch_widths.append(max(len(row) for row in data_rows))
+        batch = _parse_xlsx_rows(_pad_rows(data_rows, batch_widths[-1]))
+        for position in range(batch.shape[1]):
+            column = batch.iloc[:, position]
+            missing = column.isna() | column.eq("") if column.dtype == object else column.isna()
+            has_missing[position] = has_missing.get(position, False) or bool(missing.any())
+            if not missing.all():
+                values = column[~missing]
+                dtype = np.dtype('uint64') if _is_uint64_overflow(values) else column.dtype
+                batch_dtypes.setdefault(position, []).append(dtype)
+                if is_integer_dtype(dtype) and min(values) < 0:
+                    has_negative.add(position)
+
+    column_types = {}
+    blank_positions = set()
+    for position, dtypes in batch_dtypes.items():
+        # 比该列更窄的批次在该列上全为空
+        missing = has_missing[position] or min(batch_widths) <= position
+        # 与 pandas 的数字转换一致，布尔值按整数处理（与整数混合为整数，有空值时为浮点数）
+        integer = all(is_integer_dtype(dtype) or is_bool_dtype(dtype) for dtype in dtypes)
+        numeric = all(is_integer_dtype(dtype) or is_bool_dtype(dtype) or is_float_dtype(dtype) for dtype in dtypes)
+        if numeric and np.dtype('uint64') in dtypes:
+            # 超出 int64 的整数（如广告号）：有空值或负数时 pandas 不转换，且空值保留为空字符串
+            if missing:
+                column_types[position] = np.dtype(object)
+                blank_positions.add(position)
+            elif position in has_negative and integer:
+                column_types[position] = np.dtype(object)
+            else:
+                column_types[position] = np.dtype('uint64') if integer else np.dtype('float64')
+        elif all(is_bool_dtype(dtype) for dtype in dtypes) and not missing:
+            column_types[position] = np.dtype(bool)
+        elif integer and not missing:
+            column_types[position] = np.dtype('int64')
+        elif numeric:
+            column_types[position] = np.dtype('float64')
+        elif all(dtype == dtypes[0] for dtype in dtypes):
+            column_types[position] = dtypes[0]      # 如日期时间列
+        else:
+            column_types[position] = np.dtype(object)
+    return width, column_types, blank_positions
+
+def iter_tabular_xlsx_batches(xlsx_path: Path, source: dict, batch_rows: int):
+    """
+    以 openpyxl 只读、仅取值模式逐行读取 tabular 工作表，每次产出最多 batch_rows 行的DataFrame，
+    拼接后与 pd.read_excel(header=header_row-1) 的结果相同（按最宽的行补齐、Unnamed 列名、空行、列类型），
+    与数据块如何切分无关。
+    read_excel 的列类型取决于整列的值（如客户端版本列同时有 '2.91.1' 和 '25206' 时整列为字符串），
+    因此先扫描一遍工作表确定各列类型和最宽行的宽度（不保留数据，内存占用与一个数据块相同），
+    第二遍再按这些类型解析各数据块。
+    """
+    header_index = source.get('header_row', 1) - 1
+    width, column_types, blank_positions = _scan_xlsx_column_types(xlsx_path, source, batch_rows)
+    float_positions = [position for position, dtype in column_types.items() if is_float_dtype(dtype)]
+    columns = None
+
+    for header_rows, data_rows in _iter_xlsx_raw_batches(xlsx_path, source, batch_rows):
+        if columns is None:
+            columns = _parse_xlsx_rows(_pad_rows(header_rows, width), header=header_index).columns
+        if not data_rows:
+            continue
+        rows = _pad_rows(data_rows, width)
+        batch = _parse_xlsx_rows(rows)
+        # 整表为 object 而本批转换成了数字的列，重新解析以保留单元格原值
+        raw_positions = {position: object for position, dtype in column_types.items()
+                         if dtype == object and batch.iloc[:, position].dtype != object}
+        if raw_positions:
+            raw = _parse_xlsx_rows(rows, dtype=raw_positions)
+            for position in raw_positions:
+                column = raw.iloc[:, position]
+                batch.isetitem(position, column.mask(column.isna(), "") if position in blank_positions else column)
+        reparse = [position for position in float_positions if batch.iloc[:, position].dtype.kind in 'iub']
+        if reparse:
+            # 整表读取时该列有空值，文本数字按浮点数解析（与整数转浮点数的舍入不同），补一个空行重新解析
+            with_blank = _parse_xlsx_rows(rows + [[""] * width])
+            for position in reparse:
+                if with_blank.iloc[:, position].dtype.kind == 'f':
+                    batch.isetitem(position, with_blank.iloc[:-1, position])
+        for position, dtype in column_types.items():
+            if dtype != object and batch.iloc[:, position].dtype != dtype:
+                batch.isetitem(position, batch.iloc[:, position].astype(dtype))
+        batch.columns = columns
+        yield batch
+
+def build_missing_sheets_error(missing_sheets: list, available_sheets: list):
+    """生成"缺少工作表"的用户友好错误对象，供数据提取和模板预筛选共用"""
+    from .error_handler import ETLError, ErrorType
+
+    missing_count = len(missing_sheets)
+    if missing_count == 1:
+        sheet_name = missing_sheets[0]
+        error_message = f"您的Excel文件中缺少【{sheet_name}】工作表"
+        details = f"系统需要读取名为【{sheet_name}】的工作表，但在您上传的文件中没有找到这个工作表。"
+    else:
+        # 显示所有缺失的工作表，不做截断
+        sheet_list = '】、【'.join(missing_sheets)
+        error_message = f"您的Excel文件中缺少{missing_count}个工作表：【{sheet_list}】"
+        details = f"系统需要读取以下工作表：【{sheet_list}】，但在您上传的文件中没有找到这些工作表。"
     
-    # print(f"\n--- [CSV诊断探针#1B] 解析器最终生成的DataFrame预览 (应包含extra_data列) ---")
-    # print(final_df.head().to_string())
+    # 生成详细的建议
+    suggestions = [
+        f"🔍 请检查您的Excel文件是否包含以下工作表：",
+        f"   缺少的工作表：【{', '.join(missing_sheets)}】",
+        "",
+        f"📋 您的文件当前包含的工作表：",
+        f"   {', '.join(available_sheets)}",
+        "",
+        "💡 可能的解决方案：",
+        "   • 确认工作表名称拼写是否正确（注意区分大小写）",
+        "   • 检查是否选择了正确的交易平台",
+        "   • 重新从交易平台导出完整的数据文件",
+        "   • 确认您选择的平台与文件内容是否匹配"
+    ]
     
-    return final_df
+    return ETLError(
+        error_type=ErrorType.DATA_VALIDATION_ERROR,
+        message=error_message,
+        details=details,
+        suggestions=suggestions
+    )
 
 # --- 核心"取货员"函数 (升级版) ---
-def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
+def extract_data_from_sources(excel_path: Path, sources_config: list, sheet_cache: SheetCache = None,
+                              optional_sources=None, probe_rows: int = None) -> dict:
     """
     (V9版 - 严格验证版)
     能够根据文件后缀名，智能选择Excel或CSV的解析策略。
     新增：严格验证所有sources都必须成功提取数据，否则抛出异常。
+    sheet_cache: 可选的单次上传工作表缓存，多个模板之间共享，避免重复解析同一工作表。
+    optional_sources: 可选数据源ID集合（来自模板计划），默认使用 OPTIONAL_SOURCE_IDS。
+    probe_rows: Excel中 tabular 数据源最多读取的数据行数（大文件流式处理前的模板匹配探测），默认读取全部。
     """
+    if sheet_cache is None:
+        sheet_cache = SheetCache(excel_path)
+    if optional_sources is None:
+        optional_sources = OPTIONAL_SOURCE_IDS
+
     extracted_data = {}
     failed_sources = []  # 记录失败的数据源
     success_sources = []  # 记录成功的数据源
@@ -238,13 +534,13 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
         # --- CSV 文件处理逻辑 (支持4种识别方法和编码检测) ---
         print(f"    📄 解析CSV文件: {excel_path.name}")
         
-        # 首先检测文件编码
-        detected_encoding = _detect_csv_encoding(excel_path)
-        print(f"    🔍 文件编码: {detected_encoding}")
+        # 首先探测文件编码和格式（只读取文件开头的一小段）
+        csv_format = sheet_cache.csv_format()
+        print(f"    🔍 文件编码: {csv_format.encoding}, 分隔符: {csv_format.delimiter!r}")
         
         try:
-            # 使用检测到的编码读取整个CSV文件作为原始数据
-            csv_df = pd.read_csv(excel_path, header=None, encoding=detected_encoding)  # 不设置header，保持原始结构
+            # 使用探测到的编码和分隔符读取整个CSV文件作为原始数据（同一上传内只读取一次）
+            csv_df = sheet_cache.read_csv(csv_format)
             
             # 遍历配置中的每个数据源，根据layout类型进行处理
             for source in sources_config:
@@ -255,50 +551,35 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
                 try:
                     # --- CSV调度中心：根据布局类型选择处理方法 ---
                     if layout == 'tabular':
-                        # 标准表格：使用指定的header_row
+                        # 标准表格：使用指定的header_row（共享原始数据的视图，不复制整个文件）
                         header_row = source.get('header_row', 1) - 1  # 转换为0-based索引
-                        df = csv_df.copy()
-                        if header_row < len(csv_df):
-                            df.columns = csv_df.iloc[header_row].values  # 设置表头
-                            df = df.iloc[header_row + 1:].reset_index(drop=True)  # 去掉表头行
-                            df.dropna(how='all', inplace=True)  # 清理空行
-                        else:
-                            df = pd.DataFrame()
+                        df = _tabular_view_csv(csv_df, header_row)
                         
                     elif layout == 'form_layout':
                         # 表单布局：寻找特定标题并解析键值对
                         header_aliases = source.get('section_header_aliases', [])
                         header_offset = source.get('header_offset', 1)
-                        df = _parse_form_subtable_csv(csv_df, header_aliases, header_offset)
+                        df = _parse_form_subtable_csv(csv_df, header_aliases, header_offset, sheet_cache.cell_index(csv_df))
                         
                     elif layout == 'find_subtable_by_header':
                         # 动态子表：寻找特定标题下的表格数据
                         header_aliases = source.get('section_header_aliases', [])
                         header_offset = source.get('header_offset', 1)
-                        df = _parse_tabular_subtable_csv(csv_df, header_aliases, header_offset)
+                        df = _parse_tabular_subtable_csv(csv_df, header_aliases, header_offset, sheet_cache.cell_index(csv_df))
                         
                     elif layout == 'merged_key_value':
-                        # 复杂三维表：处理合并单元格和键值对
-                        df = _parse_merged_key_value_csv(csv_df, source)
+                        # 复杂三维表：解析器会重新标记列名并替换列，传入浅拷贝即可保护共享原始数据
+                        df = _parse_merged_key_value_csv(csv_df.copy(deep=False), source)
                         
                     else:
                         print(f"  - 🟡 警告: 未知的CSV布局类型 '{layout}'，使用默认tabular处理。")
                         # 默认按标准表格处理
                         header_row = source.get('header_row', 1) - 1
-                        df = csv_df.copy()
-                        if header_row < len(csv_df):
-                            df.columns = csv_df.iloc[header_row].values
-                            df = df.iloc[header_row + 1:].reset_index(drop=True)
-                            df.dropna(how='all', inplace=True)
-                        else:
-                            df = pd.DataFrame()
+                        df = _tabular_view_csv(csv_df, header_row)
                     
                     # ✅ 智能验证：区分必需和可选数据源
                     is_data_empty = df is None or (isinstance(df, pd.DataFrame) and df.empty) or (isinstance(df, dict) and not df)
                     
-                    # 定义可选数据源（这些数据源为空时不应该导致整个处理失败）
-                    optional_sources = ['p2p_trade_raw', 'otc_trade_raw', 'margin_trade_raw', 'pay_trade_raw']
-                    
                     if is_data_empty:
                         if source_id in optional_sources:
                             # 可选数据源为空时，记录警告但继续处理
@@ -354,8 +635,7 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
         # --- Excel 文件处理逻辑 (增强验证) ---
         print(f"    📊 解析Excel文件: {excel_path.name}")
         try:
-            xls = pd.ExcelFile(excel_path)
-            available_sheets = xls.sheet_names
+            available_sheets = sheet_cache.sheet_names()
             print(f"    📋 文件包含工作表: {available_sheets}")
         except FileNotFoundError:
             print(f"    ❌ 文件未找到: {excel_path}")
@@ -411,20 +691,24 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
                 
                 # --- 调度中心 ---
                 if layout == 'tabular':
-                    df = pd.read_excel(xls, sheet_name=sheet_name, header=source.get('header_row', 1) - 1, nrows=source.get('nrows', None))
+                    nrows = source.get('nrows', None)
+                    if probe_rows is not None:
+                        nrows = probe_rows if nrows is None else min(nrows, probe_rows)
+                    df = sheet_cache.read_sheet(sheet_name, header=source.get('header_row', 1) - 1, nrows=nrows)
                 
                 elif layout == 'merged_key_value':
-                    raw_df = pd.read_excel(xls, sheet_name=sheet_name, header=source.get('header_row', 1) - 1)
-                    df = _parse_merged_key_value(raw_df, source)
+                    raw_df = sheet_cache.read_sheet(sheet_name, header=source.get('header_row', 1) - 1)
+                    # 解析器只替换整列、不改写原数组，传入浅拷贝即可保护缓存中的原始数据
+                    df = _parse_merged_key_value(raw_df.copy(deep=False), source)
                     
                 else: # 处理 find_subtable_by_header 和 form_layout
-                    full_sheet_df = pd.read_excel(xls, sheet_name=sheet_name, header=None)
+                    full_sheet_df = sheet_cache.read_sheet(sheet_name, header=None)
                     header_aliases = source.get('section_header_aliases', []) 
                     
                     if layout == 'find_subtable_by_header':
-                        df = _parse_tabular_subtable(full_sheet_df, header_aliases, source['header_offset'])
+                        df = _parse_tabular_subtable(full_sheet_df, header_aliases, source['header_offset'], sheet_cache.cell_index(full_sheet_df))
                     elif layout == 'form_layout':
-                        df = _parse_form_subtable(full_sheet_df, header_aliases, source['header_offset'])
+                        df = _parse_form_subtable(full_sheet_df, header_aliases, source['header_offset'], sheet_cache.cell_index(full_sheet_df))
                     else:
                         print(f"        🟡 警告: 未知布局类型 '{layout}'，跳过")
                         df = pd.DataFrame()
@@ -432,9 +716,6 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
                 # ✅ 智能验证：区分必需和可选数据源
                 is_data_empty = df is None or (isinstance(df, pd.DataFrame) and df.empty) or (isinstance(df, dict) and not df)
                 
-                # 定义可选数据源（这些数据源为空时不应该导致整个处理失败）
-                optional_sources = ['p2p_trade_raw', 'otc_trade_raw', 'margin_trade_raw', 'pay_trade_raw']
-                
                 if is_data_empty:
                     if source_id in optional_sources:
                         # 可选数据源为空时，记录警告但继续处理
@@ -487,9 +768,6 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
     success_count = len(success_sources)
     failed_count = len(failed_sources)
     
-    # 定义可选数据源
-    optional_sources = ['p2p_trade_raw', 'otc_trade_raw', 'margin_trade_raw', 'pay_trade_raw']
-    
     # 过滤出真正关键的失败（排除可选数据源的失败）
     critical_failures = [f for f in failed_sources if f['source_id'] not in optional_sources]
     
@@ -525,32 +803,7 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
             failed_details.append(f"• {failed['source_id']}: {failed['reason']}")
         
         if missing_sheets:
-            # 生成用户友好的错误信息
-            missing_count = len(missing_sheets)
-            if missing_count == 1:
-                sheet_name = missing_sheets[0]
-                error_message = f"您的Excel文件中缺少【{sheet_name}】工作表"
-                details = f"系统需要读取名为【{sheet_name}】的工作表，但在您上传的文件中没有找到这个工作表。"
-            else:
-                # 显示所有缺失的工作表，不做截断
-                sheet_list = '】、【'.join(missing_sheets)
-                error_message = f"您的Excel文件中缺少{missing_count}个工作表：【{sheet_list}】"
-                details = f"系统需要读取以下工作表：【{sheet_list}】，但在您上传的文件中没有找到这些工作表。"
-            
-            # 生成详细的建议
-            suggestions = [
-                f"🔍 请检查您的Excel文件是否包含以下工作表：",
-                f"   缺少的工作表：【{', '.join(missing_sheets)}】",
-                "",
-                f"📋 您的文件当前包含的工作表：",
-                f"   {', '.join(available_sheets)}",
-                "",
-                "💡 可能的解决方案：",
-                "   • 确认工作表名称拼写是否正确（注意区分大小写）",
-                "   • 检查是否选择了正确的交易平台",
-                "   • 重新从交易平台导出完整的数据文件",
-                "   • 确认您选择的平台与文件内容是否匹配"
-            ]
+            raise build_missing_sheets_error(missing_sheets, available_sheets)
         else:
             error_message = "文件数据提取失败"
             details = "系统无法从您上传的文件中提取到必需的数据。这可能是因为文件格式不正确或文件内容不完整。"
@@ -576,12 +829,112 @@ def extract_data_from_sources(excel_path: Path, sources_config: list) -> dict:
             print("    🎯 所有数据源提取成功！")
     return extracted_data
 
-def process_single_destination(destination_config: dict, all_extracted_data: dict, function_registry: dict, source_file_name: str) -> pd.DataFrame:
+class CompiledRule(NamedTuple):
+    """预编译的单条映射规则：别名列表转为元组，转换函数名解析为可调用对象"""
+    target_field: str
+    kind: str               # 'static' | 'lookup' | 'column'
+    static_value: Any
+    lookup_source: str
+    aliases: tuple
+    transforms: tuple       # 已从函数注册表解析出的转换函数
+    batch_transforms: tuple # 与 transforms 一一对应的批量（按列）实现，没有则为None
+    in_extra: bool
+
+class CompiledDestination(NamedTuple):
+    """预编译的目标表生产线"""
+    target_table: str
+    primary_source: str
+    rules: tuple
+    config: dict
+
+def compile_destination(destination_config: dict, function_registry: dict,
+                        batch_function_registry: dict = None) -> CompiledDestination:
+    """
+    将一条 destinations 配置编译为 CompiledDestination，未注册的转换函数会被忽略（与逐行解析时一致）。
+    batch_function_registry: 同名的批量转换函数注册表（输入输出为Series），列式执行时优先使用。
+    """
+    batch_function_registry = batch_function_registry or {}
+    rules = []
+    for rule in destination_config.get('mappings', []):
+        if 'static_value' in rule:
+            kind = 'static'
+        elif 'lookup_source' in rule:
+            kind = 'lookup'
+        else:
+            kind = 'column'
+        function_names = [
+            trans['function']
+            for trans in rule.get('transformations', [])
+            if function_registry.get(trans['function'])
+        ]
+        transforms = tuple(function_registry[name] for name in function_names)
+        batch_transforms = tuple(batch_function_registry.get(name) for name in function_names)
+        rules.append(CompiledRule(
+            target_field=rule['target_field'],
+            kind=kind,
+            static_value=rule.get('static_value'),
+            lookup_source=rule.get('lookup_source'),
+            aliases=tuple(rule.get('source_field_aliases', [])),
+            transforms=transforms,
+            batch_transforms=batch_transforms,
+            in_extra=rule.get('in_extra', False)
+        ))
+    return CompiledDestination(
+        target_table=destination_config.get('target_table'),
+        primary_source=destination_config.get('primary_source'),
+        rules=tuple(rules),
+        config=destination_config
+    )
+
+def _bind_rules(rules: tuple, source_columns, all_extracted_data: dict, resolve_alias) -> list:
     """
-    (V5版 - 智能处理版)
+    对一个主数据源的表头只做一次别名解析：
+    返回 [(规则, 取值方式, 列名或查找值)]，逐行处理时不再重复查找别名和 lookup_source。
+    all_extracted_data: lookup_source 的取值来源。
+    """
+    bound_rules = []
+    for rule in rules:
+        if rule.kind == 'static':
+            bound_rules.append((rule, 'static', rule.static_value))
+        elif rule.kind == 'lookup':
+            raw_value = None
+            lookup_data = all_extracted_data.get(rule.lookup_source)
+            is_lookup_data_valid = False
+            if isinstance(lookup_data, dict) and lookup_data:
+                is_lookup_data_valid = True
+            elif isinstance(lookup_data, pd.DataFrame) and not lookup_data.empty:
+                is_lookup_data_valid = True
+            if is_lookup_data_valid:
+                lookup_row = pd.Series(lookup_data) if isinstance(lookup_data, dict) else lookup_data.iloc[0]
+                field_name = resolve_alias(lookup_row.index, rule.aliases)
+                if field_name:
+                    raw_value = lookup_row.get(field_name)
+            bound_rules.append((rule, 'static', raw_value))
+        else:
+            bound_rules.append((rule, 'column', resolve_alias(source_columns, rule.aliases)))
+    return bound_rules
+
+def process_single_destination(destination_config: dict, all_extracted_data: dict, function_registry: dict, source_file_name: str,
+                               compiled_destination: CompiledDestination = None, alias_resolver=None,
+                               vectorized: bool = True, batch_function_registry: dict = None,
+                               lookup_data: dict = None) -> pd.DataFrame:
+    """
+    (V7版 - 列式执行版)
     能够智能地判断主数据源是多行表格(DataFrame)还是单条记录(dict)。
+    compiled_destination: 模板计划中预编译好的生产线，未提供时按 function_registry 现场编译。
+    alias_resolver: 别名解析函数 resolver(columns, aliases)，模板计划会按表头签名缓存解析结果。
+    vectorized: 多行表格按列整体构建目标字段（默认）；False 时使用逐行处理，两者结果完全一致。
+    batch_function_registry: 现场编译时使用的批量转换函数注册表。
+    lookup_data: lookup_source 的取值来源，默认与 all_extracted_data 相同；
+                 流式处理时传入首个数据块，保证每个数据块查到的都是文件第一行的值。
     """
-    primary_source_name = destination_config.get('primary_source')
+    if compiled_destination is None:
+        compiled_destination = compile_destination(destination_config, function_registry, batch_function_registry)
+    resolve_alias = alias_resolver or find_field_from_aliases
+    if lookup_data is None:
+        lookup_data = all_extracted_data
+
+    primary_source_name = compiled_destination.primary_source
     primary_data = all_extracted_data.get(primary_source_name)
 
     if primary_data is None:
@@ -592,81 +945,158 @@ def process_single_destination(destination_config: dict, all_extracted_data: dic
     
     # --- 核心升级：判断原材料是"多行表格"还是"单条记录" ---
     if isinstance(primary_data, pd.DataFrame):
-        # 如果是多行表格，我们像以前一样，逐行处理
+        # 如果是多行表格，别名只解析一次，然后逐行处理
+        bound_rules = _bind_rules(compiled_destination.rules, primary_data.columns, lookup_data, resolve_alias)
+        if vectorized and _can_process_vectorized(primary_data):
+            return _process_rows_vectorized(bound_rules, primary_data, source_file_name)
         for index, source_row in primary_data.iterrows():
-            new_row = _process_one_row(destination_config, source_row, primary_data.columns, all_extracted_data, function_registry, source_file_name)
+            new_row = _process_one_row(bound_rules, source_row, source_file_name)
             output_rows.append(new_row)
     elif isinstance(primary_data, dict):
         # 如果是单条记录（字典），我们只处理一次，不需要循环！
         # 我们把这个字典包装成pandas的Series，让下游函数可以统一处理
         source_row = pd.Series(primary_data)
-        new_row = _process_one_row(destination_config, source_row, primary_data.keys(), all_extracted_data, function_registry, source_file_name)
+        bound_rules = _bind_rules(compiled_destination.rules, primary_data.keys(), lookup_data, resolve_alias)
+        new_row = _process_one_row(bound_rules, source_row, source_file_name)
         output_rows.append(new_row)
     
     return pd.DataFrame(output_rows)
 
-def _process_one_row(destination_config, source_row, source_columns, all_extracted_data, function_registry, source_file_name):
+def _process_one_row(bound_rules, source_row, source_file_name):
     """
     (最终版) 负责处理单行数据的完整映射逻辑。
+    bound_rules 由 _bind_rules 生成，别名和查找值已经解析完毕。
     """
-    mappings = destination_config.get('mappings', [])
     standard_fields = {'source_file_name': source_file_name}
     
     extra_fields = source_row.get('extra_data', {})
     if not isinstance(extra_fields, dict):
         extra_fields = {}
 
-    for rule in mappings:
-        target_field = rule['target_field']
-        raw_value = None
-        
-        if 'static_value' in rule:
-            raw_value = rule['static_value']
-        elif 'lookup_source' in rule:
-            lookup_data = all_extracted_data.get(rule['lookup_source'])
-            is_lookup_data_valid = False
-            if isinstance(lookup_data, dict) and lookup_data:
-                is_lookup_data_valid = True
-            elif isinstance(lookup_data, pd.DataFrame) and not lookup_data.empty:
-                is_lookup_data_valid = True
-            if is_lookup_data_valid:
-                lookup_row = pd.Series(lookup_data) if isinstance(lookup_data, dict) else lookup_data.iloc[0]
-                field_name = find_field_from_aliases(lookup_row.index, rule.get('source_field_aliases', []))
-                if field_name:
-                    raw_value = lookup_row.get(field_name)
+    for rule, value_kind, bound_value in bound_rules:
+        if value_kind == 'static':
+            raw_value = bound_value
+        elif bound_value:
+            raw_value = source_row.get(bound_value)
         else:
-            field_name = find_field_from_aliases(source_columns, rule.get('source_field_aliases', []))
-            if field_name:
-                raw_value = source_row.get(field_name)
+            raw_value = None
 
         transformed_value = raw_value
-        for trans in rule.get('transformations', []):
-            func = function_registry.get(trans['function'])
-            if func:
-                transformed_value = func(transformed_value)
+        for func in rule.transforms:
+            transformed_value = func(transformed_value)
 
-        if rule.get('in_extra', False):
-            extra_fields[target_field] = transformed_value
+        if rule.in_extra:
+            extra_fields[rule.target_field] = transformed_value
         else:
-            standard_fields[target_field] = transformed_value
+            standard_fields[rule.target_field] = transformed_value
     
     if extra_fields:
-        def _json_converter(o):
-            if pd.isna(o):
-                return None
-            if isinstance(o, pd.Timestamp):
-                return o.isoformat()
-            if isinstance(o, Decimal):
-                return str(o)
-            if hasattr(o, 'item'):
-                return o.item()
-            raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
-        
-        sanitized_extra_fields = {k: _sanitize_for_json(v) for k, v in extra_fields.items()}
-        standard_fields['extra_data'] = json.dumps(sanitized_extra_fields, default=_json_converter, ensure_ascii=False)
+        standard_fields['extra_data'] = _serialize_extra_fields(extra_fields)
     
     return standard_fields
 
+def _can_process_vectorized(primary_data: pd.DataFrame) -> bool:
+    """
+    列式执行要求列名唯一，且 DataFrame.values 的合并类型为 object/数值/布尔，
+    这样按列取出的元素与 iterrows() 逐行取出的元素完全相同。
+    """
+    if not primary_data.columns.is_unique:
+        return False
+    return primary_data.values.dtype.kind in 'Obiuf'
+
+def _process_rows_vectorized(bound_rules, primary_data: pd.DataFrame, source_file_name: str) -> pd.DataFrame:
+    """
+    列式映射：每个 target_field 作为一整列构建，static_value 和 lookup 值只计算一次后广播。
+    输出与逐行调用 _process_one_row 后 pd.DataFrame(rows) 的结果完全一致（列顺序、取值和类型推断）。
+    """
+    row_count = len(primary_data)
+    if row_count == 0:
+        return pd.DataFrame([])
+
+    # 与 iterrows() 使用同一个合并后的二维数组，保证元素类型一致
+    values = primary_data.values
+    columns = primary_data.columns
+
+    def column_values(label):
+        return list(values[:, columns.get_loc(label)])
+
+    standard_columns = {'source_file_name': [source_file_name] * row_count}
+    extra_columns = {}
+
+    for rule, value_kind, bound_value in bound_rules:
+        if value_kind == 'column' and bound_value:
+            column = column_values(bound_value)
+            for func, batch_func in zip(rule.transforms, rule.batch_transforms):
+                column = _apply_column_transform(func, batch_func, column)
+        else:
+            # static_value / lookup 值 / 未找到的字段：整列相同，只转换一次再广播
+            value = bound_value if value_kind == 'static' else None
+            for func in rule.transforms:
+                value = func(value)
+            column = [value] * row_count
+
+        if rule.in_extra:
+            extra_columns[rule.target_field] = column
+        else:
+            standard_columns[rule.target_field] = column
+
+    # --- extra_data：合并原始 extra_data 字典和 in_extra 字段，逐行序列化为JSON ---
+    source_extra = column_values('extra_data') if 'extra_data' in columns else None
+    if source_extra is not None or extra_columns:
+        existing_column = standard_columns.get('extra_data')
+        merged_column = []
+        has_extra = False
+        for i in range(row_count):
+            extra_fields = source_extra[i] if source_extra is not None else {}
+            if not isinstance(extra_fields, dict):
+                extra_fields = {}
+            for target_field, column in extra_columns.items():
+                extra_fields[target_field] = column[i]
+
+            if extra_fields:
+                merged_column.append(_serialize_extra_fields(extra_fields))
+                has_extra = True
+            elif existing_column is not None:
+                merged_column.append(existing_column[i])
+            else:
+                # 与由字典列表构建DataFrame时缺失键的填充值一致
+                merged_column.append(np.nan)
+
+        if has_extra:
+            standard_columns['extra_data'] = merged_column
+
+    # 由行元组构建DataFrame，与由字典列表构建时走相同的类型推断流程
+    column_names = list(standard_columns.keys())
+    return pd.DataFrame(list(zip(*standard_columns.values())), columns=column_names)
+
+def _apply_column_transform(func, batch_func, column: list) -> list:
+    """优先调用批量转换函数处理整列，批量函数缺失或失败时逐元素调用标量函数"""
+    if batch_func is not None:
+        try:
+            result = batch_func(pd.Series(column, dtype=object))
+            if len(result) == len(column):
+                return result.tolist()
+            print(f"    ⚠️ 批量函数 {batch_func.__name__} 返回 {len(result)} 行（应为 {len(column)} 行），逐元素回退到 {func.__name__}")
+        except Exception as e:
+            print(f"    ⚠️ 批量函数 {batch_func.__name__} 出错，逐元素回退到 {func.__name__}: {e}")
+    return [func(value) for value in column]
+
+def _json_converter(o):
+    if pd.isna(o):
+        return None
+    if isinstance(o, pd.Timestamp):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return str(o)
+    if hasattr(o, 'item'):
+        return o.item()
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+def _serialize_extra_fields(extra_fields: dict) -> str:
+    """将 extra_data 字典清洗后序列化为JSON字符串"""
+    sanitized_extra_fields = {k: _sanitize_for_json(v) for k, v in extra_fields.items()}
+    return json.dumps(sanitized_extra_fields, default=_json_converter, ensure_ascii=False)
+
 def _sanitize_for_json(obj):
     """
     (全新的"深度清洁"工具)
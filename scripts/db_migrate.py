@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库结构迁移脚本（非破坏性）
+
+与 db_setup.py 的"清空并重建"不同，这里只在现有表上增量执行结构变更，不删除任何数据：
+1. schema_version 表记录已执行到的迁移版本
+2. 每个迁移由若干步骤组成，每一步执行前先查询 information_schema，已存在则跳过，可重复执行
+3. report 子命令输出现有查询的 EXPLAIN 和耗时，migrate --report 输出迁移前后对比
+
+版本：
+    v1 核心表二级索引/前缀索引
+    v2 用户搜索索引表 search_index（见 search_index.py），创建后根据现有数据回填
+    v3 file_metadata.content_hash：上传文件的内容哈希，用于跳过重复文件的ETL
+    v4 核心表 row_fingerprint：记录指纹，用于增量重新导入（见 incremental.py）
+    v5 file_metadata.error_message：处理失败时的错误说明
+
+用法：
+    python scripts/db_migrate.py status              # 查看当前版本和待执行的迁移
+    python scripts/db_migrate.py migrate             # 执行所有待执行的迁移
+    python scripts/db_migrate.py migrate --report    # 执行迁移，并输出迁移前后的 EXPLAIN/耗时
+    python scripts/db_migrate.py report --user-id 12345 --file-name xxx.xlsx
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+from sqlalchemy import text
+
+# 添加项目根目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from scripts.db_setup import DB_CONFIG
+from scripts.utils import get_db_engine
+from scripts.search_index import SEARCH_INDEX_TABLE, SEARCH_INDEX_TABLE_DEFINITION, rebuild_search_index
+from scripts.incremental import FINGERPRINT_COLUMN
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+CORE_TABLES = ['users', 'transactions', 'asset_movements', 'login_logs', 'devices']
+
+# --- 迁移定义 ---
+# 每一步为 (步骤类型, 表名, 对象名, 定义)，步骤类型对应 STEP_HANDLERS 中的处理函数。
+# TEXT 列只能建前缀索引：source_file_name 取前191个字符（utf8mb4 下 764 字节，兼容 MySQL 5.7 的 767 字节限制），
+# 地址/交易哈希取前100个字符，足以覆盖各链的完整地址和 txid。
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': '核心表二级索引：user_id、source_file_name、login_ip、device_id、address、txid',
+        'steps': [
+            ('index', 'users', 'idx_source_file_name', 'source_file_name(191)'),
+            ('index', 'transactions', 'idx_user_id', 'user_id'),
+            ('index', 'transactions', 'idx_source_file_name', 'source_file_name(191)'),
+            ('index', 'asset_movements', 'idx_user_id', 'user_id'),
+            ('index', 'asset_movements', 'idx_source_file_name', 'source_file_name(191)'),
+            ('index', 'asset_movements', 'idx_address', 'address(100)'),
+            ('index', 'asset_movements', 'idx_txid', 'txid(100)'),
+            ('index', 'login_logs', 'idx_user_id', 'user_id'),
+            ('index', 'login_logs', 'idx_source_file_name', 'source_file_name(191)'),
+            ('index', 'login_logs', 'idx_login_ip', 'login_ip'),
+            ('index', 'login_logs', 'idx_device_id', 'device_id'),
+            ('index', 'devices', 'idx_user_id', 'user_id'),
+            ('index', 'devices', 'idx_source_file_name', 'source_file_name(191)'),
+            ('index', 'devices', 'idx_device_id', 'device_id'),
+        ]
+    },
+    {
+        'version': 2,
+        'description': '用户搜索索引表 search_index，并根据现有数据回填',
+        'steps': [
+            ('table', SEARCH_INDEX_TABLE, None, SEARCH_INDEX_TABLE_DEFINITION),
+            ('backfill', SEARCH_INDEX_TABLE, None, None),
+        ]
+    },
+    {
+        'version': 3,
+        'description': '文件元信息内容哈希 file_metadata.content_hash',
+        'steps': [
+            ('column', 'file_metadata', 'content_hash', "CHAR(64) NULL COMMENT '文件内容的SHA-256'"),
+            ('index', 'file_metadata', 'idx_content_hash', 'content_hash'),
+        ]
+    },
+    {
+        'version': 4,
+        'description': '核心表记录指纹 row_fingerprint，用于增量重新导入',
+        # 索引 (user_id, source, row_fingerprint) 覆盖增量比较时按用户读取指纹的查询
+        'steps': [
+            step
+            for table in CORE_TABLES
+            for step in (
+                ('column', table, FINGERPRINT_COLUMN, "CHAR(40) NULL COMMENT '记录指纹（增量导入）'"),
+                ('index', table, 'idx_user_fingerprint', f'user_id, source, {FINGERPRINT_COLUMN}'),
+            )
+        ]
+    },
+    {
+        'version': 5,
+        'description': '文件元信息错误说明 file_metadata.error_message（create_file_metadata_table.py 创建的旧表没有该列）',
+        'steps': [
+            ('column', 'file_metadata', 'error_message', "TEXT NULL COMMENT '错误信息（如果有）'"),
+        ]
+    },
+]
+
+
+def _ensure_index(connection, table: str, index_name: str, columns: str) -> bool:
+    """索引不存在时创建，返回是否实际执行了变更"""
+    exists = connection.execute(text(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index_name LIMIT 1"
+    ), {'table': table, 'index_name': index_name}).first()
+    if exists:
+        return False
+    connection.execute(text(f"ALTER TABLE `{table}` ADD INDEX `{index_name}` ({columns})"))
+    return True
+
+
+def _ensure_column(connection, table: str, column: str, definition: str) -> bool:
+    """列不存在时添加，返回是否实际执行了变更"""
+    exists = connection.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column LIMIT 1"
+    ), {'table': table, 'column': column}).first()
+    if exists:
+        return False
+    connection.execute(text(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}"))
+    return True
+
+
+def _ensure_table(connection, table: str, name, definition: str) -> bool:
+    """表不存在时按定义（CREATE TABLE IF NOT EXISTS）创建"""
+    exists = connection.execute(text(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table LIMIT 1"
+    ), {'table': table}).first()
+    if exists:
+        return False
+    connection.execute(text(definition))
+    return True
+
+
+def _backfill_search_index(connection, table: str, name, definition) -> bool:
+    """搜索索引为空时根据核心表中的现有数据回填"""
+    if connection.execute(text(f"SELECT 1 FROM `{table}` LIMIT 1")).first():
+        return False
+    rebuild_search_index(DB_CONFIG, connection=connection)
+    return True
+
+
+STEP_HANDLERS = {
+    'index': _ensure_index,
+    'column': _ensure_column,
+    'table': _ensure_table,
+    'backfill': _backfill_search_index,
+}
+
+
+def ensure_schema_version_table(connection):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def get_current_version(connection) -> int:
+    ensure_schema_version_table(connection)
+    version = connection.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar()
+    return int(version or 0)
+
+
+def pending_migrations(current_version: int) -> list:
+    return [migration for migration in MIGRATIONS if migration['version'] > current_version]
+
+
+def apply_migrations(db_config: dict) -> int:
+    """
+    依次执行所有未执行的迁移，返回执行后的版本号。
+    MySQL 的 DDL 会隐式提交，因此每一步单独生效；中途失败时已完成的步骤保留，
+    版本号不记录，修复后重新执行会跳过已存在的对象继续完成。
+    """
+    engine = get_db_engine(db_config)
+    with engine.connect() as connection:
+        current_version = get_current_version(connection)
+        connection.commit()
+        migrations = pending_migrations(current_version)
+        if not migrations:
+            print(f"✅ 数据库结构已是最新版本 (v{current_version})")
+            return current_version
+
+        for migration in migrations:
+            print(f"\n🚀 执行迁移 v{migration['version']}: {migration['description']}")
+            for step_type, table, name, definition in migration['steps']:
+                changed = STEP_HANDLERS[step_type](connection, table, name, definition)
+                status = "✅ 已执行" if changed else "⏭️ 已存在，跳过"
+                target = f"{table}.{name} ({definition})" if step_type in ('index', 'column') else table
+                print(f"   {status}: [{step_type}] {target}")
+            connection.execute(
+                text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description) VALUES (:version, :description)"),
+                {'version': migration['version'], 'description': migration['description']}
+            )
+            connection.commit()
+            current_version = migration['version']
+
+    print(f"\n✅ 迁移完成，当前版本: v{current_version}")
+    return current_version
+
+
+# --- 现有查询的 EXPLAIN / 耗时报告 ---
+# 与 db_queries.get_data_from_db、utils.delete_data_by_filename、db_queries.search_users_by_fuzzy_term 中的查询条件一致。
+# 删除语句用等价条件的 SELECT COUNT(*) 计时，不会真的删除数据。
+def build_report_queries() -> list:
+    queries = []
+    for table in CORE_TABLES:
+        queries.append((f"按用户查询 {table}", f"SELECT * FROM `{table}` WHERE user_id = :user_id"))
+    for table in CORE_TABLES:
+        queries.append((f"按文件删除 {table}", f"SELECT COUNT(*) FROM `{table}` WHERE source_file_name = :file_name"))
+    queries.append(("模糊搜索 users", "SELECT user_id FROM users WHERE user_id LIKE :pattern OR name LIKE :pattern "
+                                      "OR phone_number LIKE :pattern OR email LIKE :pattern"))
+    queries.append(("模糊搜索 login_logs", "SELECT user_id FROM login_logs WHERE login_ip LIKE :pattern "
+                                           "OR device_id LIKE :pattern"))
+    return queries
+
+
+def _first_value(connection, sql: str):
+    """取查询结果的第一个值，表为空或不存在时返回None"""
+    try:
+        return connection.execute(text(sql)).scalar()
+    except Exception:
+        connection.rollback()
+        return None
+
+
+def _pick_sample_params(connection, user_id: str = None, file_name: str = None, term: str = None) -> dict:
+    """未指定时从库中取一个真实存在的用户ID和文件名作为查询参数（库为空时使用空字符串）"""
+    if user_id is None:
+        user_id = _first_value(connection, "SELECT user_id FROM transactions WHERE user_id IS NOT NULL LIMIT 1") \
+            or _first_value(connection, "SELECT user_id FROM users WHERE user_id IS NOT NULL LIMIT 1") or ''
+    if file_name is None:
+        file_name = _first_value(connection, "SELECT source_file_name FROM transactions LIMIT 1") \
+            or _first_value(connection, "SELECT source_file_name FROM users LIMIT 1") or ''
+    if term is None:
+        term = str(user_id)[:6]
+    return {'user_id': user_id, 'file_name': file_name, 'pattern': f"%{term}%"}
+
+
+def collect_query_report(db_config: dict, params: dict = None, repeat: int = 5) -> list:
+    """
+    对每个查询执行 EXPLAIN 并计时（取 repeat 次的中位数）。
+    :return: [{'name', 'plans': [(表, 访问类型, 使用的索引, 预估行数)], 'ms'}]
+    """
+    engine = get_db_engine(db_config)
+    report = []
+    with engine.connect() as connection:
+        if params is None:
+            params = _pick_sample_params(connection)
+        for name, sql in build_report_queries():
+            plans = [
+                (row.get('table'), row.get('type'), row.get('key'), row.get('rows'))
+                for row in connection.execute(text(f"EXPLAIN {sql}"), params).mappings()
+            ]
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                connection.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            report.append({'name': name, 'plans': plans, 'ms': statistics.median(timings)})
+    return report
+
+
+def _format_plan(plans: list) -> str:
+    return '; '.join(f"{access_type or '-'}/{key or '无索引'}/~{rows}" for _, access_type, key, rows in plans)
+
+
+def print_query_report(report: list, before: list = None):
+    """打印报告；提供 before 时输出迁移前后对比"""
+    print("\n" + "=" * 100)
+    print("📊 现有查询的执行计划与耗时（访问类型/使用的索引/预估扫描行数）")
+    print("=" * 100)
+    before_by_name = {item['name']: item for item in before or []}
+    for item in report:
+        previous = before_by_name.get(item['name'])
+        print(f"\n🔍 {item['name']}")
+        if previous:
+            print(f"   迁移前: {_format_plan(previous['plans'])}  {previous['ms']:.2f} ms")
+            print(f"   迁移后: {_format_plan(item['plans'])}  {item['ms']:.2f} ms")
+        else:
+            print(f"   {_format_plan(item['plans'])}  {item['ms']:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库结构迁移（非破坏性）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='查看当前版本和待执行的迁移')
+    migrate_parser = subparsers.add_parser('migrate', help='执行所有待执行的迁移')
+    migrate_parser.add_argument('--report', action='store_true', help='输出迁移前后的 EXPLAIN 和耗时对比')
+    report_parser = subparsers.add_parser('report', help='输出现有查询的 EXPLAIN 和耗时')
+    for sub in (migrate_parser, report_parser):
+        sub.add_argument('--user-id', help='用于测试查询的用户ID（默认取库中任意一个）')
+        sub.add_argument('--file-name', help='用于测试查询的源文件名（默认取库中任意一个）')
+        sub.add_argument('--term', help='用于模糊搜索的关键词（默认取用户ID前6位）')
+        sub.add_argument('--repeat', type=int, default=5, help='每个查询的计时次数')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        with get_db_engine(DB_CONFIG).connect() as connection:
+            current_version = get_current_version(connection)
+            connection.commit()
+        print(f"📌 当前版本: v{current_version}")
+        for migration in pending_migrations(current_version):
+            print(f"   ⏳ 待执行 v{migration['version']}: {migration['description']}")
+        return
+
+    if args.command == 'migrate' and not args.report:
+        apply_migrations(DB_CONFIG)
+        return
+
+    # 只有输出报告时才需要测试参数（新建的空库上执行 migrate 不查询核心表）
+    with get_db_engine(DB_CONFIG).connect() as connection:
+        params = _pick_sample_params(connection, args.user_id, args.file_name, args.term)
+    print(f"🧪 测试参数: {params}")
+
+    if args.command == 'report':
+        print_query_report(collect_query_report(DB_CONFIG, params, args.repeat))
+        return
+
+    before = collect_query_report(DB_CONFIG, params, args.repeat)
+    apply_migrations(DB_CONFIG)
+    print_query_report(collect_query_report(DB_CONFIG, params, args.repeat), before)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,221 @@
 # scripts/db_queries.py
 
-from .utils import get_db_engine
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from .utils import get_db_engine, get_raw_connection
+from .search_index import SEARCH_INDEX_TABLE, FIELD_LABELS, TABLE_MATCH_TYPES, MAX_VALUE_LENGTH, normalize_search_value
+from sqlalchemy import bindparam, text
 import pandas as pd
 
+# 索引搜索最多返回的索引命中条数（合并为用户结果前）
+SEARCH_RESULT_LIMIT = 200
+PHONE_LIKE_PATTERN = re.compile(r'^[\d\s\-+()]+$')
+
+# /api/mindmap_data 查询的核心表（按返回结果中的顺序）
+MINDMAP_TABLES = ["users", "transactions", "asset_movements", "login_logs", "devices"]
+
+# 并发查询的线程数：所有请求共享，同时也限制了占用的连接池连接数（需小于 pool_size + max_overflow）
+QUERY_WORKERS = int(os.environ.get('ETL_QUERY_WORKERS', 8))
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='db-query')
+
+# 流式读取时每次从服务端游标获取的行数
+STREAM_FETCH_ROWS = 1000
+
+# --- 查询返回的列，也是 fields 参数可选择的列（与 db_setup.TABLE_DEFINITIONS 中的表结构保持一致，
+#     不包含 row_fingerprint 等内部列）---
+MINDMAP_COLUMNS = {
+    'users': ['id', 'source', 'user_id', 'name', 'registration_time', 'phone_number', 'email',
+              'source_file_name', 'extra_data'],
+    'transactions': ['id', 'source', 'user_id', 'transaction_id', 'transaction_time', 'transaction_type',
+                     'direction', 'base_asset', 'quote_asset', 'price', 'quantity', 'total_amount', 'fee',
+                     'fee_asset', 'source_file_name', 'extra_data'],
+    'asset_movements': ['id', 'source', 'user_id', 'direction', 'asset', 'quantity', 'address', 'txid',
+                        'network', 'transaction_time', 'status', 'source_file_name', 'extra_data'],
+    'login_logs': ['id', 'source', 'user_id', 'login_time', 'login_ip', 'device_id', 'source_file_name',
+                   'extra_data'],
+    'devices': ['id', 'source', 'user_id', 'device_id', 'client_type', 'ip_address', 'add_time',
+                'source_file_name', 'extra_data'],
+}
+# 列投影时总是返回的列（分页游标和前端关联依赖）
+REQUIRED_COLUMNS = ('id', 'user_id')
+# 体积较大的JSON列：列投影时只有显式请求、或只取一条记录时才返回
+LAZY_COLUMNS = ('extra_data',)
+
+def parse_fields_param(fields_param: str, tables: list, single_row: bool = False):
+    """
+    解析 /api/mindmap_data 的 fields 参数，返回 {表名: [列名, ...]}；未提供时返回None（查询全部列）。
+    格式：
+      transactions:id,transaction_time;login_logs:login_ip   按表指定
+      transaction_time,login_ip                              对所有表生效（只取各表中存在的列）
+    未指定列的表返回除 LAZY_COLUMNS 外的全部列。
+    列名不合法时抛出 ValueError。
+    """
+    if not fields_param or not fields_param.strip():
+        return None
+
+    global_columns = None
+    table_columns = {}
+    for segment in fields_param.split(';'):
+        segment = segment.strip()
+        if not segment:
+            continue
+        if ':' in segment:
+            table_name, column_list = segment.split(':', 1)
+            table_name = table_name.strip()
+            if table_name not in tables:
+                raise ValueError(f"fields 中的表 '{table_name}' 不在查询的表中")
+            columns = {column.strip() for column in column_list.split(',') if column.strip()}
+            unknown = sorted(columns - set(MINDMAP_COLUMNS[table_name]))
+            if unknown:
+                raise ValueError(f"表 '{table_name}' 不存在列: {', '.join(unknown)}")
+            table_columns[table_name] = columns
+        else:
+            columns = {column.strip() for column in segment.split(',') if column.strip()}
+            known = set().union(*(MINDMAP_COLUMNS[table_name] for table_name in tables))
+            unknown = sorted(columns - known)
+            if unknown:
+                raise ValueError(f"不存在的列: {', '.join(unknown)}")
+            global_columns = (global_columns or set()) | columns
+
+    projection = {}
+    for table_name in tables:
+        selected = table_columns.get(table_name, global_columns)
+        if selected is None:
+            selected = set(MINDMAP_COLUMNS[table_name]) - set(LAZY_COLUMNS)
+        selected = selected | set(REQUIRED_COLUMNS)
+        if single_row:
+            selected |= set(LAZY_COLUMNS)
+        projection[table_name] = [column for column in MINDMAP_COLUMNS[table_name] if column in selected]
+    return projection
+
+def _select_list(table_name: str, columns: list = None) -> str:
+    """未指定列时查询该表 MINDMAP_COLUMNS 中的全部列"""
+    return ', '.join(f"`{column}`" for column in columns or MINDMAP_COLUMNS[table_name])
+
+def _to_json_value(value):
+    """把驱动返回的值转换为可直接 jsonify 的类型"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+def _rows_to_records(columns: list, rows: list) -> list:
+    """
+    游标结果直接转换为字典列表。
+    只对需要转换的列（DECIMAL → float、JSON/BLOB 字节 → str）逐个处理，其余列原样使用。
+    """
+    if not rows:
+        return []
+    convert_columns = []
+    for index in range(len(columns)):
+        sample = next((row[index] for row in rows if row[index] is not None), None)
+        if isinstance(sample, (Decimal, bytes, bytearray)):
+            convert_columns.append(index)
+    if convert_columns:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for index in convert_columns:
+                row[index] = _to_json_value(row[index])
+    return [dict(zip(columns, row)) for row in rows]
+
+def _fetch_user_rows(db_config: dict, table_name: str, user_id: str, limit: int = None, after_id: int = None,
+                     columns: list = None) -> list:
+    """
+    在连接池的一个连接上查询某张表中该用户的记录。
+    limit/after_id: 键集分页，按 id 升序返回 id > after_id 的前 limit 条（走 user_id 索引，无需 OFFSET 扫描）。
+    columns: 只查询这些列（已经过 parse_fields_param 校验），默认 MINDMAP_COLUMNS 中的全部列。
+    """
+    sql = f"SELECT {_select_list(table_name, columns)} FROM `{table_name}` WHERE user_id = %s"
+    params = [user_id]
+    if after_id is not None:
+        sql += " AND id > %s"
+        params.append(after_id)
+    if limit is not None:
+        sql += " ORDER BY id LIMIT %s"
+        params.append(limit)
+
+    conn = get_raw_connection(db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, tuple(params))
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()  # 归还连接到连接池
+    return _rows_to_records(columns, rows)
+
+def _count_user_rows(db_config: dict, table_name: str, user_id: str) -> int:
+    conn = get_raw_connection(db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM `{table_name}` WHERE user_id = %s", (user_id,))
+        count = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()
+    return int(count)
+
+def _collect_source_files(db_config: dict, result: dict) -> list:
+    """根据结果中出现的 source_file_name 获取文件元信息"""
+    source_files_set = {
+        record['source_file_name']
+        for table_name, records in result.items() if table_name != 'source_files'
+        for record in records if record.get('source_file_name')
+    }
+    return get_source_files_metadata(db_config, source_files_set)
+
+def get_source_files_metadata(db_config: dict, file_names) -> list:
+    """获取一组源文件的元信息"""
+    if not file_names:
+        return []
+    from .file_metadata import get_file_metadata_by_names
+    return get_file_metadata_by_names(db_config, list(file_names))
+
+def iter_user_records(db_config: dict, user_id: str, tables: list = None, after_id: int = None,
+                      projection: dict = None):
+    """
+    逐表、逐批流式读取用户的全部记录，产出 (表名, 记录字典)。
+    使用非缓冲（服务端）游标，每次只从服务器取 STREAM_FETCH_ROWS 行，服务端内存占用与用户的数据量无关。
+    表按顺序依次读取，同一时刻只占用一个连接。
+    projection: parse_fields_param 的结果，为None时查询全部列。
+    """
+    for table_name in tables or MINDMAP_TABLES:
+        columns = projection.get(table_name) if projection else None
+        sql = f"SELECT {_select_list(table_name, columns)} FROM `{table_name}` WHERE user_id = %s"
+        params = [user_id]
+        if after_id is not None:
+            sql += " AND id > %s ORDER BY id"
+            params.append(after_id)
+
+        conn = get_raw_connection(db_config)
+        completed = False
+        try:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(sql, tuple(params))
+            columns = [desc[0] for desc in cursor.description]
+            while True:
+                rows = cursor.fetchmany(STREAM_FETCH_ROWS)
+                if not rows:
+                    break
+                for record in _rows_to_records(columns, rows):
+                    yield table_name, record
+            cursor.close()
+            completed = True
+        finally:
+            if completed:
+                conn.close()  # 归还连接到连接池
+            else:
+                # 客户端中途断开时游标里还有未读完的结果，这个连接不能再放回连接池
+                conn.invalidate()
+
 def get_data_from_db(db_config: dict, user_id: str):
     """
     根据用户ID从数据库获取所有5个表的相关数据。
+    5张表的查询在连接池的多个连接上并发执行，结果直接从游标转换为可JSON序列化的字典。
     返回格式: {
         "users": [...],
         "transactions": [...],
@@ -16,61 +226,20 @@ def get_data_from_db(db_config: dict, user_id: str):
     }
     """
     print(f"准备从数据库中为用户 '{user_id}' 查询所有相关数据...")
-    engine = get_db_engine(db_config)
-    
-    result = {
-        "users": [],
-        "transactions": [],
-        "asset_movements": [],
-        "login_logs": [],
-        "devices": [],
-        "source_files": []
-    }
-    
-    # 查询所有表的数据
-    tables = [
-        ("users", "SELECT * FROM users WHERE user_id = %s"),
-        ("transactions", "SELECT * FROM transactions WHERE user_id = %s"),
-        ("asset_movements", "SELECT * FROM asset_movements WHERE user_id = %s"),
-        ("login_logs", "SELECT * FROM login_logs WHERE user_id = %s"),
-        ("devices", "SELECT * FROM devices WHERE user_id = %s")
-    ]
     
     try:
-        source_files_set = set()
+        futures = {
+            table_name: _query_executor.submit(_fetch_user_rows, db_config, table_name, user_id)
+            for table_name in MINDMAP_TABLES
+        }
         
-        for table_name, query in tables:
-            print(f"查询 {table_name} 表...")
-            df = pd.read_sql(query, engine, params=(user_id,))
-            
-            # 转换为字典列表，处理NaN值
-            records = []
-            for _, row in df.iterrows():
-                record = {}
-                for col in df.columns:
-                    value = row[col]
-                    if pd.isna(value):
-                        record[col] = None
-                    else:
-                        record[col] = value
-                records.append(record)
-            
-            result[table_name] = records
-            print(f"从 {table_name} 表获取到 {len(records)} 条记录")
-            
-            # 收集源文件信息
-            for record in records:
-                if record.get('source_file_name'):
-                    source_files_set.add(record['source_file_name'])
+        result = {}
+        for table_name, future in futures.items():
+            result[table_name] = future.result()
+            print(f"从 {table_name} 表获取到 {len(result[table_name])} 条记录")
         
         # 处理源文件列表 - 获取详细信息
-        if source_files_set:
-            from .file_metadata import get_file_metadata_by_names
-            file_metadata_list = get_file_metadata_by_names(db_config, list(source_files_set))
-            result["source_files"] = file_metadata_list
-        else:
-            result["source_files"] = []
-        
+        result["source_files"] = _collect_source_files(db_config, result)
         print(f"共涉及 {len(result['source_files'])} 个源文件，已获取详细信息")
         
         return result
@@ -79,6 +248,57 @@ def get_data_from_db(db_config: dict, user_id: str):
         print(f"数据库查询失败: {e}")
         return None
 
+def get_data_page_from_db(db_config: dict, user_id: str, tables: list, limit: int, after_id: int = None,
+                          projection: dict = None):
+    """
+    键集分页获取用户数据：每张表按 id 升序返回 id > after_id 的最多 limit 条。
+    projection: parse_fields_param 的结果，只查询其中的列；为None时查询全部列。
+    返回 (数据, 分页信息)，数据格式与 get_data_from_db 相同（只包含请求的表）；
+    分页信息: {表名: {"returned": 条数, "has_more": 是否还有下一页, "next_after_id": 下一页的 after_id}}
+    查询失败时返回 (None, None)。
+    """
+    print(f"分页查询用户 '{user_id}' 的数据: 表={tables}, limit={limit}, after_id={after_id}")
+    try:
+        # 多取一条用于判断是否还有下一页
+        futures = {
+            table_name: _query_executor.submit(_fetch_user_rows, db_config, table_name, user_id, limit + 1, after_id,
+                                               projection.get(table_name) if projection else None)
+            for table_name in tables
+        }
+        
+        result = {}
+        pagination = {}
+        for table_name, future in futures.items():
+            records = future.result()
+            has_more = len(records) > limit
+            records = records[:limit]
+            result[table_name] = records
+            pagination[table_name] = {
+                "returned": len(records),
+                "has_more": has_more,
+                "next_after_id": records[-1]['id'] if has_more else None
+            }
+        
+        result["source_files"] = _collect_source_files(db_config, result)
+        return result, pagination
+        
+    except Exception as e:
+        print(f"数据库分页查询失败: {e}")
+        return None, None
+
+def count_user_rows(db_config: dict, user_id: str, tables: list = None):
+    """只统计用户在各表中的记录数: {表名: 条数}，查询失败返回None"""
+    tables = tables or MINDMAP_TABLES
+    try:
+        futures = {
+            table_name: _query_executor.submit(_count_user_rows, db_config, table_name, user_id)
+            for table_name in tables
+        }
+        return {table_name: future.result() for table_name, future in futures.items()}
+    except Exception as e:
+        print(f"统计用户记录数失败: {e}")
+        return None
+
 def search_users_by_fuzzy_term(db_config: dict, search_term: str):
     """
     通过模糊查找在多个表中搜索用户信息
@@ -199,4 +419,92 @@ def search_users_by_fuzzy_term(db_config: dict, search_term: str):
         
     except Exception as e:
         print(f"模糊查找失败: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def _escape_like(value: str) -> str:
+    """转义 LIKE 通配符，使搜索词按字面匹配（MySQL 默认转义字符为反斜杠）"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_users_by_index(db_config: dict, search_term: str, limit: int = SEARCH_RESULT_LIMIT, query_type=None):
+    """
+    通过 search_index 表查找用户：精确匹配排在前面，其次是前缀匹配，均可走 normalized_value 上的索引。
+    query_type: classify_search_query() 的识别结果。提供时只按对应的字段类型做一次等值或前缀查找；
+                未提供（自由文本）时在所有字段类型中做前缀匹配：统一小写，含数字时额外按"仅数字"匹配手机号。
+    返回格式与 search_users_by_fuzzy_term 相同，没有匹配时返回空列表，查询失败返回None。
+    """
+    term = search_term.strip()
+    if not term:
+        return []
+    print(f"开始索引查找用户信息，搜索词: '{term}' (类型: {query_type.kind if query_type else '自由文本'})")
+    engine = get_db_engine(db_config)
+
+    bind_params = []
+    if query_type is not None:
+        params = {'field_types': list(query_type.field_types), 'limit': limit}
+        bind_params.append(bindparam('field_types', expanding=True))
+        if query_type.exact:
+            params['values'] = list(query_type.values)
+            bind_params.append(bindparam('values', expanding=True))
+            where_clause = "si.normalized_value IN :values AND si.field_type IN :field_types"
+            order_clause = "si.user_id"
+        else:
+            value = query_type.values[0]
+            params.update({'exact': value, 'prefix': _escape_like(value) + '%'})
+            where_clause = "si.normalized_value LIKE :prefix AND si.field_type IN :field_types"
+            order_clause = "(si.normalized_value = :exact) DESC, si.user_id"
+    else:
+        exact = term.lower()[:MAX_VALUE_LENGTH]
+        params = {'exact': exact, 'prefix': _escape_like(exact) + '%', 'limit': limit}
+        conditions = ["si.normalized_value LIKE :prefix"]
+        exact_checks = ["si.normalized_value = :exact"]
+        # 只有由数字和电话分隔符组成的搜索词才额外按手机号匹配，避免 "abc_1" 之类的文本匹配到所有1开头的号码
+        phone_digits = normalize_search_value('phone', term) if PHONE_LIKE_PATTERN.match(term) else None
+        if phone_digits and phone_digits != exact:
+            params.update({'phone_exact': phone_digits, 'phone_prefix': phone_digits + '%'})
+            conditions.append("(si.field_type = 'phone' AND si.normalized_value LIKE :phone_prefix)")
+            exact_checks.append("(si.field_type = 'phone' AND si.normalized_value = :phone_exact)")
+        where_clause = ' OR '.join(conditions)
+        order_clause = f"({' OR '.join(exact_checks)}) DESC, si.user_id"
+
+    query = text(f"""
+    SELECT si.user_id, u.name, u.phone_number, u.email, si.source, si.source_table,
+           si.field_type, si.normalized_value
+    FROM {SEARCH_INDEX_TABLE} si
+    LEFT JOIN users u ON si.user_id = u.user_id
+    WHERE {where_clause}
+    ORDER BY {order_clause}
+    LIMIT :limit
+    """).bindparams(*bind_params)
+
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(query, params).mappings().all()
+        print(f"索引查找完成，命中 {len(rows)} 条索引记录")
+
+        # 按 (用户, 来源表) 合并命中的字段，保持精确匹配优先的顺序
+        grouped = {}
+        for row in rows:
+            key = (row['user_id'], row['source_table'])
+            if key not in grouped:
+                grouped[key] = {
+                    'user_id': row['user_id'],
+                    'name': row['name'] or '',
+                    'phone_number': row['phone_number'] or '',
+                    'email': row['email'] or '',
+                    'source': row['source'] or '',
+                    'match_type': TABLE_MATCH_TYPES.get(row['source_table'], row['source_table'] or ''),
+                    'details': []
+                }
+            detail = f"{FIELD_LABELS.get(row['field_type'], row['field_type'])}: {row['normalized_value']}"
+            if detail not in grouped[key]['details']:
+                grouped[key]['details'].append(detail)
+
+        results = []
+        for result in grouped.values():
+            result['match_details'] = ' | '.join(result.pop('details'))
+            results.append(result)
+        return results
+
+    except Exception as e:
+        print(f"索引查找失败: {e}")
+        return None
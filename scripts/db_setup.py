@@ -22,7 +22,9 @@ TABLE_NAMES = [
     'asset_movements',
     'login_logs',
     'devices',
-    'file_metadata'
+    'file_metadata',
+    'search_index',   # 用户搜索索引（由 db_migrate.py 创建）
+    'schema_version'  # 迁移版本表（见 db_migrate.py），重建后索引随表一起删除，版本记录也需清空
 ]
 
 
@@ -40,7 +42,8 @@ TABLE_DEFINITIONS = [
         phone_number VARCHAR(100),
         email VARCHAR(255),
         source_file_name TEXT,
-        extra_data JSON
+        extra_data JSON,
+        row_fingerprint CHAR(40) COMMENT '记录指纹（增量导入）'
     );
     """,
     # -- 表2: 统一交易记录表 --
@@ -61,7 +64,8 @@ TABLE_DEFINITIONS = [
         fee DECIMAL(36, 18),
         fee_asset VARCHAR(50),
         source_file_name TEXT,
-        extra_data JSON
+        extra_data JSON,
+        row_fingerprint CHAR(40) COMMENT '记录指纹（增量导入）'
     );
     """,
     # -- 表3: 统一充提记录表 --
@@ -79,7 +83,8 @@ TABLE_DEFINITIONS = [
         transaction_time DATETIME,
         status VARCHAR(100),
         source_file_name TEXT,
-        extra_data JSON
+        extra_data JSON,
+        row_fingerprint CHAR(40) COMMENT '记录指纹（增量导入）'
     );
     """,
     # -- 表4: 统一登录日志表 --
@@ -92,7 +97,8 @@ TABLE_DEFINITIONS = [
         login_ip VARCHAR(100),
         device_id VARCHAR(255),
         source_file_name TEXT,
-        extra_data JSON
+        extra_data JSON,
+        row_fingerprint CHAR(40) COMMENT '记录指纹（增量导入）'
     );
     """,
     # -- 表5: 统一设备信息表 --
@@ -106,7 +112,8 @@ TABLE_DEFINITIONS = [
         ip_address VARCHAR(100),
         add_time DATETIME,
         source_file_name TEXT,
-        extra_data JSON
+        extra_data JSON,
+        row_fingerprint CHAR(40) COMMENT '记录指纹（增量导入）'
     );
     """,
     # -- 表6: 文件元信息表 --
@@ -124,11 +131,13 @@ TABLE_DEFINITIONS = [
         status ENUM('uploaded', 'processing', 'processed', 'error') DEFAULT 'uploaded' COMMENT '处理状态',
         processed_time TIMESTAMP NULL COMMENT '处理完成时间',
         error_message TEXT COMMENT '错误信息（如果有）',
+        content_hash CHAR(64) NULL COMMENT '文件内容的SHA-256',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
         INDEX idx_platform (platform),
         INDEX idx_status (status),
-        INDEX idx_upload_time (upload_time)
+        INDEX idx_upload_time (upload_time),
+        INDEX idx_content_hash (content_hash)
     ) COMMENT='文件元信息表，记录上传文件的详细信息';
     """
 ]
@@ -164,6 +173,7 @@ def initialize_database():
             connection.commit()
         
         print("\n✅ 数据库重置成功！所有核心表都已被清空并重新创建。")
+        print("💡 请运行 python scripts/db_migrate.py migrate 创建查询索引。")
 
     except Exception as e:
         print(f"❌ 数据库重置失败: {e}")
@@ -1,15 +1,51 @@
 # scripts/file_metadata.py - 文件元信息管理
 import os
+import hashlib
 from pathlib import Path
 from datetime import datetime
 import pandas as pd
 from sqlalchemy import text
-from .utils import get_db_engine
+from .utils import get_db_engine, get_raw_connection
 
-def insert_file_metadata(db_config: dict, file_path: str, original_filename: str = None, platform: str = None):
+# 计算内容哈希时每次读取的字节数
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# MySQL 错误码：列不存在（未执行迁移的旧表缺少可选列时出现）
+MYSQL_UNKNOWN_COLUMN = 1054
+
+def _is_unknown_column(error: Exception, column: str) -> bool:
+    return getattr(error, 'errno', None) == MYSQL_UNKNOWN_COLUMN and column in str(error)
+
+def save_stream_with_hash(stream, file_path, chunk_size: int = HASH_CHUNK_BYTES) -> str:
+    """
+    把上传的文件流写入磁盘，同时计算内容的 SHA-256，返回十六进制哈希。
+    只读一遍数据，不需要写完后再读一次文件。
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as output:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            output.write(chunk)
+    return digest.hexdigest()
+
+def compute_file_hash(file_path, chunk_size: int = HASH_CHUNK_BYTES) -> str:
+    """计算磁盘上已有文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def insert_file_metadata(db_config: dict, file_path: str, original_filename: str = None, platform: str = None,
+                         content_hash: str = None):
     """
     插入文件元信息到数据库
+    content_hash: 文件内容的 SHA-256（需要已执行迁移 v3），用于识别重复上传的相同文件
     """
+    conn = None
     try:
         file_path = Path(file_path)
         
@@ -26,78 +62,81 @@ def insert_file_metadata(db_config: dict, file_path: str, original_filename: str
         if platform is None:
             platform = infer_platform_from_filename(file_path.name)
         
-        engine = get_db_engine(db_config)
-        
-        # 检查文件是否已存在
-        import mysql.connector
-        conn = mysql.connector.connect(
-            host=db_config.get('host', '127.0.0.1'),
-            port=db_config.get('port', 3306),
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['db_name'],
-            charset='utf8mb4'
-        )
+        # 检查文件是否已存在（连接来自共享连接池）
+        conn = get_raw_connection(db_config)
         cursor = conn.cursor()
         
+        # content_hash 列由迁移 v3 添加，只在提供哈希时写入；未迁移的库缺少该列时不写哈希重试
+        fields = {
+            'original_filename': original_filename,
+            'file_size': file_size,
+            'file_type': file_type,
+            'platform': platform,
+            'file_path': str(file_path)
+        }
+        if content_hash is not None:
+            fields['content_hash'] = content_hash
+        
         check_query = "SELECT id FROM file_metadata WHERE file_name = %s"
         cursor.execute(check_query, (file_path.name,))
         existing = cursor.fetchall()
         
-        if existing:
-            # 更新现有记录
-            update_query = """
-            UPDATE file_metadata 
-            SET original_filename = %s, file_size = %s, file_type = %s, 
-                platform = %s, file_path = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE file_name = %s
-            """
-            cursor.execute(update_query, (
-                original_filename, file_size, file_type, 
-                platform, str(file_path), file_path.name
-            ))
-            conn.commit()
-            print(f"更新文件元信息: {file_path.name}")
-        else:
-            # 插入新记录
-            insert_query = """
-            INSERT INTO file_metadata 
-            (file_name, original_filename, file_size, file_type, platform, file_path)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(insert_query, (
-                file_path.name, original_filename, file_size, 
-                file_type, platform, str(file_path)
-            ))
-            conn.commit()
-            print(f"插入文件元信息: {file_path.name}")
+        try:
+            _write_file_metadata(conn, cursor, file_path.name, fields, bool(existing))
+        except Exception as e:
+            if 'content_hash' not in fields or not _is_unknown_column(e, 'content_hash'):
+                raise
+            print("⚠️ file_metadata 表还没有 content_hash 列（请执行 python scripts/db_migrate.py migrate），不记录内容哈希")
+            del fields['content_hash']
+            _write_file_metadata(conn, cursor, file_path.name, fields, bool(existing))
         
         cursor.close()
-        conn.close()
         return True
         
     except Exception as e:
         print(f"插入文件元信息失败: {e}")
         return False
+    finally:
+        if conn is not None:
+            conn.close()  # 归还连接到连接池
+
+def _write_file_metadata(conn, cursor, file_name: str, fields: dict, existing: bool):
+    """按字段插入或更新一条文件元信息并提交"""
+    if existing:
+        # 更新现有记录
+        assignments = ', '.join(f"{column} = %s" for column in fields)
+        update_query = f"""
+        UPDATE file_metadata 
+        SET {assignments}, updated_at = CURRENT_TIMESTAMP
+        WHERE file_name = %s
+        """
+        cursor.execute(update_query, tuple(fields.values()) + (file_name,))
+        conn.commit()
+        print(f"更新文件元信息: {file_name}")
+    else:
+        # 插入新记录
+        columns = ', '.join(['file_name'] + list(fields))
+        placeholders = ', '.join(['%s'] * (len(fields) + 1))
+        insert_query = f"""
+        INSERT INTO file_metadata 
+        ({columns})
+        VALUES ({placeholders})
+        """
+        cursor.execute(insert_query, (file_name,) + tuple(fields.values()))
+        conn.commit()
+        print(f"插入文件元信息: {file_name}")
 
 def get_file_metadata_by_names(db_config: dict, file_names: list):
     """
     根据文件名列表获取文件元信息
     """
+    conn = None
     try:
         if not file_names:
             return []
         
-        # 使用原始mysql连接
-        import mysql.connector
-        conn = mysql.connector.connect(
-            host=db_config.get('host', '127.0.0.1'),
-            port=db_config.get('port', 3306),
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['db_name'],
-            charset='utf8mb4'
-        )
+        # 使用连接池中的原始mysql连接
+        conn = get_raw_connection(db_config)
         
         # 构建IN查询
         placeholders = ','.join(['%s'] * len(file_names))
@@ -127,7 +166,6 @@ def get_file_metadata_by_names(db_config: dict, file_names: list):
         columns = [desc[0] for desc in cursor.description]
         rows = cursor.fetchall()
         cursor.close()
-        conn.close()
         
         # 转换为字典列表
         results = []
@@ -151,35 +189,28 @@ def get_file_metadata_by_names(db_config: dict, file_names: list):
     except Exception as e:
         print(f"获取文件元信息失败: {e}")
         return []
+    finally:
+        if conn is not None:
+            conn.close()  # 归还连接到连接池
 
 def update_file_record_count(db_config: dict, file_name: str, record_count: int):
     """
     更新文件的记录数量
     """
+    conn = None
     try:
-        engine = get_db_engine(db_config)
-        
         update_query = """
         UPDATE file_metadata 
         SET record_count = %s, status = 'processed', processed_time = CURRENT_TIMESTAMP
         WHERE file_name = %s
         """
         
-        # 使用原始连接执行
-        import mysql.connector
-        conn = mysql.connector.connect(
-            host=db_config.get('host', '127.0.0.1'),
-            port=db_config.get('port', 3306),
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['db_name'],
-            charset='utf8mb4'
-        )
+        # 使用连接池中的原始连接执行
+        conn = get_raw_connection(db_config)
         cursor = conn.cursor()
         cursor.execute(update_query, (record_count, file_name))
         conn.commit()
         cursor.close()
-        conn.close()
             
         print(f"更新文件 {file_name} 的记录数: {record_count}")
         return True
@@ -187,6 +218,77 @@ def update_file_record_count(db_config: dict, file_name: str, record_count: int)
     except Exception as e:
         print(f"更新文件记录数失败: {e}")
         return False
+    finally:
+        if conn is not None:
+            conn.close()  # 归还连接到连接池
+
+def update_file_status(db_config: dict, file_name: str, status: str, error_message: str = None):
+    """
+    更新文件的处理状态（uploaded/processing/processed/error）
+    error_message: 可选的说明，写入 error_message 列（迁移 v5 之前的旧表可能没有该列，此时只更新状态）
+    """
+    conn = None
+    try:
+        conn = get_raw_connection(db_config)
+        cursor = conn.cursor()
+        if error_message is not None:
+            try:
+                cursor.execute("UPDATE file_metadata SET status = %s, error_message = %s WHERE file_name = %s",
+                               (status, error_message, file_name))
+                error_message_written = True
+            except Exception as e:
+                if not _is_unknown_column(e, 'error_message'):
+                    raise
+                print("⚠️ file_metadata 表还没有 error_message 列（请执行 python scripts/db_migrate.py migrate），只更新状态")
+                error_message_written = False
+        if error_message is None or not error_message_written:
+            cursor.execute("UPDATE file_metadata SET status = %s WHERE file_name = %s", (status, file_name))
+        conn.commit()
+        cursor.close()
+        return True
+        
+    except Exception as e:
+        print(f"更新文件状态失败: {e}")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()  # 归还连接到连接池
+
+def find_processed_file_by_hash(db_config: dict, content_hash: str, exclude_file_name: str = None):
+    """
+    查找内容哈希相同、且已成功处理的文件，返回最近处理的一条 {file_name, platform, record_count}；
+    没有找到（或尚未执行迁移 v3、查询失败）时返回None。
+    """
+    conn = None
+    try:
+        query = """
+        SELECT file_name, platform, record_count
+        FROM file_metadata
+        WHERE content_hash = %s AND status = 'processed' AND file_name <> %s
+        ORDER BY processed_time DESC
+        LIMIT 1
+        """
+        
+        conn = get_raw_connection(db_config)
+        cursor = conn.cursor()
+        cursor.execute(query, (content_hash, exclude_file_name or ''))
+        row = cursor.fetchone()
+        cursor.close()
+        
+        if row is None:
+            return None
+        return {
+            'file_name': row[0],
+            'platform': row[1],
+            'record_count': int(row[2]) if row[2] is not None else 0
+        }
+        
+    except Exception as e:
+        print(f"按内容哈希查找文件失败: {e}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()  # 归还连接到连接池
 
 def infer_platform_from_filename(filename: str):
     """
@@ -227,6 +329,8 @@ def create_file_metadata_table(db_config: dict):
             processed_time TIMESTAMP NULL,
             record_count INT DEFAULT 0,
             status ENUM('uploaded', 'processing', 'processed', 'error') DEFAULT 'uploaded',
+            content_hash CHAR(64) NULL,
+            error_message TEXT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
         )
@@ -239,6 +343,7 @@ def create_file_metadata_table(db_config: dict):
             conn.execute("CREATE INDEX IF NOT EXISTS idx_file_name ON file_metadata(file_name)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_time ON file_metadata(upload_time)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_platform ON file_metadata(platform)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_content_hash ON file_metadata(content_hash)")
             
             conn.commit()
             
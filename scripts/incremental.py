@@ -0,0 +1,216 @@
+# scripts/incremental.py - 增量重新导入
+# 办案人员经常为同一账户上传更新后的导出文件，新文件通常包含旧文件的全部记录，只多出少量新记录。
+# 每条写入核心表的记录都带有稳定的指纹 row_fingerprint：
+#   sha1(除 id、source_file_name 外全部列的值 + 相同内容在本文件中的出现序号)
+# 增量模式下，把新文件每张表的记录与被它取代的旧文件（调用方明确给出的 source_file_name 列表）中
+# 同一账户（user_id + source）已存储的指纹比较：只插入新出现的记录、只删除不再出现的记录，
+# 未变化的记录不重新写入，只把 source_file_name 改为新文件（连同搜索索引），新文件拥有自己的全部内容，
+# 之后的增量导入只需取代上一个文件。其他文件的数据（如同一账户分多次导出的报告）不受影响。
+# 指纹按生产线分别计算（整表写入和增量写入相同），同一张表的多条生产线可能产生相同的指纹，比较时按多重集合处理。
+# 指纹列由 db_migrate.py 的迁移 v4 添加。
+import hashlib
+from typing import NamedTuple
+import pandas as pd
+from sqlalchemy import bindparam, text
+from .utils import write_df_to_db
+from .search_index import SEARCH_INDEX_TABLE, search_index_available, write_search_index
+
+FINGERPRINT_COLUMN = 'row_fingerprint'
+
+# 不参与指纹计算的列：同一条记录出现在不同文件中时这些列会变化
+FINGERPRINT_EXCLUDED_COLUMNS = {'id', 'source_file_name', FINGERPRINT_COLUMN}
+
+# 按 user_id 查询已有指纹、按 id 删除记录时每条语句的参数个数
+QUERY_CHUNK_SIZE = 1000
+
+# 已确认存在指纹列的表（只缓存存在的结果，执行迁移后无需重启即可生效）
+_fingerprint_tables = set()
+
+
+class IncrementalResult(NamedTuple):
+    """一张表增量写入的结果"""
+    inserted_rows: pd.DataFrame   # 实际插入的记录（用于写搜索索引）
+    deleted: int                  # 删除的不再出现的记录数
+    unchanged: int                # 未变化、不重新写入的记录数
+    relinked: int                 # 未变化的记录中从旧文件转移到新文件的记录数
+    affected_users: set           # 有插入、删除或转移的 user_id
+
+
+def fingerprint_column_available(connection, table_name: str) -> bool:
+    """表中是否已有指纹列（未执行迁移 v4、或查询失败时返回False）"""
+    if table_name in _fingerprint_tables:
+        return True
+    try:
+        exists = connection.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column LIMIT 1"
+        ), {'table': table_name, 'column': FINGERPRINT_COLUMN}).first()
+    except Exception as e:
+        print(f"    ⚠️ 检查指纹列失败: {e}")
+        return False
+    if exists:
+        _fingerprint_tables.add(table_name)
+    return bool(exists)
+
+
+def _fingerprint_value(value) -> str:
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return '\x00'
+    return str(value)
+
+
+def compute_row_fingerprints(df: pd.DataFrame) -> pd.Series:
+    """
+    计算每条记录的指纹（40位十六进制），返回与 df 同索引的Series。
+    内容完全相同的多条记录按出现顺序带上序号，各自得到不同的指纹，重复记录不会被合并。
+    """
+    columns = sorted(column for column in df.columns if column not in FINGERPRINT_EXCLUDED_COLUMNS)
+    contents = pd.Series([
+        '\x1f'.join(f"{column}={_fingerprint_value(value)}" for column, value in zip(columns, row))
+        for row in df[columns].itertuples(index=False, name=None)
+    ], index=df.index, dtype=object)
+    ordinals = contents.groupby(contents, sort=False).cumcount()
+    return pd.Series([
+        hashlib.sha1(f"{content}\x1e{ordinal}".encode('utf-8')).hexdigest()
+        for content, ordinal in zip(contents, ordinals)
+    ], index=df.index, dtype=object)
+
+
+def add_row_fingerprints(df: pd.DataFrame) -> pd.DataFrame:
+    """返回带有指纹列的副本"""
+    df = df.copy()
+    df[FINGERPRINT_COLUMN] = compute_row_fingerprints(df)
+    return df
+
+
+def _scope_keys(user_ids: pd.Series, sources: pd.Series) -> pd.Series:
+    """(user_id, source) 组合键，空值统一为同一个标记"""
+    return user_ids.map(_fingerprint_value) + '\x1f' + sources.map(_fingerprint_value)
+
+
+def _load_stored_fingerprints(connection, table_name: str, file_names: list, user_ids: list,
+                              include_null_user: bool) -> pd.DataFrame:
+    """读取这些源文件中、这些用户在表中已存储的 id、user_id、source、source_file_name 和指纹"""
+    columns = ['id', 'user_id', 'source', 'source_file_name', FINGERPRINT_COLUMN]
+    select = (f"SELECT id, user_id, source, source_file_name, {FINGERPRINT_COLUMN} FROM `{table_name}` "
+              f"WHERE source_file_name IN :file_names")
+    frames = []
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        query = text(f"{select} AND user_id IN :user_ids").bindparams(
+            bindparam('file_names', expanding=True), bindparam('user_ids', expanding=True))
+        rows = connection.execute(query, {'file_names': file_names,
+                                          'user_ids': user_ids[start:start + QUERY_CHUNK_SIZE]}).fetchall()
+        frames.append(pd.DataFrame(rows, columns=columns))
+    if include_null_user:
+        query = text(f"{select} AND user_id IS NULL").bindparams(bindparam('file_names', expanding=True))
+        rows = connection.execute(query, {'file_names': file_names}).fetchall()
+        frames.append(pd.DataFrame(rows, columns=columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _occurrence_keys(fingerprints: pd.Series) -> pd.Series:
+    """指纹 + 该指纹的出现序号，用于按多重集合比较（相同指纹出现几次就匹配几次）"""
+    ordinals = fingerprints.groupby(fingerprints, sort=False).cumcount()
+    return fingerprints + '#' + ordinals.astype(str)
+
+
+def _execute_by_ids(connection, sql: str, ids: list, params: dict = None):
+    """按 id 分批执行 sql（其中以 :ids 表示 id 列表）"""
+    for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+        statement = text(sql).bindparams(bindparam('ids', expanding=True))
+        connection.execute(statement, {**(params or {}), 'ids': ids[start:start + QUERY_CHUNK_SIZE]})
+
+
+def write_incremental(df: pd.DataFrame, table_name: str, db_config: dict, connection,
+                      file_name: str, superseded_files: list, method: str = 'to_sql') -> IncrementalResult:
+    """
+    增量写入一张表：df 为新文件 file_name 中该表的全部记录（同一张表的多条生产线合并后一次传入，
+    每条生产线的结果已由 add_row_fingerprints 分别计算指纹）。
+    比较范围是 superseded_files 中的源文件里、df 中出现的每个 (user_id, source) 的记录：
+      - 指纹不在库中的记录插入
+      - 范围内指纹不在 df 中的记录删除（包括没有指纹的历史记录）
+      - 指纹相同的记录保留，source_file_name 改为 file_name
+    connection: 本次导入的事务连接，先删除后插入（users 表的 user_id 唯一键要求如此）。
+    """
+    if FINGERPRINT_COLUMN not in df.columns:
+        df = add_row_fingerprints(df)
+    user_ids = df['user_id'] if 'user_id' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    sources = df['source'] if 'source' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    scope = set(_scope_keys(user_ids, sources))
+
+    stored = _load_stored_fingerprints(
+        connection, table_name, list(superseded_files),
+        sorted({str(user_id) for user_id in user_ids.dropna()}),
+        include_null_user=bool(user_ids.isna().any())
+    )
+    stored = stored[_scope_keys(stored['user_id'], stored['source']).isin(scope)]
+
+    # 没有指纹的历史记录无法比较，全部视为不再出现
+    fingerprinted = stored[stored[FINGERPRINT_COLUMN].notna()]
+    stored_keys = _occurrence_keys(fingerprinted[FINGERPRINT_COLUMN].astype(str))
+    new_keys = _occurrence_keys(df[FINGERPRINT_COLUMN].astype(str))
+    matched = stored_keys.isin(set(new_keys))
+    stale = pd.concat([stored[stored[FINGERPRINT_COLUMN].isna()], fingerprinted[~matched]])
+    relinked = fingerprinted[matched & (fingerprinted['source_file_name'] != file_name)]
+    inserted_rows = df[~new_keys.isin(set(stored_keys))]
+
+    stale_ids = [int(row_id) for row_id in stale['id']]
+    _execute_by_ids(connection, f"DELETE FROM `{table_name}` WHERE id IN :ids", stale_ids)
+    _execute_by_ids(connection, f"UPDATE `{table_name}` SET source_file_name = :file_name WHERE id IN :ids",
+                    [int(row_id) for row_id in relinked['id']], {'file_name': file_name})
+    if not inserted_rows.empty:
+        write_df_to_db(inserted_rows, table_name, db_config, connection=connection, method=method)
+
+    affected_users = set(stale['user_id'].dropna().astype(str)) | set(relinked['user_id'].dropna().astype(str))
+    if 'user_id' in inserted_rows.columns:
+        affected_users.update(inserted_rows['user_id'].dropna().astype(str))
+    print(f"    🔁 '{table_name}' 增量写入: 新增 {len(inserted_rows)} 条，删除 {len(stale_ids)} 条，"
+          f"未变化 {len(df) - len(inserted_rows)} 条（其中 {len(relinked)} 条从旧文件转移）")
+    return IncrementalResult(
+        inserted_rows=inserted_rows,
+        deleted=len(stale_ids),
+        unchanged=len(df) - len(inserted_rows),
+        relinked=len(relinked),
+        affected_users=affected_users
+    )
+
+
+def write_incremental_search_index(df: pd.DataFrame, table_name: str, db_config: dict, connection,
+                                   superseded_files: list, method: str = 'to_sql') -> int:
+    """
+    增量写入后重建该表在比较范围内的搜索索引：删除 superseded_files 中 df 涉及的 (user_id, source)
+    来自该表的索引条目（对应的记录已删除或已转移到新文件），再按 df 的全部记录写入新文件的索引。
+    返回写入的索引条数；索引表不存在时由 write_search_index 打印警告并跳过。
+    """
+    try:
+        _delete_scoped_search_index(df, table_name, connection, superseded_files)
+    except Exception as e:
+        print(f"    ⚠️ 清理旧文件的搜索索引失败（可稍后执行 python -m scripts.search_index rebuild 重建）: {e}")
+    return write_search_index(table_name, df, db_config, connection=connection, method=method)
+
+
+def _delete_scoped_search_index(df: pd.DataFrame, table_name: str, connection, superseded_files: list):
+    """删除 superseded_files 中 df 涉及的 (user_id, source) 来自该表的索引条目"""
+    if 'user_id' not in df.columns or not search_index_available(connection):
+        return
+    sources = df['source'] if 'source' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    scope = set(_scope_keys(df['user_id'].map(lambda value: str(value).strip() if pd.notna(value) else None), sources))
+    user_ids = sorted({str(user_id).strip() for user_id in df['user_id'].dropna()})
+    columns = ['id', 'user_id', 'source']
+    frames = []
+    for start in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+        query = text(
+            f"SELECT id, user_id, source FROM {SEARCH_INDEX_TABLE} "
+            f"WHERE source_table = :table AND source_file_name IN :file_names AND user_id IN :user_ids"
+        ).bindparams(bindparam('file_names', expanding=True), bindparam('user_ids', expanding=True))
+        rows = connection.execute(query, {'table': table_name, 'file_names': list(superseded_files),
+                                          'user_ids': user_ids[start:start + QUERY_CHUNK_SIZE]}).fetchall()
+        frames.append(pd.DataFrame(rows, columns=columns))
+    if not frames:
+        return
+    entries = pd.concat(frames, ignore_index=True)
+    entries = entries[_scope_keys(entries['user_id'], entries['source']).isin(scope)]
+    _execute_by_ids(connection, f"DELETE FROM {SEARCH_INDEX_TABLE} WHERE id IN :ids",
+                    [int(entry_id) for entry_id in entries['id']])
@@ -0,0 +1,133 @@
+# scripts/job_queue.py - ETL后台任务队列
+# 上传接口只负责保存文件并登记任务，真正的ETL在有界线程池中执行，
+# 前端通过 /api/jobs/<job_id> 轮询任务状态、当前阶段和行数统计。
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 任务状态 ---
+JOB_STATE_QUEUED = 'queued'
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_SUCCEEDED = 'succeeded'
+JOB_STATE_FAILED = 'failed'
+
+# --- ETL阶段（与 run_etl_process_for_file 中的 progress_callback 一一对应） ---
+JOB_STAGES = ['queued', 'template_match', 'extract', 'transform', 'write', 'done']
+
+# --- 默认并发配置 ---
+DEFAULT_MAX_WORKERS = 2         # 同时执行的ETL任务数量上限
+DEFAULT_MAX_FINISHED_JOBS = 200 # 内存中最多保留的已结束任务数量
+
+
+class ETLJobQueue:
+    """
+    有界的ETL任务队列。
+    任务函数需要接受 progress_callback 关键字参数，并返回 (是否成功, 消息/错误对象)。
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS,
+                 error_formatter=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='etl-job')
+        self._jobs = {}
+        self._finished_order = []
+        self._lock = threading.Lock()
+        self._max_finished_jobs = max_finished_jobs
+        # 将失败结果（ETLError等）转换为可JSON序列化的字典
+        self._error_formatter = error_formatter
+
+    def submit(self, func, *args, metadata: dict = None, **kwargs) -> str:
+        """登记并提交一个ETL任务，立即返回任务ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            'job_id': job_id,
+            'state': JOB_STATE_QUEUED,
+            'stage': 'queued',
+            'message': None,
+            'error': None,
+            'counts': {
+                'rows_extracted': 0,
+                'rows_written': 0,
+                'tables': {}
+            },
+            'metadata': metadata or {},
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+
+        def progress_callback(stage: str, **counts):
+            self._update_progress(job_id, stage, counts)
+
+        self._executor.submit(self._run, job_id, func, args, kwargs, progress_callback)
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        """返回任务状态的快照，任务不存在时返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot['counts'] = dict(job['counts'])
+            snapshot['counts']['tables'] = dict(job['counts']['tables'])
+            return snapshot
+
+    def _run(self, job_id, func, args, kwargs, progress_callback):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['state'] = JOB_STATE_RUNNING
+            job['started_at'] = time.time()
+
+        try:
+            success, result = func(*args, progress_callback=progress_callback, **kwargs)
+        except Exception as e:
+            success, result = False, e
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job['finished_at'] = time.time()
+            if success:
+                job['state'] = JOB_STATE_SUCCEEDED
+                job['stage'] = 'done'
+                job['message'] = result
+            else:
+                job['state'] = JOB_STATE_FAILED
+                job['error'] = self._format_error(result)
+            self._finished_order.append(job_id)
+            # 只保留最近的已结束任务，避免任务表无限增长
+            while len(self._finished_order) > self._max_finished_jobs:
+                expired_id = self._finished_order.pop(0)
+                self._jobs.pop(expired_id, None)
+
+    def _update_progress(self, job_id: str, stage: str, counts: dict):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['stage'] = stage
+            table_name = counts.pop('table', None)
+            table_rows = counts.pop('table_rows', None)
+            if table_name is not None and table_rows is not None:
+                tables = job['counts']['tables']
+                tables[table_name] = tables.get(table_name, 0) + table_rows
+            job['counts'].update(counts)
+
+    def _format_error(self, result):
+        if self._error_formatter is not None:
+            try:
+                return self._error_formatter(result)
+            except Exception:
+                pass
+        return {
+            "success": False,
+            "error": {
+                "type": "PROCESSING_ERROR",
+                "title": "处理失败",
+                "user_message": str(result),
+                "suggestions": ["请检查文件格式和内容", "联系技术支持"]
+            }
+        }
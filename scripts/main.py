@@ -1,11 +1,20 @@
 # main.py - 虚拟币平台数据处理引擎
+import os
 from pathlib import Path
 import pandas as pd
 import commentjson
 from sqlalchemy import create_engine 
-from .utils import test_database_connection, load_mapping_config, get_db_engine, write_df_to_db
-from .utils import determine_company_from_filename, delete_data_by_filename
-from .data_extract import extract_data_from_sources, process_single_destination
+from .utils import test_database_connection, get_db_engine, write_df_to_db
+from .utils import determine_company_from_filename, delete_data_by_filename, relink_data_by_filename
+from .search_index import SEARCH_INDEX_TABLE, search_index_available, write_search_index, delete_search_index_by_filename
+from .file_metadata import update_file_record_count, update_file_status
+from .incremental import fingerprint_column_available, add_row_fingerprints, write_incremental, write_incremental_search_index
+from .read_cache import invalidate_for_write
+from .data_extract import extract_data_from_sources, process_single_destination, build_missing_sheets_error
+from .data_extract import is_streamable_tabular_sources, iter_tabular_csv_chunks, iter_tabular_xlsx_batches
+from .sheet_cache import SheetCache
+from .template_index import build_template_signature_index, rank_templates_by_sheet_names, sources_present_by_sheets
+from .template_plan import TemplatePlanCache
 from . import transforms
 from .error_handler import ETLError, ErrorType, create_user_friendly_error, handle_exception, format_error_for_frontend
 
@@ -29,6 +38,17 @@ FUNCTION_REGISTRY = {
     'map_imtoken_direction': transforms.map_imtoken_direction
 }
 
+# --- 批量转换函数注册表（与 FUNCTION_REGISTRY 同名，输入输出为整列Series） ---
+# 列式映射时优先使用；未在此注册的函数（如自定义转换）按元素调用标量版本。
+BATCH_FUNCTION_REGISTRY = {
+    'parse_universal_datetime': transforms.parse_universal_datetime_batch,
+    'string_to_decimal': transforms.string_to_decimal_batch,
+    'map_buy_sell': transforms.map_buy_sell_batch,
+    'extract_base_asset': transforms.extract_base_asset_batch,
+    'extract_quote_asset': transforms.extract_quote_asset_batch,
+    'map_imtoken_direction': transforms.map_imtoken_direction_batch
+}
+
 # --- 模板文件注册表（支持多模板） ---
 TEMPLATE_REGISTRY = {
     'okx': [
@@ -53,6 +73,13 @@ TEMPLATE_REGISTRY = {
     ]
 }
 
+# --- 预编译模板计划（启动时编译一次，模板文件修改时间变化后自动重新编译） ---
+TEMPLATE_PLANS = TemplatePlanCache(FUNCTION_REGISTRY, BATCH_FUNCTION_REGISTRY)
+TEMPLATE_PLANS.preload(TEMPLATE_REGISTRY)
+
+# --- 模板工作表签名索引（启动时预先计算，用于Excel文件的快速模板筛选） ---
+TEMPLATE_SIGNATURE_INDEX = build_template_signature_index(TEMPLATE_REGISTRY, TEMPLATE_PLANS)
+
 # --- 核心数据表列表 ---
 CORE_TABLES = [
     'users',
@@ -62,12 +89,30 @@ CORE_TABLES = [
     'devices'
 ]
 
+# --- 大文件流式处理配置 ---
+# 超过 STREAM_MIN_FILE_BYTES 的CSV/xlsx文件：模板匹配时 tabular 数据源只读取前 STREAM_PROBE_ROWS 行；
+# 写库时 tabular 数据按 STREAM_CHUNK_ROWS 行一块读取、转换并写入数据库，峰值内存取决于数据块大小而不是文件大小。
+# - CSV：匹配到的模板全部为 tabular 数据源时才流式处理
+# - xlsx：tabular 工作表用 openpyxl 只读模式逐行读取，其余布局的工作表仍整表读取（通常很小）
+STREAM_MIN_FILE_BYTES = int(os.environ.get('ETL_STREAM_MIN_BYTES', 32 * 1024 * 1024))
+STREAM_CHUNK_ROWS = int(os.environ.get('ETL_STREAM_CHUNK_ROWS', 50000))
+STREAM_PROBE_ROWS = 2000
+STREAM_EXTENSIONS = ['.csv', '.xlsx']
+
+# --- 写库方式 ---
+# to_sql（默认）：pandas executemany，mysql-connector 会把它改写为多行 INSERT；
+# multi：pandas 自行拼接多行 VALUES（extra_data 较宽时可能超过 max_allowed_packet）；
+# load_data：LOAD DATA LOCAL INFILE（需要服务器开启 local_infile）。
+# 在目标数据库上用 scripts/bench_db_write.py 测得各方式的 行/秒 之后，再决定是否通过环境变量切换
+DB_WRITE_METHOD = os.environ.get('ETL_DB_WRITE_METHOD', 'to_sql')
+
 def validate_platform_match(extracted_data: dict, platform: str, file_path: Path) -> dict:
     """
     验证提取的数据是否与选择的平台匹配
     
     Args:
-        extracted_data: 提取到的数据字典
+        extracted_data: 提取到的数据字典；也可以是根据工作表目录推断出的 {source_id: 工作表名}，
+                        用于在解析工作表之前预检匹配度
         platform: 识别的平台名称
         file_path: 文件路径
     
@@ -109,13 +154,139 @@ def validate_platform_match(extracted_data: dict, platform: str, file_path: Path
         'suggestions': []
     }
 
-def run_etl_process_for_file(file_path: Path, selected_company: str = None):
+def _report_progress(progress_callback, stage: str, **counts):
+    """向任务队列汇报当前ETL阶段和行数统计，回调异常不影响ETL本身"""
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(stage, **counts)
+    except Exception as e:
+        print(f"⚠️ 汇报ETL进度失败: {e}")
+
+def _transform_and_write(template_plan, extracted_data: dict, file_name: str, destination_rows: dict,
+                         progress_callback=None, connection=None, lookup_data: dict = None,
+                         destination_indexes: list = None, touched_users: set = None,
+                         fingerprint: bool = False, incremental_frames: dict = None):
+    """
+    对一批提取数据执行模板中的生产线并写入数据库。
+    整表处理时调用一次；流式处理时每个数据块调用一次，写入行数累计到 destination_rows。
+    connection: 本次上传共享的事务连接，所有生产线、所有数据块都在它上面写入。
+    touched_users: 收集写入数据涉及的 user_id，提交后用于精确失效查询缓存。
+    destination_indexes: 只执行这些序号的生产线，默认执行全部。
+    fingerprint: 写入时附带记录指纹（表中已有指纹列时），供之后的增量导入比较。
+    incremental_frames: 增量模式下不直接写入，按目标表收集带指纹的转换结果 {表名: [DataFrame]}，
+                        由 _write_incremental_tables 合并后统一比较写入。
+                        指纹与整表写入时一样按生产线分别计算，两种模式下相同数据的指纹一致。
+    """
+    for index, destination in enumerate(template_plan.destinations):
+        if destination_indexes is not None and index not in destination_indexes:
+            continue
+        target_table_name = destination.target_table
+        print(f"  📝 正在处理目标表: '{target_table_name}'")
+
+        try:
+            _report_progress(progress_callback, 'transform')
+            # 处理数据并转换
+            final_df = process_single_destination(
+                destination.config,
+                extracted_data,
+                FUNCTION_REGISTRY,
+                file_name,
+                compiled_destination=destination,
+                alias_resolver=template_plan.resolve_alias,
+                lookup_data=lookup_data
+            )
+            
+            if final_df is not None and not final_df.empty and incremental_frames is not None:
+                incremental_frames.setdefault(target_table_name, []).append(add_row_fingerprints(final_df))
+                destination_rows[index] = destination_rows.get(index, 0) + len(final_df)
+                print(f"  ✅ 表 '{target_table_name}' 转换完成，{len(final_df)} 条记录待增量比较")
+            elif final_df is not None and not final_df.empty:
+                if fingerprint and fingerprint_column_available(connection, target_table_name):
+                    final_df = add_row_fingerprints(final_df)
+                # 写入数据库
+                _report_progress(progress_callback, 'write')
+                write_df_to_db(final_df, target_table_name, DB_CONFIG,
+                               connection=connection, method=DB_WRITE_METHOD)
+                write_search_index(target_table_name, final_df, DB_CONFIG,
+                                   connection=connection, method=DB_WRITE_METHOD)
+                if touched_users is not None and 'user_id' in final_df.columns:
+                    touched_users.update(final_df['user_id'].dropna().astype(str).unique())
+                destination_rows[index] = destination_rows.get(index, 0) + len(final_df)
+                _report_progress(progress_callback, 'write', rows_written=sum(destination_rows.values()),
+                                 table=target_table_name, table_rows=len(final_df))
+                print(f"  ✅ 表 '{target_table_name}' 处理完成，写入 {len(final_df)} 条记录")
+            else:
+                print(f"  ⚠️ 表 '{target_table_name}' 没有数据需要写入")
+                
+        except KeyError as e:
+            raise create_user_friendly_error(
+                ErrorType.COLUMN_MISSING,
+                details=f"处理表 '{target_table_name}' 时缺少必需字段: {str(e)}",
+                custom_suggestions=[
+                    f"检查文件中是否包含字段: {str(e)}",
+                    "确认列名拼写是否正确",
+                    "检查数据模板配置是否匹配文件格式"
+                ]
+            )
+        except Exception as e:
+            error_msg = str(e).lower()
+            if 'database' in error_msg or 'connection' in error_msg:
+                raise create_user_friendly_error(
+                    ErrorType.DB_WRITE_ERROR,
+                    details=f"写入表 '{target_table_name}' 失败: {str(e)}",
+                    custom_suggestions=["检查数据库连接", "确认数据库有足够空间", "检查数据格式是否正确"]
+                )
+            else:
+                raise create_user_friendly_error(
+                    ErrorType.DATA_TRANSFORMATION_ERROR,
+                    details=f"数据转换失败: {str(e)}",
+                    custom_suggestions=["检查数据格式是否正确", "确认数据类型匹配", "删除异常数据行"]
+                )
+
+def _write_incremental_tables(table_frames: dict, file_name: str, superseded_files: list, connection,
+                              progress_callback=None, touched_users: set = None) -> int:
+    """
+    增量模式：每张表合并所有生产线的结果后与被取代文件中已存储的指纹比较写入，返回插入的行数。
+    完成后 file_name 拥有该表中自己的全部记录（未变化的记录已从旧文件转移过来）。
+    """
+    rows_inserted = 0
+    for table_name, frames in table_frames.items():
+        table_df = pd.concat(frames, ignore_index=True)
+        try:
+            result = write_incremental(table_df, table_name, DB_CONFIG, connection,
+                                       file_name, superseded_files, method=DB_WRITE_METHOD)
+        except Exception as e:
+            raise create_user_friendly_error(
+                ErrorType.DB_WRITE_ERROR,
+                details=f"增量写入表 '{table_name}' 失败: {str(e)}",
+                custom_suggestions=["检查数据库连接", "确认已执行 python scripts/db_migrate.py migrate"]
+            )
+        write_incremental_search_index(table_df, table_name, DB_CONFIG, connection,
+                                       superseded_files, method=DB_WRITE_METHOD)
+        if touched_users is not None:
+            touched_users.update(result.affected_users)
+        rows_inserted += len(result.inserted_rows)
+        _report_progress(progress_callback, 'write', rows_written=rows_inserted,
+                         table=table_name, table_rows=len(result.inserted_rows))
+    return rows_inserted
+
+def run_etl_process_for_file(file_path: Path, selected_company: str = None, progress_callback=None,
+                             incremental: bool = False, platform: str = None, superseded_files: list = None):
     """
     执行单个文件的完整ETL流程，带有详细的错误处理
     
     Args:
         file_path: 待处理文件的路径
         selected_company: 用户在前端选择的公司名称（如：'币安', '火币'等），用于验证匹配
+        progress_callback: 可选的进度回调 callback(stage, **counts)，
+                           stage 依次为 template_match / extract / transform / write
+        incremental: 增量模式，不先删除该文件的旧数据，只插入新记录、删除被取代文件中同一账户不再出现的记录
+                     （需要比较完整的数据，因此不使用流式处理）
+        superseded_files: 增量模式下被本文件取代的旧文件名（source_file_name），只与这些文件的数据比较；
+                          本文件自己的文件名总是包含在内
+        platform: 已确定的内部平台标识（TEMPLATE_REGISTRY 的键，如批量导入时按工作表识别），
+                  提供时跳过平台选择和文件名识别
     
     Returns:
         tuple: (是否成功, 成功消息/ETLError对象)
@@ -146,8 +317,17 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
         # 步骤3：确定数据平台
         print("🔍 正在识别数据平台...")
         
-        # 首先检查用户是否选择了公司
-        if selected_company:
+        # 调用方已确定平台时直接使用，其次检查用户是否选择了公司
+        if platform:
+            if platform not in TEMPLATE_REGISTRY:
+                raise create_user_friendly_error(
+                    ErrorType.COMPANY_NOT_RECOGNIZED,
+                    details=f"不支持的平台: {platform}",
+                    custom_suggestions=[f"支持的平台: {', '.join(TEMPLATE_REGISTRY.keys())}"]
+                )
+            company_name = platform
+            print(f"✅ 使用指定的平台: {company_name}")
+        elif selected_company:
             print(f"� 用户选择的平台: {selected_company}")
             # 将前端选择映射到内部标识符
             company_mapping = {
@@ -214,6 +394,7 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
             
         # 步骤4：多模板扫描和匹配
         print("📋 正在扫描数据模板...")
+        _report_progress(progress_callback, 'template_match')
         template_paths = TEMPLATE_REGISTRY[company_name]
         
         if not template_paths:
@@ -225,37 +406,81 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
         
         # 尝试每个模板，找到第一个匹配的
         successful_template = None
-        successful_config = None
+        successful_plan = None
         successful_data = None
-        template_errors = []
+        template_errors = {}  # {模板路径: 错误信息}
         
         print(f"    🔍 找到 {len(template_paths)} 个 {company_name} 模板，开始逐个尝试...")
         
-        for i, template_path in enumerate(template_paths, 1):
-            print(f"    📋 尝试模板 {i}/{len(template_paths)}: {template_path.name}")
+        # 大文件只用前几行匹配模板，匹配成功后再决定是否流式写入
+        file_suffix = file_path.suffix.lower()
+        stream_candidate = (not incremental and file_suffix in STREAM_EXTENSIONS
+                            and file_path.stat().st_size >= STREAM_MIN_FILE_BYTES)
+        if stream_candidate:
+            print(f"    🌊 文件较大 ({file_path.stat().st_size / 1024 / 1024:.1f} MB)，使用前 {STREAM_PROBE_ROWS} 行匹配模板")
+        
+        # 单次上传共享的工作表缓存：每个工作表在所有模板候选之间只解析一次
+        sheet_cache = SheetCache(file_path, csv_nrows=STREAM_PROBE_ROWS if stream_candidate else None)
+        
+        # 工作表签名预筛选：只读取工作簿目录，在解析任何工作表之前对候选模板排序/淘汰
+        candidate_paths = list(template_paths)
+        available_sheets = None
+        if file_path.suffix.lower() in ['.xlsx', '.xls']:
+            try:
+                available_sheets = sheet_cache.sheet_names()
+            except Exception as e:
+                print(f"    🟡 无法读取工作表目录，跳过签名预筛选: {e}")
+            
+            if available_sheets is not None:
+                candidate_paths, rejected_templates = rank_templates_by_sheet_names(template_paths, available_sheets, TEMPLATE_PLANS)
+                for template_path, missing_sheets in rejected_templates.items():
+                    missing_error = build_missing_sheets_error(missing_sheets, available_sheets)
+                    error_msg = f"模板 {template_path.name}: {missing_error.message} ({missing_error.details})"
+                    template_errors[template_path] = error_msg
+                    print(f"    ⏭️ 签名预筛选淘汰模板 {template_path.name}: 缺少 {len(missing_sheets)} 个必需工作表")
+                if candidate_paths:
+                    print(f"    🧭 签名预筛选后的候选顺序: {[path.name for path in candidate_paths]}")
+        
+        for i, template_path in enumerate(candidate_paths, 1):
+            print(f"    📋 尝试模板 {i}/{len(candidate_paths)}: {template_path.name}")
             
             if not template_path.exists():
                 error_msg = f"模板文件 {template_path} 不存在"
-                template_errors.append(error_msg)
+                template_errors[template_path] = error_msg
                 print(f"        ❌ {error_msg}")
                 continue
             
             try:
-                # 加载模板配置
-                mapping_config = load_mapping_config(template_path)
+                # 获取预编译的模板计划（模板未修改时不会重新解析）
+                template_plan = TEMPLATE_PLANS.get(template_path)
+                mapping_config = template_plan.config
                 if not mapping_config:
                     error_msg = f"模板文件 {template_path.name} 内容为空"
-                    template_errors.append(error_msg)
+                    template_errors[template_path] = error_msg
                     print(f"        ❌ {error_msg}")
                     continue
                 
                 print(f"        ✅ 模板配置加载成功")
                 
+                # 根据工作表目录预检平台匹配度，不匹配时无需解析任何工作表
+                if selected_company and available_sheets is not None:
+                    present_sources = sources_present_by_sheets(template_path, available_sheets, TEMPLATE_PLANS)
+                    validation_result = validate_platform_match(present_sources, company_name, file_path)
+                    if not validation_result['is_match']:
+                        error_msg = f"模板 {template_path.name}: {validation_result['reason']}"
+                        template_errors[template_path] = error_msg
+                        print(f"        ❌ {error_msg}")
+                        continue
+                
                 # 尝试使用这个模板提取数据
                 print(f"        🔍 测试模板匹配度...")
+                _report_progress(progress_callback, 'extract')
                 extracted_data = extract_data_from_sources(
                     file_path,
-                    mapping_config.get('sources', [])
+                    list(template_plan.sources),
+                    sheet_cache=sheet_cache,
+                    optional_sources=template_plan.optional_sources,
+                    probe_rows=STREAM_PROBE_ROWS if stream_candidate else None
                 )
                 
                 # 验证平台匹配度
@@ -263,13 +488,13 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
                     validation_result = validate_platform_match(extracted_data, company_name, file_path)
                     if not validation_result['is_match']:
                         error_msg = f"模板 {template_path.name}: {validation_result['reason']}"
-                        template_errors.append(error_msg)
+                        template_errors[template_path] = error_msg
                         print(f"        ❌ {error_msg}")
                         continue
                 
                 # 如果到这里，说明模板匹配成功
                 successful_template = template_path
-                successful_config = mapping_config
+                successful_plan = template_plan
                 successful_data = extracted_data
                 print(f"        🎯 模板 {template_path.name} 匹配成功！")
                 break
@@ -279,15 +504,19 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
                 error_msg = f"模板 {template_path.name}: {e.message}"
                 if e.details:
                     error_msg += f" ({e.details})"
-                template_errors.append(error_msg)
+                template_errors[template_path] = error_msg
                 print(f"        ❌ {error_msg}")
                 continue
             except Exception as e:
                 error_msg = f"模板 {template_path.name}: 处理异常 - {str(e)}"
-                template_errors.append(error_msg)
+                template_errors[template_path] = error_msg
                 print(f"        ❌ {error_msg}")
                 continue
         
+        # 模板选择结束，释放工作簿句柄和未被选中的缓存数据
+        print(f"    📦 工作表缓存: 命中 {sheet_cache.hits} 次, 解析 {sheet_cache.misses} 次")
+        sheet_cache.close()
+        
         # 检查是否找到了匹配的模板
         if not successful_template:
             # 所有模板都失败了，生成结构化错误报告
@@ -305,26 +534,13 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
             }
             
             # 处理每个模板的错误信息
-            for i, (template_path, error) in enumerate(zip(template_paths, template_errors), 1):
+            for i, template_path in enumerate(template_paths, 1):
+                error = template_errors.get(template_path, "模板格式不匹配")
                 template_name = template_path.name.replace('.jsonc', '').replace('_map', '').replace(f'{company_name}_', '')
                 
-                # 尝试从模板文件中读取自定义显示名称
-                display_name = None
-                try:
-                    if template_path.exists():
-                        mapping_config = load_mapping_config(template_path)
-                        if mapping_config and 'metadata' in mapping_config:
-                            metadata = mapping_config['metadata']
-                            # 优先使用 display_name，然后是 description，最后是 version
-                            display_name = metadata.get('display_name') or metadata.get('description')
-                            if display_name:
-                                # 如果有版本信息，添加到显示名称中
-                                version = metadata.get('version')
-                                if version:
-                                    display_name = f"{display_name} (v{version})"
-                except Exception:
-                    # 如果读取模板失败，使用默认逻辑
-                    pass
+                # 从已编译的模板计划中读取自定义显示名称（不再重新解析模板文件）
+                plan = TEMPLATE_PLANS.get_or_none(template_path)
+                display_name = plan.display_name if plan is not None else None
                 
                 # 如果没有自定义名称，使用文件名推断
                 if not display_name:
@@ -394,10 +610,32 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
             )
         
         # 使用成功匹配的模板继续处理
-        mapping_config = successful_config
+        template_plan = successful_plan
         extracted_data = successful_data
         print(f"✅ 使用模板: {successful_template.name}")
         print(f"✅ 成功加载 {company_name} 平台的数据模板")
+        
+        # 需要逐块读取的数据源：CSV 为整个模板的全部数据源，xlsx 为其中的 tabular 工作表
+        streamed_sources = []
+        if stream_candidate and file_suffix == '.csv':
+            if is_streamable_tabular_sources(list(template_plan.sources)):
+                streamed_sources = list(template_plan.sources)
+            else:
+                # 模板包含非 tabular 数据源，无法分块处理，重新完整提取
+                print("🟡 模板包含非 tabular 数据源，改为完整读取文件")
+                extracted_data = extract_data_from_sources(
+                    file_path,
+                    list(template_plan.sources),
+                    optional_sources=template_plan.optional_sources
+                )
+        elif stream_candidate:
+            streamed_sources = [
+                source for source in template_plan.sources
+                if source.get('data_layout', 'tabular') == 'tabular'
+                and isinstance(extracted_data.get(source.get('source_id')), pd.DataFrame)
+                and not extracted_data[source['source_id']].empty
+            ]
+        stream_mode = bool(streamed_sources)
             
         print("\n" + "-"*60)
         print("🔗 步骤1: 数据库连接测试")
@@ -416,83 +654,129 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
                     "联系管理员检查数据库状态"
                 ]
             )
+        update_file_status(DB_CONFIG, file_path.name, 'processing')
 
-        print("\n" + "-"*60)
-        print("🗑️ 步骤2: 清理旧数据")
-        print("-"*60)
-        # 步骤6：清理旧数据
-        try:
-            delete_data_by_filename(DB_CONFIG, CORE_TABLES, file_path.name)
-        except Exception as e:
-            print(f"⚠️ 清理旧数据时出现问题: {str(e)}")
-            print("继续处理新数据...")
+        # 删除旧数据和写入新数据在同一个连接、同一个事务中完成：
+        # 任何一张表写入失败时整体回滚，不会留下"旧数据已删、新数据写了一半"的状态
+        engine = get_db_engine(DB_CONFIG, allow_local_infile=(DB_WRITE_METHOD == 'load_data'))
+        touched_users = set()  # 本次写入涉及的 user_id
+        with engine.begin() as connection:
+            if incremental and not all(fingerprint_column_available(connection, table) for table in CORE_TABLES):
+                print("⚠️ 核心表还没有 row_fingerprint 列（请执行 python scripts/db_migrate.py migrate），改为完整导入")
+                incremental = False
+            
+            print("\n" + "-"*60)
+            print("🗑️ 步骤2: 清理旧数据")
+            print("-"*60)
+            # 步骤6：清理旧数据（增量模式下由指纹比较决定删除哪些记录）
+            if incremental:
+                superseded_files = list(dict.fromkeys([file_path.name] + list(superseded_files or [])))
+                print(f"🔁 增量模式：与 {len(superseded_files)} 个源文件（含本文件）的数据比较，只写入新增记录、删除不再出现的记录")
+            else:
+                try:
+                    delete_data_by_filename(DB_CONFIG, CORE_TABLES, file_path.name, connection=connection)
+                    delete_search_index_by_filename(DB_CONFIG, file_path.name, connection=connection)
+                except Exception as e:
+                    print(f"⚠️ 清理旧数据时出现问题: {str(e)}")
+                    print("继续处理新数据...")
         
-        print("\n" + "-"*60)
-        print("📊 步骤3: 数据验证完成")
-        print("-"*60)
-        # 数据已经在模板匹配过程中提取和验证了
-        print(f"✅ 数据提取完成，使用模板: {successful_template.name}")
+            print("\n" + "-"*60)
+            print("📊 步骤3: 数据验证完成")
+            print("-"*60)
+            # 数据已经在模板匹配过程中提取和验证了
+            print(f"✅ 数据提取完成，使用模板: {successful_template.name}")
         
-        if not extracted_data:
-            raise create_user_friendly_error(
-                ErrorType.FILE_EMPTY,
-                details="从文件中未提取到任何有效数据",
-                custom_suggestions=["检查文件是否包含数据", "确认文件格式是否正确", "检查工作表是否为空"]
-            )
-        else:
-            total_records = sum(len(df) for df in extracted_data.values() if isinstance(df, pd.DataFrame))
-            print(f"✅ 成功提取数据，共 {total_records} 条记录")
+            if not extracted_data:
+                raise create_user_friendly_error(
+                    ErrorType.FILE_EMPTY,
+                    details="从文件中未提取到任何有效数据",
+                    custom_suggestions=["检查文件是否包含数据", "确认文件格式是否正确", "检查工作表是否为空"]
+                )
+            elif stream_mode:
+                print(f"✅ 模板匹配完成，将按每块 {STREAM_CHUNK_ROWS} 行流式处理")
+            else:
+                total_records = sum(len(df) for df in extracted_data.values() if isinstance(df, pd.DataFrame))
+                print(f"✅ 成功提取数据，共 {total_records} 条记录")
+                _report_progress(progress_callback, 'extract', rows_extracted=total_records)
             
-        print("\n" + "-"*60)
-        print("💾 步骤4: 数据转换和写入数据库")
-        print("-"*60)
-        # 步骤8：处理每个目标表
-        processed_tables = []
-        for destination in mapping_config.get('destinations', []):
-            target_table_name = destination.get('target_table')
-            print(f"  📝 正在处理目标表: '{target_table_name}'")
-
-            try:
-                # 处理数据并转换
-                final_df = process_single_destination(
-                    destination,
-                    extracted_data,
-                    FUNCTION_REGISTRY,
-                    file_path.name
+            print("\n" + "-"*60)
+            print("💾 步骤4: 数据转换和写入数据库")
+            print("-"*60)
+            # 步骤8：处理每个目标表
+            destination_rows = {}  # {生产线序号: 累计写入行数}
+            if stream_mode and file_suffix == '.csv':
+                rows_extracted = 0
+                lookup_data = None
+                chunks = iter_tabular_csv_chunks(file_path, list(template_plan.sources), STREAM_CHUNK_ROWS)
+                for chunk_index, chunk_data in enumerate(chunks, 1):
+                    # lookup_source 始终取自第一个数据块，与整表处理时取第一行的语义一致
+                    if lookup_data is None:
+                        lookup_data = chunk_data
+                    chunk_rows = len(next(iter(chunk_data.values())))
+                    rows_extracted += chunk_rows
+                    print(f"  📦 数据块 {chunk_index}: {chunk_rows} 行 (累计 {rows_extracted} 行)")
+                    _report_progress(progress_callback, 'extract', rows_extracted=rows_extracted)
+                    _transform_and_write(template_plan, chunk_data, file_path.name, destination_rows,
+                                         progress_callback, connection, lookup_data=lookup_data,
+                                         touched_users=touched_users)
+            elif stream_mode:
+                # 非流式数据源的生产线整表处理一次；lookup_source 使用探测时读取的前几行（第一行与整表一致）
+                streamed_ids = [source['source_id'] for source in streamed_sources]
+                whole_indexes = [
+                    index for index, destination in enumerate(template_plan.destinations)
+                    if destination.primary_source not in streamed_ids
+                ]
+                rows_extracted = sum(
+                    len(df) for source_id, df in extracted_data.items()
+                    if source_id not in streamed_ids and isinstance(df, pd.DataFrame)
                 )
-                
-                if final_df is not None and not final_df.empty:
-                    # 写入数据库
-                    write_df_to_db(final_df, target_table_name, DB_CONFIG)
-                    processed_tables.append(target_table_name)
-                    print(f"  ✅ 表 '{target_table_name}' 处理完成，写入 {len(final_df)} 条记录")
-                else:
-                    print(f"  ⚠️ 表 '{target_table_name}' 没有数据需要写入")
-                    
-            except KeyError as e:
-                raise create_user_friendly_error(
-                    ErrorType.COLUMN_MISSING,
-                    details=f"处理表 '{target_table_name}' 时缺少必需字段: {str(e)}",
-                    custom_suggestions=[
-                        f"检查文件中是否包含字段: {str(e)}",
-                        "确认列名拼写是否正确",
-                        "检查数据模板配置是否匹配文件格式"
+                _report_progress(progress_callback, 'extract', rows_extracted=rows_extracted)
+                _transform_and_write(template_plan, extracted_data, file_path.name, destination_rows,
+                                     progress_callback, connection, destination_indexes=whole_indexes,
+                                     touched_users=touched_users)
+            
+                for source in streamed_sources:
+                    source_id = source['source_id']
+                    batch_indexes = [
+                        index for index, destination in enumerate(template_plan.destinations)
+                        if destination.primary_source == source_id
                     ]
-                )
-            except Exception as e:
-                error_msg = str(e).lower()
-                if 'database' in error_msg or 'connection' in error_msg:
-                    raise create_user_friendly_error(
-                        ErrorType.DB_WRITE_ERROR,
-                        details=f"写入表 '{target_table_name}' 失败: {str(e)}",
-                        custom_suggestions=["检查数据库连接", "确认数据库有足够空间", "检查数据格式是否正确"]
-                    )
-                else:
-                    raise create_user_friendly_error(
-                        ErrorType.DATA_TRANSFORMATION_ERROR,
-                        details=f"数据转换失败: {str(e)}",
-                        custom_suggestions=["检查数据格式是否正确", "确认数据类型匹配", "删除异常数据行"]
-                    )
+                    if not batch_indexes:
+                        continue
+                    print(f"  🌊 逐行读取工作表: '{source['worksheet_name']}'")
+                    batches = iter_tabular_xlsx_batches(file_path, source, STREAM_CHUNK_ROWS)
+                    for batch_index, batch in enumerate(batches, 1):
+                        rows_extracted += len(batch)
+                        print(f"  📦 数据块 {batch_index}: {len(batch)} 行 (累计 {rows_extracted} 行)")
+                        _report_progress(progress_callback, 'extract', rows_extracted=rows_extracted)
+                        batch_data = dict(extracted_data)
+                        batch_data[source_id] = batch
+                        _transform_and_write(template_plan, batch_data, file_path.name, destination_rows,
+                                             progress_callback, connection, lookup_data=extracted_data,
+                                             destination_indexes=batch_indexes, touched_users=touched_users)
+            elif incremental:
+                incremental_frames = {}
+                _transform_and_write(template_plan, extracted_data, file_path.name, destination_rows,
+                                     progress_callback, connection, touched_users=touched_users,
+                                     incremental_frames=incremental_frames)
+                _write_incremental_tables(incremental_frames, file_path.name, superseded_files, connection,
+                                          progress_callback, touched_users)
+            else:
+                # 流式处理时各数据块分别计算序号，重复记录的指纹可能冲突，因此只在整表写入时附带指纹
+                _transform_and_write(template_plan, extracted_data, file_path.name, destination_rows,
+                                     progress_callback, connection, touched_users=touched_users,
+                                     fingerprint=True)
+        
+        # 事务已提交：失效涉及的用户、该文件（旧数据所属用户）以及搜索结果的查询缓存
+        invalidate_for_write(touched_users, superseded_files if incremental else [file_path.name])
+        # 标记为已处理：之后上传内容相同的文件时可以直接复用本次结果
+        update_file_record_count(DB_CONFIG, file_path.name, sum(destination_rows.values()))
+        
+        processed_tables = [
+            destination.target_table
+            for index, destination in enumerate(template_plan.destinations)
+            if index in destination_rows
+        ]
         
         print("\n" + "="*80)
         print("🎉 ETL流程完成！")
@@ -506,6 +790,7 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
         print(f"\n❌ ETL处理错误: {e.message}")
         if e.details:
             print(f"详细信息: {e.details}")
+        update_file_status(DB_CONFIG, file_path.name, 'error', e.message)
         return False, e
     except Exception as e:
         # 捕获所有未预期的错误
@@ -516,6 +801,41 @@ def run_etl_process_for_file(file_path: Path, selected_company: str = None):
         )
         print(f"\n❌ 未知错误: {error_obj.message}")
         print(f"详细信息: {error_obj.details}")
+        update_file_status(DB_CONFIG, file_path.name, 'error', error_obj.message)
+        return False, error_obj
+
+def relink_processed_file(file_path: Path, existing_file_name: str, progress_callback=None):
+    """
+    上传的文件与已成功处理的 existing_file_name 内容完全相同时使用：
+    不重新解析和写入，只把已有数据（核心表和搜索索引）的来源改为新文件名。
+    返回值与 run_etl_process_for_file 相同: (是否成功, 成功消息/ETLError对象)
+    """
+    try:
+        print(f"\n🔗 文件 '{file_path.name}' 与已处理的 '{existing_file_name}' 内容相同，转移已有数据")
+        _report_progress(progress_callback, 'write')
+        engine = get_db_engine(DB_CONFIG)
+        with engine.begin() as connection:
+            relink_tables = CORE_TABLES + ([SEARCH_INDEX_TABLE] if search_index_available(connection) else [])
+            updated = relink_data_by_filename(DB_CONFIG, relink_tables,
+                                              existing_file_name, file_path.name, connection=connection)
+        invalidate_for_write(file_names=[existing_file_name, file_path.name])
+        
+        rows_written = sum(count for table, count in updated.items() if table in CORE_TABLES)
+        _report_progress(progress_callback, 'write', rows_written=rows_written)
+        update_file_record_count(DB_CONFIG, file_path.name, rows_written)
+        # 旧文件已经没有数据，不再作为重复文件的复用对象
+        update_file_status(DB_CONFIG, existing_file_name, 'uploaded', f"数据已转移到 {file_path.name}")
+        
+        success_msg = f"文件 '{file_path.name}' 与已处理的 '{existing_file_name}' 内容相同，已转移 {rows_written} 条数据"
+        print(f"✅ {success_msg}")
+        return True, success_msg
+    except Exception as e:
+        error_obj = create_user_friendly_error(
+            ErrorType.DB_WRITE_ERROR,
+            details=f"转移文件 {existing_file_name} 的数据到 {file_path.name} 时出错: {str(e)}"
+        )
+        print(f"\n❌ {error_obj.message}")
+        update_file_status(DB_CONFIG, file_path.name, 'error', error_obj.message)
         return False, error_obj
 
 # --- 开发测试入口 ---
@@ -0,0 +1,73 @@
+# scripts/query_classifier.py - 搜索词类型识别
+# 大多数搜索词一眼就能看出是哪类标识：IPv4、邮箱、手机号、64位十六进制交易哈希、TRON/ETH/BTC 地址。
+# 识别出类型后，/api/search_uid 只在 search_index 中按对应的 field_type 做一次等值或前缀查找，
+# 无法识别的自由文本才走通用的前缀匹配（及按需的包含匹配）。
+import re
+from typing import NamedTuple
+from .search_index import normalize_search_value
+
+BASE58_CHARS = '1-9A-HJ-NP-Za-km-z'
+
+
+class SearchQueryType(NamedTuple):
+    """搜索词的识别结果"""
+    kind: str            # 识别出的类型，如 'ipv4'、'email'、'txid'
+    field_types: tuple   # 在 search_index 中查找的 field_type
+    values: tuple        # 规范化后的查找值（等值匹配时可能有多个写法）
+    exact: bool          # True: 等值匹配；False: 前缀匹配
+
+
+# 钱包地址在部分数据源（如 ImToken/TokenPocket）中同时用作用户ID和设备ID
+ADDRESS_FIELD_TYPES = ('address', 'user_id', 'device_id')
+
+# --- 识别规则（按顺序匹配，先匹配的优先）---
+# (类型, 正则, 查找的字段类型, 是否等值匹配)
+QUERY_PATTERNS = [
+    ('txid', re.compile(r'^(0x)?[0-9a-fA-F]{64}$'), ('txid',), True),
+    ('eth_address', re.compile(r'^0x[0-9a-fA-F]{40}$'), ADDRESS_FIELD_TYPES, True),
+    ('tron_address', re.compile(rf'^T[{BASE58_CHARS}]{{33}}$'), ADDRESS_FIELD_TYPES, True),
+    ('btc_address', re.compile(rf'^(?:[13][{BASE58_CHARS}]{{25,34}}|(?:bc1|BC1)[02-9ac-hj-np-zAC-HJ-NP-Z]{{11,71}})$'),
+     ADDRESS_FIELD_TYPES, True),
+    ('ipv4', re.compile(r'^(25[0-5]|2[0-4]\d|1?\d?\d)(\.(25[0-5]|2[0-4]\d|1?\d?\d)){3}$'), ('ip',), True),
+    # IP 前缀至少要有两个点（如 192.168.、192.168.1），否则 1.5、0.01 这类金额会被误认为IP
+    ('ipv4_prefix', re.compile(r'^\d{1,3}\.\d{1,3}\.(\d{1,3}\.?)?$'), ('ip',), False),
+    ('email', re.compile(r'^[^@\s]+@[^@\s]*$'), ('email',), False),
+    # 纯数字可能是手机号，也可能是数字形式的用户ID（如币安/欧易）
+    ('digits', re.compile(r'^\d{5,}$'), ('phone', 'user_id'), False),
+    ('phone', re.compile(r'^\+?[\d\s\-()]{7,20}$'), ('phone',), False),
+]
+
+
+def _txid_variants(value: str) -> tuple:
+    """交易哈希在不同数据源中可能带或不带 0x 前缀，两种写法都查"""
+    value = value.lower()
+    bare = value[2:] if value.startswith('0x') else value
+    return (bare, '0x' + bare)
+
+
+def classify_search_query(search_term: str):
+    """
+    识别搜索词类型，返回 SearchQueryType；无法识别（自由文本）时返回None。
+    查找值按 search_index 的规范化规则处理，保证与写入索引时的值一致。
+    """
+    term = (search_term or '').strip()
+    if not term:
+        return None
+
+    for kind, pattern, field_types, exact in QUERY_PATTERNS:
+        if not pattern.match(term):
+            continue
+        if kind == 'txid':
+            values = _txid_variants(term)
+        elif kind in ('phone', 'digits'):
+            digits = normalize_search_value('phone', term)
+            if not digits or (kind == 'phone' and len(digits) < 7):
+                continue
+            if term.startswith('+86') and len(digits) == 13:
+                digits = digits[2:]  # 去掉国际区号，与数据中的11位手机号一致
+            values = (digits,)
+        else:
+            # 按第一个字段类型的规则规范化（如 ETH 地址、邮箱转小写），Base58 地址保持原样
+            values = (normalize_search_value(field_types[0], term),)
+        return SearchQueryType(kind=kind, field_types=field_types, values=values, exact=exact)
+    return None
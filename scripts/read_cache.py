@@ -0,0 +1,161 @@
+# scripts/read_cache.py - 查询接口的结果缓存
+# 办案人员会在结果页反复打开同一个 user_id，/api/mindmap_data 和 /api/search_uid 的结果在数据未变化时完全相同。
+# 这里提供一个有界的 LRU + TTL 缓存，每个条目带有标签：
+#   user:<user_id>     该用户的数据
+#   file:<文件名>       来自该源文件的数据
+#   search             所有搜索结果（任何写入都可能产生新的匹配）
+# ETL写库或按文件删除数据后，按涉及的用户和文件精确失效对应条目。
+#
+# 读取与失效的竞争：请求在事务提交前读到旧数据、却在失效之后才写入缓存时，旧数据会被缓存到过期为止。
+# 因此缓存带有代数：每次失效时代数加一，并记录每个标签最后一次失效时的代数；
+# 请求在读库前取得当前代数，写入缓存时只要任一标签在此之后失效过，就放弃写入。
+#
+# 失效只在本进程内生效：其他进程的写入（backfill.py 的导入进程、多进程部署时的其他服务进程）
+# 不会通知本进程，这些写入造成的旧数据最多保留 READ_CACHE_TTL_SECONDS 秒。
+import os
+import threading
+import time
+from collections import OrderedDict
+
+READ_CACHE_MAX_ENTRIES = int(os.environ.get('ETL_READ_CACHE_MAX_ENTRIES', 512))
+READ_CACHE_TTL_SECONDS = int(os.environ.get('ETL_READ_CACHE_TTL_SECONDS', 300))
+
+SEARCH_TAG = 'search'
+
+
+def user_tag(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def file_tag(file_name: str) -> str:
+    return f"file:{file_name}"
+
+
+class ReadCache:
+    """
+    线程安全的 LRU + TTL 缓存。
+    缓存的值在多个请求之间共享，调用方不能修改取出的值。
+    """
+
+    def __init__(self, max_entries: int = READ_CACHE_MAX_ENTRIES, ttl_seconds: int = READ_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()   # key -> (过期时间, 值, 标签集合)
+        self._tag_index = {}            # tag -> {key, ...}
+        self._generation = 0            # 每次失效加一
+        self._tag_generations = {}      # tag -> 最后一次失效时的代数
+        self._generation_floor = 0      # _tag_generations 被清理时的代数，早于它取得的代数一律视为过期
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key):
+        """返回 (是否命中, 值)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def generation(self) -> int:
+        """读库前调用，把返回值传给 set(generation=...)"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, tags=(), generation: int = None):
+        """
+        写入缓存。generation: 读库前 generation() 的返回值；
+        任一标签在此之后失效过时不写入（读到的可能是失效前的数据），返回False。
+        """
+        tags = frozenset(tags)
+        with self._lock:
+            if generation is not None and (
+                generation < self._generation_floor
+                or any(self._tag_generations.get(tag, -1) > generation for tag in tags)
+            ):
+                self.stale_sets += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, tags)
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+        return True
+
+    def invalidate_tags(self, tags) -> int:
+        """删除带有任一标签的条目，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            if len(self._tag_generations) > self.max_entries * 8:
+                # 记录的标签过多时整体清理，之前取得的代数全部作废
+                self._tag_generations.clear()
+                self._generation_floor = self._generation
+            for tag in tags:
+                self._tag_generations[tag] = self._generation
+                for key in list(self._tag_index.get(tag, ())):
+                    if key in self._entries:
+                        self._remove(key)
+                        removed += 1
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale_sets': self.stale_sets,
+            }
+
+    def _remove(self, key):
+        # 调用方需持有锁
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+
+# 进程内共享的缓存实例（Flask 请求线程和后台ETL任务线程共用）
+READ_CACHE = ReadCache()
+
+
+def invalidate_for_write(user_ids=(), file_names=()) -> int:
+    """
+    数据写入或删除后调用：失效涉及的用户、来自这些文件的数据，以及全部搜索结果。
+    应在事务提交之后调用，避免并发请求在提交前把旧数据重新放入缓存。
+    """
+    tags = [user_tag(user_id) for user_id in user_ids]
+    tags += [file_tag(file_name) for file_name in file_names]
+    tags.append(SEARCH_TAG)
+    removed = READ_CACHE.invalidate_tags(tags)
+    if removed:
+        print(f"  🧹 已失效 {removed} 条查询缓存")
+    return removed
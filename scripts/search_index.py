@@ -0,0 +1,231 @@
+# scripts/search_index.py - 用户搜索索引（反范式）
+# ETL写库时，把核心表中可用于查找用户的字段（邮箱、手机号、地址、交易哈希、IP、设备ID等）
+# 规范化后写入 search_index 表，/api/search_uid 通过 normalized_value 上的索引做精确/前缀匹配，
+# 不再对每张表做 LIKE '%词%' 全表扫描。
+# 每条索引记录带有 source_file_name，重新处理同一文件时与核心表数据一起清理。
+# 索引表由 db_migrate.py 的迁移 v2 创建；表不存在时跳过索引的写入和清理，
+# 不能让 pandas 的 to_sql 自动建表（没有索引，且在 MySQL 中 DDL 会隐式提交本次上传的事务）。
+import re
+import pandas as pd
+from sqlalchemy import text
+from .utils import get_db_engine, write_df_to_db
+
+SEARCH_INDEX_TABLE = 'search_index'
+
+# normalized_value 的最大长度：191个字符在 utf8mb4 下为 764 字节，兼容 MySQL 5.7 的索引长度限制
+MAX_VALUE_LENGTH = 191
+
+SEARCH_INDEX_TABLE_DEFINITION = f"""
+CREATE TABLE IF NOT EXISTS {SEARCH_INDEX_TABLE} (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    normalized_value VARCHAR({MAX_VALUE_LENGTH}) NOT NULL COMMENT '规范化后的值（邮箱小写、手机号仅数字等）',
+    field_type VARCHAR(20) NOT NULL COMMENT '字段类型: email/phone/address/txid/ip/device_id/user_id/name',
+    user_id VARCHAR(255) NOT NULL,
+    source VARCHAR(50),
+    source_table VARCHAR(50) COMMENT '来源核心表',
+    source_file_name VARCHAR(255),
+    INDEX idx_value_type (normalized_value, field_type),
+    INDEX idx_user_id (user_id),
+    INDEX idx_source_file_name (source_file_name(191))
+) COMMENT='用户搜索索引，由ETL写库时生成'
+"""
+
+# --- 各核心表中写入索引的字段: {表名: [(列名, 字段类型)]} ---
+INDEXED_FIELDS = {
+    'users': [('user_id', 'user_id'), ('name', 'name'), ('email', 'email'), ('phone_number', 'phone')],
+    'login_logs': [('login_ip', 'ip'), ('device_id', 'device_id')],
+    'devices': [('device_id', 'device_id'), ('ip_address', 'ip')],
+    'asset_movements': [('address', 'address'), ('txid', 'txid')],
+}
+
+# 搜索结果中展示的字段名称和匹配类型（与模糊搜索的返回格式保持一致）
+FIELD_LABELS = {
+    'user_id': '用户ID',
+    'name': '姓名',
+    'email': '邮箱',
+    'phone': '手机',
+    'ip': 'IP地址',
+    'device_id': '设备ID',
+    'address': '地址',
+    'txid': '交易ID',
+}
+TABLE_MATCH_TYPES = {
+    'users': '用户信息',
+    'login_logs': '登录日志',
+    'devices': '设备信息',
+    'asset_movements': '资产流水',
+}
+
+# 大小写无关的字段统一转小写；地址只有 0x 开头的十六进制地址（ETH等）大小写无关，Base58 地址保持原样
+LOWERCASE_FIELDS = {'email', 'name', 'txid'}
+EMPTY_MARKERS = {'', 'nan', 'none', 'null', '-', '--'}
+HEX_ADDRESS_PATTERN = re.compile(r'^0[xX][0-9a-fA-F]+$')
+
+# 重建索引时每次从核心表读取的行数
+REBUILD_CHUNK_ROWS = 50000
+
+# 已确认索引表存在（只缓存存在的结果，执行迁移后无需重启即可生效）
+_search_index_exists = False
+
+
+def normalize_search_value(field_type: str, value):
+    """把单个值按字段类型规范化，无效值返回None（写入索引和查询时使用同一规则）"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    normalized = str(value).strip()
+    if field_type == 'phone':
+        normalized = re.sub(r'\D', '', normalized)
+    elif field_type in LOWERCASE_FIELDS:
+        normalized = normalized.lower()
+    elif field_type == 'address' and HEX_ADDRESS_PATTERN.match(normalized):
+        normalized = normalized.lower()
+    if normalized.lower() in EMPTY_MARKERS:
+        return None
+    return normalized[:MAX_VALUE_LENGTH]
+
+
+def _normalize_series(series: pd.Series, field_type: str) -> pd.Series:
+    """normalize_search_value 的整列版本，返回与输入同索引的Series（无效值为NaN）"""
+    values = series.dropna()
+    if values.empty:
+        return pd.Series(index=series.index, dtype=object)
+    normalized = values.astype(str).str.strip()
+    if field_type == 'phone':
+        normalized = normalized.str.replace(r'\D', '', regex=True)
+    elif field_type in LOWERCASE_FIELDS:
+        normalized = normalized.str.lower()
+    elif field_type == 'address':
+        is_hex = normalized.str.match(HEX_ADDRESS_PATTERN.pattern)
+        normalized = normalized.where(~is_hex, normalized.str.lower())
+    normalized = normalized[~normalized.str.lower().isin(EMPTY_MARKERS)]
+    return normalized.str.slice(0, MAX_VALUE_LENGTH).reindex(series.index)
+
+
+def build_search_index_rows(table_name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    从一张核心表的待写入数据中生成搜索索引记录（同一批内去重）。
+    不在 INDEXED_FIELDS 中的表、或没有 user_id 列的数据返回空DataFrame。
+    """
+    fields = INDEXED_FIELDS.get(table_name)
+    if not fields or df is None or df.empty or 'user_id' not in df.columns:
+        return pd.DataFrame()
+
+    user_ids = df['user_id'].map(lambda value: None if pd.isna(value) else str(value).strip())
+    parts = []
+    for column, field_type in fields:
+        if column not in df.columns:
+            continue
+        part = pd.DataFrame({
+            'normalized_value': _normalize_series(df[column], field_type),
+            'field_type': field_type,
+            'user_id': user_ids,
+            'source': df['source'] if 'source' in df.columns else None,
+            'source_table': table_name,
+            'source_file_name': df['source_file_name'] if 'source_file_name' in df.columns else None,
+        })
+        parts.append(part[part['normalized_value'].notna() & part['user_id'].notna() & (part['user_id'] != '')])
+
+    if not parts:
+        return pd.DataFrame()
+    rows = pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+    return rows
+
+
+def search_index_available(connection) -> bool:
+    """索引表是否已创建（未执行迁移 v2、或查询失败时返回False）"""
+    global _search_index_exists
+    if _search_index_exists:
+        return True
+    try:
+        exists = connection.execute(text(
+            "SELECT 1 FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = :table LIMIT 1"
+        ), {'table': SEARCH_INDEX_TABLE}).first()
+    except Exception as e:
+        print(f"    ⚠️ 检查搜索索引表失败: {e}")
+        return False
+    _search_index_exists = bool(exists)
+    return _search_index_exists
+
+
+def _warn_missing_table():
+    print(f"    ⚠️ 搜索索引表 '{SEARCH_INDEX_TABLE}' 不存在，跳过索引"
+          f"（请执行 python scripts/db_migrate.py migrate）")
+
+
+def write_search_index(table_name: str, df: pd.DataFrame, db_config: dict, connection=None, method: str = 'to_sql') -> int:
+    """
+    为刚写入核心表的数据生成并写入搜索索引，返回写入的索引条数。
+    索引是可重建的派生数据：写入失败（如尚未执行迁移、索引表不存在）只打印警告，不影响核心数据写入。
+    """
+    rows = build_search_index_rows(table_name, df)
+    if rows.empty:
+        return 0
+    try:
+        if connection is None:
+            with get_db_engine(db_config).begin() as own_connection:
+                return write_search_index(table_name, df, db_config, connection=own_connection, method=method)
+        if not search_index_available(connection):
+            _warn_missing_table()
+            return 0
+        write_df_to_db(rows, SEARCH_INDEX_TABLE, db_config, connection=connection, method=method)
+        return len(rows)
+    except Exception as e:
+        print(f"    ⚠️ 写入搜索索引失败（可稍后执行 python -m scripts.search_index rebuild 重建）: {e}")
+        return 0
+
+
+def delete_search_index_by_filename(db_config: dict, source_file_name: str, connection=None):
+    """清理某个源文件的搜索索引记录，失败时只打印警告"""
+    try:
+        if connection is None:
+            with get_db_engine(db_config).begin() as own_connection:
+                return delete_search_index_by_filename(db_config, source_file_name, connection=own_connection)
+        if not search_index_available(connection):
+            _warn_missing_table()
+            return
+        connection.execute(text(f"DELETE FROM {SEARCH_INDEX_TABLE} WHERE source_file_name = :file_name"),
+                           {"file_name": source_file_name})
+        print("    ✅ 已清理搜索索引中的旧数据")
+    except Exception as e:
+        print(f"    ⚠️ 清理搜索索引时发生错误: {e}")
+
+
+def rebuild_search_index(db_config: dict, connection=None) -> int:
+    """
+    清空并根据核心表中的现有数据重建搜索索引，返回写入的索引条数。
+    用于首次启用索引时回填历史数据，或索引与核心表不一致时修复。
+    """
+    def _rebuild(conn):
+        conn.execute(text(f"DELETE FROM {SEARCH_INDEX_TABLE}"))
+        total = 0
+        for table_name, fields in INDEXED_FIELDS.items():
+            columns = ['user_id', 'source', 'source_file_name'] + [
+                column for column, _ in fields if column != 'user_id'
+            ]
+            column_list = ', '.join(f"`{column}`" for column in columns)
+            chunks = pd.read_sql(text(f"SELECT {column_list} FROM `{table_name}`"), conn, chunksize=REBUILD_CHUNK_ROWS)
+            for chunk in chunks:
+                rows = build_search_index_rows(table_name, chunk)
+                if not rows.empty:
+                    write_df_to_db(rows, SEARCH_INDEX_TABLE, db_config, connection=conn, method='multi')
+                    total += len(rows)
+            print(f"  ✅ 已从 '{table_name}' 表重建索引，累计 {total} 条")
+        return total
+
+    if connection is not None:
+        return _rebuild(connection)
+    with get_db_engine(db_config).begin() as own_connection:
+        return _rebuild(own_connection)
+
+
+if __name__ == '__main__':
+    # 用法: python -m scripts.search_index rebuild
+    import sys
+    from .db_setup import DB_CONFIG
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("用法: python -m scripts.search_index rebuild")
+        sys.exit(1)
+    print("🔄 开始重建搜索索引...")
+    print(f"✅ 搜索索引重建完成，共 {rebuild_search_index(DB_CONFIG)} 条")
@@ -0,0 +1,111 @@
+# scripts/sheet_cache.py - 单次上传内共享的原始工作表缓存
+# 多模板逐个尝试、同一模板内多个数据源引用同一工作表时，
+# 每个工作表（按表头参数区分）在一次上传中只解码一次。
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .csv_sniffer import CsvFormat, sniff_csv_format
+
+
+def build_cell_value_index(sheet_df: pd.DataFrame) -> dict:
+    """
+    为原始数据帧构建单元格值索引: {字符串单元格值: (行标签, 列标签)}。
+    按行优先顺序扫描一次，每个值只记录第一次出现的位置（与 stack() 后取第一个匹配的结果一致）。
+    只索引字符串单元格——路标别名都是字符串，数值/空单元格不可能与之相等。
+    """
+    values = sheet_df.values
+    if values.size == 0:
+        return {}
+    flat_values = values.ravel()  # 行优先
+    is_str = np.fromiter((isinstance(v, str) for v in flat_values), dtype=bool, count=flat_values.size)
+    positions = np.flatnonzero(is_str)
+    if positions.size == 0:
+        return {}
+    cell_values = pd.Series(flat_values[positions], dtype=object)
+    first_seen = ~cell_values.duplicated(keep='first').values
+    positions = positions[first_seen]
+    rows, cols = np.divmod(positions, values.shape[1])
+    return dict(zip(
+        cell_values.values[first_seen],
+        zip(sheet_df.index[rows], sheet_df.columns[cols])
+    ))
+
+
+class SheetCache:
+    """
+    一次上传（一个文件）范围内的原始数据帧缓存。
+    缓存键为 (工作表名, header, nrows)，CSV文件按探测到的编码和格式缓存整表原始数据。
+    返回的DataFrame在多个模板/数据源之间共享，调用方如需原地修改必须先 copy()。
+    csv_nrows: 只读取CSV的前N行（大文件流式处理时用于模板匹配探测），默认读取整个文件。
+    """
+
+    def __init__(self, file_path: Path, csv_nrows: int = None):
+        self.file_path = file_path
+        self.csv_nrows = csv_nrows
+        self._excel_file = None
+        self._frames = {}
+        self._cell_indexes = {}
+        self._csv_format = None
+        self.hits = 0
+        self.misses = 0
+
+    def excel_file(self) -> pd.ExcelFile:
+        """打开（仅一次）Excel工作簿句柄"""
+        if self._excel_file is None:
+            self._excel_file = pd.ExcelFile(self.file_path)
+        return self._excel_file
+
+    def sheet_names(self) -> list:
+        return self.excel_file().sheet_names
+
+    def read_sheet(self, sheet_name: str, header=None, nrows=None) -> pd.DataFrame:
+        """读取工作表，相同的 (工作表, header, nrows) 只解析一次"""
+        key = ('sheet', sheet_name, header, nrows)
+        if key in self._frames:
+            self.hits += 1
+            return self._frames[key]
+
+        self.misses += 1
+        df = pd.read_excel(self.excel_file(), sheet_name=sheet_name, header=header, nrows=nrows)
+        self._frames[key] = df
+        return df
+
+    def csv_format(self) -> CsvFormat:
+        """探测（仅一次）CSV文件的编码、分隔符和引号"""
+        if self._csv_format is None:
+            self._csv_format = sniff_csv_format(self.file_path)
+        return self._csv_format
+
+    def read_csv(self, csv_format: CsvFormat) -> pd.DataFrame:
+        """以 header=None 读取CSV文件（或前 csv_nrows 行）作为原始数据，同一格式只读取一次"""
+        key = ('csv', csv_format)
+        if key in self._frames:
+            self.hits += 1
+            return self._frames[key]
+
+        self.misses += 1
+        df = pd.read_csv(self.file_path, header=None, nrows=self.csv_nrows, **csv_format.reader_kwargs())  # 不设置header，保持原始结构
+        self._frames[key] = df
+        return df
+
+    def cell_index(self, df: pd.DataFrame) -> dict:
+        """
+        返回本缓存中某个原始数据帧的单元格值索引（每个数据帧只构建一次），
+        同一工作表上的多个 form_layout / find_subtable_by_header 数据源共享同一个索引。
+        只能用于本缓存返回的数据帧（按对象身份缓存）。
+        """
+        key = id(df)
+        if key not in self._cell_indexes:
+            self._cell_indexes[key] = build_cell_value_index(df)
+        return self._cell_indexes[key]
+
+    def close(self):
+        """释放工作簿句柄和缓存的数据帧"""
+        if self._excel_file is not None:
+            try:
+                self._excel_file.close()
+            except Exception:
+                pass
+            self._excel_file = None
+        self._frames.clear()
+        self._cell_indexes.clear()
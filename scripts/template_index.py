@@ -0,0 +1,85 @@
+# scripts/template_index.py - 模板工作表签名索引
+# 对于Excel文件，仅凭工作表目录（sheet_names）通常就能判断哪个模板可能匹配。
+# 每个模板的"必需工作表集合"在模板计划编译时预先计算（见 template_plan.py），
+# 这里在解析任何工作表之前完成候选模板的排序和淘汰。
+from pathlib import Path
+from .template_plan import TemplatePlanCache
+
+
+def build_template_signature_index(registry: dict, plan_cache: TemplatePlanCache) -> dict:
+    """为注册表中的所有模板预先计算签名: {平台: [(模板路径, 签名), ...]}"""
+    index = {}
+    for platform, template_paths in registry.items():
+        entries = []
+        for template_path in template_paths:
+            plan = plan_cache.get_or_none(template_path)
+            if plan is not None:
+                entries.append((template_path, plan.signature))
+        index[platform] = entries
+    return index
+
+
+def rank_templates_by_sheet_names(template_paths: list, sheet_names: list, plan_cache: TemplatePlanCache):
+    """
+    仅根据工作表目录对候选模板进行排序和淘汰。
+    - 缺少任何必需工作表的模板直接淘汰
+    - 其余模板按命中的工作表数量从多到少排序（数量相同时保持注册表顺序）
+    - 没有工作表签名的模板（如CSV模板）保留在候选列表末尾，交给完整提取流程判断
+
+    :return: (候选模板路径列表, {被淘汰的模板路径: 缺少的工作表列表})
+    """
+    available = set(sheet_names)
+    ranked = []
+    unsigned = []
+    rejected = {}
+
+    for order, template_path in enumerate(template_paths):
+        plan = plan_cache.get_or_none(template_path)
+        if plan is None or not plan.signature['required_sheets']:
+            unsigned.append(template_path)
+            continue
+
+        signature = plan.signature
+        missing = [sheet for sheet in signature['source_sheets'].values()
+                   if sheet in signature['required_sheets'] and sheet not in available]
+        if missing:
+            # 保持与模板中的声明顺序一致，并去重
+            rejected[template_path] = list(dict.fromkeys(missing))
+            continue
+
+        matched_count = len((signature['required_sheets'] | signature['optional_sheets']) & available)
+        ranked.append((-matched_count, order, template_path))
+
+    candidates = [template_path for _, _, template_path in sorted(ranked)] + unsigned
+    return candidates, rejected
+
+
+def detect_platform_by_sheet_names(signature_index: dict, sheet_names: list):
+    """
+    文件名无法识别平台时，根据工作表目录猜测平台：
+    在所有带签名的模板中，选出必需工作表全部存在、且命中工作表最多的模板所属的平台。
+    没有任何模板满足时返回None。
+    """
+    available = set(sheet_names)
+    best_platform, best_count = None, 0
+    for platform, entries in signature_index.items():
+        for template_path, signature in entries:
+            if not signature['required_sheets'] or not signature['required_sheets'] <= available:
+                continue
+            matched_count = len((signature['required_sheets'] | signature['optional_sheets']) & available)
+            if matched_count > best_count:
+                best_platform, best_count = platform, matched_count
+    return best_platform
+
+
+def sources_present_by_sheets(template_path: Path, sheet_names: list, plan_cache: TemplatePlanCache) -> dict:
+    """返回工作表存在于文件中的数据源: {source_id: 工作表名}，供平台匹配度预检使用"""
+    plan = plan_cache.get_or_none(template_path)
+    if plan is None:
+        return {}
+    available = set(sheet_names)
+    return {
+        source_id: sheet_name
+        for source_id, sheet_name in plan.signature['source_sheets'].items()
+        if sheet_name in available
+    }
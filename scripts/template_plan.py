@@ -0,0 +1,158 @@
+# scripts/template_plan.py - 预编译的模板计划
+# 模板在启动时编译一次，之后只有当 .jsonc 文件的修改时间变化时才重新解析。
+# 计划中保存：解析好的转换函数、可选数据源集合、别名列表、工作表签名，
+# 以及按表头签名缓存的"别名 → 列名"解析结果。
+import threading
+from pathlib import Path
+from typing import NamedTuple
+from .utils import load_mapping_config
+from .data_extract import OPTIONAL_SOURCE_IDS, compile_destination, find_field_from_aliases
+
+# 每个模板最多缓存的表头签名数量，超出后清空重建
+MAX_ALIAS_SIGNATURES = 256
+
+
+def build_template_signature(mapping_config: dict, optional_source_ids) -> dict:
+    """
+    根据模板的 sources 配置生成工作表签名。
+    :return: {
+        'required_sheets': 必需工作表集合,
+        'optional_sheets': 可选工作表集合,
+        'source_sheets': {source_id: 工作表名}
+    }
+    """
+    required_sheets = set()
+    optional_sheets = set()
+    source_sheets = {}
+
+    for source in mapping_config.get('sources', []):
+        sheet_name = source.get('worksheet_name')
+        if not sheet_name:
+            continue
+        source_id = source.get('source_id', 'unknown')
+        source_sheets[source_id] = sheet_name
+        if source_id in optional_source_ids:
+            optional_sheets.add(sheet_name)
+        else:
+            required_sheets.add(sheet_name)
+
+    return {
+        'required_sheets': frozenset(required_sheets),
+        'optional_sheets': frozenset(optional_sheets - required_sheets),
+        'source_sheets': source_sheets
+    }
+
+
+class TemplatePlan(NamedTuple):
+    """
+    一个模板的不可变编译结果。
+    config 为原始解析结果，仅供只读使用；alias_cache 是唯一会变化的部分（按表头签名缓存别名解析），
+    ETL任务队列的多个线程共用同一计划，读写 alias_cache 时需持有 alias_lock。
+    """
+    path: Path
+    mtime_ns: int
+    config: dict
+    metadata: dict
+    sources: tuple
+    destinations: tuple     # CompiledDestination 元组
+    optional_sources: frozenset
+    signature: dict
+    alias_cache: dict
+    alias_lock: threading.Lock
+
+    @property
+    def display_name(self) -> str:
+        """模板显示名称：优先 display_name，其次 description，带上版本号"""
+        display_name = self.metadata.get('display_name') or self.metadata.get('description')
+        if display_name:
+            version = self.metadata.get('version')
+            if version:
+                display_name = f"{display_name} (v{version})"
+        return display_name
+
+    def resolve_alias(self, columns, aliases: tuple):
+        """按 (表头签名, 别名列表) 缓存别名解析结果，同一表头只解析一次"""
+        key = (tuple(columns), aliases)
+        with self.alias_lock:
+            if key in self.alias_cache:
+                return self.alias_cache[key]
+
+        # 解析在锁外进行，并发时同一个键可能解析两次，结果相同
+        field_name = find_field_from_aliases(columns, aliases)
+        with self.alias_lock:
+            if len(self.alias_cache) >= MAX_ALIAS_SIGNATURES:
+                self.alias_cache.clear()
+            self.alias_cache[key] = field_name
+        return field_name
+
+
+def compile_template_plan(template_path: Path, function_registry: dict, batch_function_registry: dict = None) -> TemplatePlan:
+    """解析 .jsonc 模板并编译为 TemplatePlan"""
+    mtime_ns = template_path.stat().st_mtime_ns
+    mapping_config = load_mapping_config(template_path) or {}
+
+    sources = tuple(mapping_config.get('sources', []))
+    optional_sources = frozenset(OPTIONAL_SOURCE_IDS) | frozenset(
+        source.get('source_id') for source in sources if source.get('optional')
+    )
+    destinations = tuple(
+        compile_destination(destination, function_registry, batch_function_registry)
+        for destination in mapping_config.get('destinations', [])
+    )
+
+    return TemplatePlan(
+        path=template_path,
+        mtime_ns=mtime_ns,
+        config=mapping_config,
+        metadata=mapping_config.get('metadata', {}) if isinstance(mapping_config.get('metadata'), dict) else {},
+        sources=sources,
+        destinations=destinations,
+        optional_sources=optional_sources,
+        signature=build_template_signature(mapping_config, optional_sources),
+        alias_cache={},
+        alias_lock=threading.Lock()
+    )
+
+
+class TemplatePlanCache:
+    """
+    模板计划缓存：按模板路径保存编译结果，每次获取时只比较文件修改时间，
+    文件未变化则直接复用，变化后自动重新编译。
+    """
+
+    def __init__(self, function_registry: dict, batch_function_registry: dict = None):
+        self.function_registry = function_registry
+        self.batch_function_registry = batch_function_registry
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def get(self, template_path: Path) -> TemplatePlan:
+        """获取模板计划，模板文件不存在时抛出 FileNotFoundError"""
+        try:
+            mtime_ns = template_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"模板文件不存在: {template_path}")
+
+        with self._lock:
+            plan = self._plans.get(template_path)
+            if plan is not None and plan.mtime_ns == mtime_ns:
+                return plan
+
+        plan = compile_template_plan(template_path, self.function_registry, self.batch_function_registry)
+        with self._lock:
+            self._plans[template_path] = plan
+        return plan
+
+    def get_or_none(self, template_path: Path) -> TemplatePlan:
+        """获取模板计划，模板缺失或无法解析时返回None"""
+        try:
+            return self.get(template_path)
+        except Exception:
+            return None
+
+    def preload(self, registry: dict):
+        """启动时编译注册表中的所有模板，单个模板失败不影响其他模板"""
+        for template_paths in registry.values():
+            for template_path in template_paths:
+                if self.get_or_none(template_path) is None:
+                    print(f"  🟡 模板预编译失败，将在使用时重试: {template_path}")
@@ -1,5 +1,24 @@
+import numpy as np
 import pandas as pd
 from decimal import Decimal, InvalidOperation
+from pandas.api.types import is_datetime64_dtype
+from pandas.tseries.api import guess_datetime_format
+
+# 常见稳定币计价后缀（按匹配优先级排列）
+QUOTE_ASSET_SUFFIXES = ('USDT', 'BUSD', 'USDC', 'DAI')
+
+# ImToken 操作类型 → 标准方向
+IMTOKEN_DIRECTION_MAP = {
+    'NEW_IDENTITY': 'CREATE',   # 钱包创建
+    'PRIVATE': 'CREATE',
+    'DELETE_WALLET': 'DELETE',  # 钱包删除
+    'IMPORT_WALLET': 'IMPORT'   # 钱包导入
+}
+
+BUY_SELL_MAP = {'买': 'BUY', '卖': 'SELL'}
+
+# 按列解析日期时间后，抽样与标量函数比对的单元格数
+DATETIME_CHECK_SAMPLES = 16
 
 def string_to_decimal(value):
     if value is None or pd.isna(value): return None
@@ -45,11 +64,113 @@ def map_imtoken_direction(value: str) -> str:
     if not isinstance(value, str): return 'UNKNOWN'
     
     value_upper = value.upper()
-    if value_upper in ['NEW_IDENTITY', 'PRIVATE']:
-        return 'CREATE'  # 钱包创建
-    elif value_upper in ['DELETE_WALLET']:
-        return 'DELETE'  # 钱包删除
-    elif value_upper in ['IMPORT_WALLET']:
-        return 'IMPORT'  # 钱包导入
-    else:
-        return value_upper  # 保持原值
\ No newline at end of file
+    return IMTOKEN_DIRECTION_MAP.get(value_upper, value_upper)  # 未知类型保持原值
+
+
+# ==============================================================================
+# --- 批量（按列）转换函数 ---
+# 输入输出均为 object 类型的 pandas Series，逐元素结果与上面的标量函数完全一致。
+# 通过 main.py 中的 BATCH_FUNCTION_REGISTRY 按同名注册；批量函数抛出异常时，
+# 调用方会回退为逐元素调用标量函数。
+# ==============================================================================
+
+# 交易对的计价币种后缀；用 \Z 而不是 $（$ 也匹配末尾换行符之前的位置，与标量函数的 endswith 不一致）
+_QUOTE_SUFFIX_PATTERN = '(' + '|'.join(QUOTE_ASSET_SUFFIXES) + r')\Z'
+
+def _string_mask(values: pd.Series) -> np.ndarray:
+    """返回元素是否为字符串的布尔数组"""
+    return np.fromiter((isinstance(v, str) for v in values.values), dtype=bool, count=len(values))
+
+def _object_series(result: np.ndarray, like: pd.Series) -> pd.Series:
+    return pd.Series(result, index=like.index, dtype=object)
+
+def parse_universal_datetime_batch(values: pd.Series) -> pd.Series:
+    """
+    按列解析日期时间：对字符串列只推断一次格式，再整列按该格式解析。
+    只对年份在前的格式（如 2023-02-01 10:00:00、2023/02/01）整列解析：
+    01/02/2023 这类日月顺序有歧义的格式，标量函数会逐个判断，整列套用同一格式结果可能不同。
+    整列解析后抽样与标量函数比对，不一致时整列放弃。
+    无法按推断格式解析的单元格（以及非字符串列）逐个回退到 parse_universal_datetime。
+    """
+    result = np.full(len(values), None, dtype=object)
+    null_mask = values.isna().values
+    is_str = _string_mask(values)
+
+    parsed_mask = np.zeros(len(values), dtype=bool)
+    if is_str.any():
+        texts = values[is_str]
+        datetime_format = guess_datetime_format(texts.iloc[0])
+        if datetime_format and datetime_format.startswith('%Y'):
+            parsed = pd.to_datetime(texts, format=datetime_format, errors='coerce')
+            # 只接受解析为无时区时间的结果，带时区或混合偏移的情况交给标量函数
+            if is_datetime64_dtype(parsed.dtype) and _matches_scalar_sample(texts, parsed):
+                ok = parsed.notna().values
+                positions = np.flatnonzero(is_str)[ok]
+                result[positions] = parsed[ok].astype(object).values
+                parsed_mask[positions] = True
+
+    for position in np.flatnonzero(~parsed_mask & ~null_mask):
+        result[position] = parse_universal_datetime(values.iat[position])
+    return _object_series(result, values)
+
+def _matches_scalar_sample(texts: pd.Series, parsed: pd.Series) -> bool:
+    """抽取均匀分布的若干个已解析单元格，检查与 parse_universal_datetime 的结果一致"""
+    ok_positions = np.flatnonzero(parsed.notna().values)
+    if len(ok_positions) == 0:
+        return True
+    sample = ok_positions[np.linspace(0, len(ok_positions) - 1, min(DATETIME_CHECK_SAMPLES, len(ok_positions))).astype(int)]
+    return all(parse_universal_datetime(texts.iat[position]) == parsed.iat[position] for position in sample)
+
+def string_to_decimal_batch(values: pd.Series) -> pd.Series:
+    """按列转换为Decimal：去千分位逗号的字符串处理整列完成，相同文本只构造一次Decimal"""
+    result = np.full(len(values), None, dtype=object)
+    valid_mask = ~values.isna().values
+    if valid_mask.any():
+        texts = values[valid_mask].astype(str).str.replace(',', '', regex=False)
+        decimals = {}
+        converted = []
+        for text in texts.values:
+            if text not in decimals:
+                try:
+                    decimals[text] = Decimal(text)
+                except (InvalidOperation, ValueError, TypeError):
+                    decimals[text] = None
+            converted.append(decimals[text])
+        result[valid_mask] = converted
+    return _object_series(result, values)
+
+def map_buy_sell_batch(values: pd.Series) -> pd.Series:
+    """按列映射买卖方向"""
+    result = np.full(len(values), 'UNKNOWN', dtype=object)
+    is_str = _string_mask(values)
+    if is_str.any():
+        mapped = values[is_str].map(BUY_SELL_MAP)
+        found = mapped.notna().values
+        result[np.flatnonzero(is_str)[found]] = mapped[found].values
+    return _object_series(result, values)
+
+def extract_base_asset_batch(pairs: pd.Series) -> pd.Series:
+    """按列从交易对中提取基础币种，非字符串元素返回None"""
+    result = np.full(len(pairs), None, dtype=object)
+    is_str = _string_mask(pairs)
+    if is_str.any():
+        result[is_str] = pairs[is_str].str.replace(_QUOTE_SUFFIX_PATTERN, '', regex=True).values
+    return _object_series(result, pairs)
+
+def extract_quote_asset_batch(pairs: pd.Series) -> pd.Series:
+    """按列从交易对中提取计价币种，非字符串元素返回None，无法判断时为'UNKNOWN'"""
+    result = np.full(len(pairs), None, dtype=object)
+    is_str = _string_mask(pairs)
+    if is_str.any():
+        suffixes = pairs[is_str].str.extract(_QUOTE_SUFFIX_PATTERN, expand=False)
+        result[is_str] = suffixes.fillna('UNKNOWN').values
+    return _object_series(result, pairs)
+
+def map_imtoken_direction_batch(values: pd.Series) -> pd.Series:
+    """按列映射ImToken操作类型，非字符串元素为'UNKNOWN'"""
+    result = np.full(len(values), 'UNKNOWN', dtype=object)
+    is_str = _string_mask(values)
+    if is_str.any():
+        upper = values[is_str].str.upper()
+        result[is_str] = upper.map(IMTOKEN_DIRECTION_MAP).fillna(upper).values
+    return _object_series(result, values)
@@ -1,8 +1,12 @@
 # scripts/utils.py
 import json
+import os
+import tempfile
+from decimal import Decimal
 import pandas as pd
 from pathlib import Path
 from .error_handler import ETLError, ErrorType, create_user_friendly_error
+from .read_cache import invalidate_for_write
 def inspect_excel_structure(file_path):
     """
     一个调试辅助函数，用来读取一个Excel文件并打印出其所有工作表及其列名的结构。
@@ -57,25 +61,73 @@ def determine_company_from_filename(file_path: Path, registry: dict) -> str:
 
 # 导入sqlalchemy库的create_engine，用于创建数据库连接引擎
 from sqlalchemy import create_engine
+import threading
 
-def get_db_engine(db_config: dict):
+# --- 数据库连接池配置 ---
+# 每个数据库配置在进程内只创建一个引擎，所有辅助函数共享它的连接池，
+# 避免每次调用都重新进行 TCP 连接和认证握手。
+DB_POOL_SIZE = int(os.environ.get('ETL_DB_POOL_SIZE', 5))          # 常驻连接数
+DB_MAX_OVERFLOW = int(os.environ.get('ETL_DB_MAX_OVERFLOW', 10))   # 高峰时允许额外创建的连接数
+DB_POOL_RECYCLE = int(os.environ.get('ETL_DB_POOL_RECYCLE', 3600)) # 连接最长复用秒数，需小于MySQL的 wait_timeout
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _reset_engines_after_fork():
+    # 子进程不能复用父进程连接池中的套接字：只丢弃引用，不关闭父进程的连接
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+def get_db_engine(db_config: dict, allow_local_infile: bool = False):
     """
-    根据传入的数据库配置字典，创建并返回一个SQLAlchemy数据库引擎。
+    根据传入的数据库配置字典，返回一个SQLAlchemy数据库引擎。
+    同一配置（及 allow_local_infile 选项）在进程内只创建一次，之后直接复用带连接池的引擎。
     :param db_config: 一个包含数据库连接信息的字典
+    :param allow_local_infile: 是否允许客户端执行 LOAD DATA LOCAL INFILE（批量导入模式需要）
     """
     db_type = db_config['type']
 
     if db_type == 'mysql':
-        # 使用 f-string 构建标准的MySQL连接URL
-        conn_url = (
-            f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}"
-            f"@{db_config['host']}:{db_config['port']}/{db_config['db_name']}"
+        cache_key = (
+            db_type, db_config['user'], db_config['password'],
+            db_config['host'], str(db_config['port']), db_config['db_name'], allow_local_infile
         )
-        return create_engine(conn_url, echo=False)  # 关闭SQL语句输出
+        with _engines_lock:
+            engine = _engines.get(cache_key)
+            if engine is None:
+                # 使用 f-string 构建标准的MySQL连接URL
+                conn_url = (
+                    f"mysql+mysqlconnector://{db_config['user']}:{db_config['password']}"
+                    f"@{db_config['host']}:{db_config['port']}/{db_config['db_name']}?charset=utf8mb4"
+                )
+                connect_args = {'allow_local_infile': True} if allow_local_infile else {}
+                engine = create_engine(
+                    conn_url,
+                    echo=False,                    # 关闭SQL语句输出
+                    connect_args=connect_args,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=True             # 取出连接前先探活，自动替换被服务器断开的连接
+                )
+                _engines[cache_key] = engine
+            return engine
     else:
         raise ValueError(f"当前配置只支持 'mysql'，但收到了 '{db_type}'")
 
 
+def get_raw_connection(db_config: dict):
+    """
+    从共享连接池中取出一个原始DBAPI连接（mysql.connector 连接），供需要直接使用游标的代码使用。
+    用法与 mysql.connector.connect() 返回的连接相同，close() 时连接归还到连接池而不是断开。
+    """
+    return get_db_engine(db_config).raw_connection()
+
+
 def test_database_connection(db_config: dict):
     """
     接收一个数据库配置字典，尝试连接数据库，并打印连接结果。
@@ -127,38 +179,98 @@ def load_mapping_config(path: Path) -> dict:
         # 重新抛出原始异常，供上层处理
         raise e
 
+# --- 写库方式 ---
+# to_sql:    pandas 默认方式，逐行 executemany
+# multi:     多行 VALUES 批量插入（每条 INSERT 语句 WRITE_CHUNK_ROWS 行）
+# load_data: 写入临时文件后执行 LOAD DATA LOCAL INFILE（需要服务器开启 local_infile）
+WRITE_METHODS = ('to_sql', 'multi', 'load_data')
+WRITE_CHUNK_ROWS = 1000
+
+def _load_data_field(value) -> str:
+    """把单元格转换为 LOAD DATA 默认转义规则下的文本：空值为 \\N，反斜杠/制表符/换行需要转义"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, float) and value != value:
+        return '\\N'
+    if value is pd.NaT or (not isinstance(value, (str, bytes, Decimal)) and pd.isna(value)):
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, pd.Timestamp):
+        text = value.isoformat(sep=' ')
+    else:
+        text = str(value)
+    return (text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+                .replace('\r', '\\r').replace('\0', '\\0'))
+
+def _load_data_local_infile(df, table_name: str, connection):
+    """把DataFrame写成制表符分隔的临时文件，用一条 LOAD DATA LOCAL INFILE 导入"""
+    columns = list(df.columns)
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8', newline='') as f:
+        temp_path = f.name
+        for row in df.itertuples(index=False, name=None):
+            f.write('\t'.join(_load_data_field(value) for value in row))
+            f.write('\n')
+    try:
+        file_literal = temp_path.replace('\\', '/').replace("'", "\\'")
+        column_list = ', '.join(f"`{column}`" for column in columns)
+        load_sql = (
+            f"LOAD DATA LOCAL INFILE '{file_literal}' INTO TABLE `{table_name}` "
+            f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            f"LINES TERMINATED BY '\\n' ({column_list})"
+        )
+        connection.exec_driver_sql(load_sql)
+    finally:
+        os.remove(temp_path)
+
 #接收处理好的数据(df)、目标表名(table_name)和数据库配置(db_config)，然后执行写入操作
-def write_df_to_db(df, table_name: str, db_config: dict):
+def write_df_to_db(df, table_name: str, db_config: dict, connection=None, method: str = 'to_sql'):
     """
     将一个DataFrame写入到指定的数据库表中。
     :param df: 要写入的Pandas DataFrame。
     :param table_name: 目标数据库表的名称。
     :param db_config: 数据库连接配置字典。
+    :param connection: 可选的已打开连接（通常处于事务中）；提供时在该连接上写入、不提交，
+                       由调用方统一提交或回滚。未提供时为本次写入单独创建引擎。
+    :param method: 写库方式，见 WRITE_METHODS。
     """
     if df is None or df.empty:
         print(f"    🟡 '{table_name}' 表无数据，跳过写入")
         return
+    if method not in WRITE_METHODS:
+        raise ValueError(f"不支持的写库方式: {method}，可选: {', '.join(WRITE_METHODS)}")
 
     try:
-        # 从我们已有的函数中获取数据库引擎
-        engine = get_db_engine(db_config)
-        
-        print(f"    📝 写入 {len(df)} 条记录到 '{table_name}' 表...")
+        print(f"    📝 写入 {len(df)} 条记录到 '{table_name}' 表 ({method})...")
         
-        # 使用pandas强大的to_sql功能，将整个DataFrame一次性写入数据库
-        df.to_sql(
-            name=table_name,       # 目标表名
-            con=engine,            # 数据库连接引擎
-            if_exists='append',    # 如果表已存在，就追加数据。'replace'会替换整个表。
-            index=False,           # 不要将DataFrame的行号索引作为一列写入数据库
-            chunksize=1000         # 可选：一次写入1000行，对于大数据量可以提高效率
-        )
+        if connection is None:
+            # 从我们已有的函数中获取数据库引擎，单独开启一个事务
+            engine = get_db_engine(db_config, allow_local_infile=(method == 'load_data'))
+            with engine.begin() as own_connection:
+                _write_with_method(df, table_name, own_connection, method)
+        else:
+            _write_with_method(df, table_name, connection, method)
         print(f"    ✅ '{table_name}' 表写入成功！")
         
     except Exception as e:
         print(f"    ❌ '{table_name}' 表写入失败: {e}")
         # 重新抛出原始异常，供上层处理
         raise e
+
+def _write_with_method(df, table_name: str, connection, method: str):
+    if method == 'load_data':
+        _load_data_local_infile(df, table_name, connection)
+        return
+    # 使用pandas强大的to_sql功能写入；连接已处于事务中时，pandas不会自行提交
+    df.to_sql(
+        name=table_name,       # 目标表名
+        con=connection,        # 数据库连接
+        if_exists='append',    # 如果表已存在，就追加数据。'replace'会替换整个表。
+        index=False,           # 不要将DataFrame的行号索引作为一列写入数据库
+        chunksize=WRITE_CHUNK_ROWS,  # 每批写入的行数
+        method='multi' if method == 'multi' else None  # multi: 每批拼成一条多行 INSERT
+    )
+
 # (文件上方是您已有的其他函数)
 # ...
 from sqlalchemy import text # <-- 在文件顶部，请确保从sqlalchemy导入text
@@ -202,23 +314,58 @@ def reset_database_tables(db_config: dict, table_names: list):
         print(f"❌ 重置数据库时发生错误: {e}")
 # utils.py 中
 
-def delete_data_by_filename(db_config: dict, table_names: list, source_file_name: str):
+def delete_data_by_filename(db_config: dict, table_names: list, source_file_name: str, connection=None):
     """
     根据源文件名，精准删除所有核心表中的现有数据。
+    connection: 可选的已打开连接（处于事务中）；提供时在该连接上删除、不单独提交，
+                这样删除旧数据和写入新数据可以在同一个事务中完成，查询缓存由调用方在提交后失效。
     """
+    def _delete_all(conn):
+        for table in table_names:
+            # SQL命令现在WHERE条件更精准了
+            delete_sql = text(f"DELETE FROM `{table}` WHERE source_file_name = :file_name")
+            conn.execute(delete_sql, {"file_name": source_file_name})
+            print(f"    ✅ 已清理表 '{table}' 中的旧数据")
+
     try:
+        if connection is not None:
+            _delete_all(connection)
+            return
         engine = get_db_engine(db_config)
         with engine.connect() as connection:
             trans = connection.begin()
             try:
-                for table in table_names:
-                    # SQL命令现在WHERE条件更精准了
-                    delete_sql = text(f"DELETE FROM `{table}` WHERE source_file_name = :file_name")
-                    connection.execute(delete_sql, {"file_name": source_file_name})
-                    print(f"    ✅ 已清理表 '{table}' 中的旧数据")
+                _delete_all(connection)
                 trans.commit()
             except Exception as e:
                 trans.rollback()
                 raise e
+        # 已提交：失效来自该文件的查询缓存（在调用方事务中删除时，由调用方在提交后失效）
+        invalidate_for_write(file_names=[source_file_name])
     except Exception as e:
-        print(f"    ❌ 清理旧数据时发生错误: {e}")
\ No newline at end of file
+        print(f"    ❌ 清理旧数据时发生错误: {e}")
+
+def relink_data_by_filename(db_config: dict, table_names: list, old_file_name: str, new_file_name: str,
+                            connection=None) -> dict:
+    """
+    把来自 old_file_name 的数据改为属于 new_file_name（内容相同的文件重复上传时使用），
+    返回 {表名: 更新的行数}。与删除不同，失败时抛出异常由调用方处理。
+    connection: 可选的已打开连接（处于事务中），语义同 delete_data_by_filename。
+    """
+    def _relink_all(conn):
+        updated = {}
+        for table in table_names:
+            update_sql = text(f"UPDATE `{table}` SET source_file_name = :new_file_name "
+                              f"WHERE source_file_name = :old_file_name")
+            result = conn.execute(update_sql, {"new_file_name": new_file_name, "old_file_name": old_file_name})
+            updated[table] = result.rowcount
+            print(f"    ✅ 表 '{table}' 已转移 {result.rowcount} 条数据")
+        return updated
+
+    if connection is not None:
+        return _relink_all(connection)
+    engine = get_db_engine(db_config)
+    with engine.begin() as connection:
+        updated = _relink_all(connection)
+    invalidate_for_write(file_names=[old_file_name, new_file_name])
+    return updated
\ No newline at end of file
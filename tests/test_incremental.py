@@ -0,0 +1,101 @@
+# tests/test_incremental.py - 增量重新导入（sqlite 内存库）
+import os
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts import incremental, search_index
+from scripts.incremental import add_row_fingerprints, write_incremental, write_incremental_search_index
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    # sqlite 没有 information_schema，直接视为索引表已存在
+    monkeypatch.setattr(incremental, 'search_index_available', lambda connection: True)
+    monkeypatch.setattr(search_index, 'search_index_available', lambda connection: True)
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE login_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, source TEXT, "
+            "login_ip TEXT, source_file_name TEXT, row_fingerprint TEXT)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT UNIQUE, source TEXT, "
+            "name TEXT, source_file_name TEXT, row_fingerprint TEXT)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE search_index (id INTEGER PRIMARY KEY AUTOINCREMENT, normalized_value TEXT, "
+            "field_type TEXT, user_id TEXT, source TEXT, source_table TEXT, source_file_name TEXT)"
+        ))
+        yield conn
+
+
+def _frame(file_name, **columns):
+    df = pd.DataFrame(columns)
+    df['source_file_name'] = file_name
+    return add_row_fingerprints(df)
+
+
+def _import(conn, table, df, file_name, superseded_files):
+    result = write_incremental(df, table, {}, conn, file_name, [file_name] + superseded_files)
+    write_incremental_search_index(df, table, {}, conn, [file_name] + superseded_files)
+    return result
+
+
+def _rows(conn, sql):
+    return conn.execute(text(sql)).fetchall()
+
+
+def test_chained_incremental_imports_transfer_unchanged_rows(connection):
+    ips = ['1.1.1.1', '2.2.2.2']
+    original = _frame('O', user_id=['u1'] * 2, source=['Binance'] * 2, login_ip=ips)
+    original.to_sql('login_logs', connection, if_exists='append', index=False)
+    search_index.write_search_index('login_logs', original, {}, connection=connection)
+
+    result = _import(connection, 'login_logs',
+                     _frame('X', user_id=['u1'] * 3, source=['Binance'] * 3, login_ip=ips + ['3.3.3.3']),
+                     'X', ['O'])
+    assert (len(result.inserted_rows), result.deleted, result.relinked) == (1, 0, 2)
+
+    result = _import(connection, 'login_logs',
+                     _frame('Y', user_id=['u1'] * 4, source=['Binance'] * 4,
+                            login_ip=ips + ['3.3.3.3', '4.4.4.4']),
+                     'Y', ['X'])
+    assert (len(result.inserted_rows), result.deleted, result.relinked) == (1, 0, 3)
+
+    assert sorted(_rows(connection, "SELECT login_ip, source_file_name FROM login_logs")) == [
+        ('1.1.1.1', 'Y'), ('2.2.2.2', 'Y'), ('3.3.3.3', 'Y'), ('4.4.4.4', 'Y')
+    ]
+    index_rows = _rows(connection, "SELECT normalized_value, source_file_name FROM search_index "
+                                   "WHERE field_type = 'ip'")
+    assert sorted(index_rows) == [('1.1.1.1', 'Y'), ('2.2.2.2', 'Y'), ('3.3.3.3', 'Y'), ('4.4.4.4', 'Y')]
+
+
+def test_chained_incremental_imports_keep_unique_users(connection):
+    _frame('O', user_id=['u1'], source=['Binance'], name=['张三']).to_sql(
+        'users', connection, if_exists='append', index=False)
+    _import(connection, 'users', _frame('X', user_id=['u1'], source=['Binance'], name=['张三']), 'X', ['O'])
+    _import(connection, 'users', _frame('Y', user_id=['u1'], source=['Binance'], name=['张三']), 'Y', ['X'])
+
+    assert _rows(connection, "SELECT user_id, source_file_name FROM users") == [('u1', 'Y')]
+
+
+def test_other_files_of_the_same_account_are_untouched(connection):
+    _frame('part_02', user_id=['u1'], source=['Binance'], login_ip=['1.1.1.1']).to_sql(
+        'login_logs', connection, if_exists='append', index=False)
+    _frame('part_03', user_id=['u1', None], source=['Binance'] * 2, login_ip=['9.9.9.9', '8.8.8.8']).to_sql(
+        'login_logs', connection, if_exists='append', index=False)
+
+    result = _import(connection, 'login_logs',
+                     _frame('part_02_v2', user_id=['u1', None], source=['Binance'] * 2,
+                            login_ip=['2.2.2.2', '7.7.7.7']),
+                     'part_02_v2', ['part_02'])
+    assert result.deleted == 1
+
+    assert sorted(_rows(connection, "SELECT login_ip, source_file_name FROM login_logs")) == [
+        ('2.2.2.2', 'part_02_v2'), ('7.7.7.7', 'part_02_v2'), ('8.8.8.8', 'part_03'), ('9.9.9.9', 'part_03')
+    ]
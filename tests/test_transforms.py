@@ -0,0 +1,22 @@
+# tests/test_transforms.py - 批量转换函数与标量函数逐元素一致
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.transforms import (extract_base_asset, extract_base_asset_batch,
+                                extract_quote_asset, extract_quote_asset_batch)
+
+PAIRS = pd.Series(['BTCUSDT', 'ETHBUSD', 'SOLUSDC', 'ETHDAI', 'BTCUSDT\n', 'USDT\n', 'BNBBTC', '', None, 42],
+                  dtype=object)
+
+
+@pytest.mark.parametrize('scalar, batch', [
+    (extract_base_asset, extract_base_asset_batch),
+    (extract_quote_asset, extract_quote_asset_batch),
+])
+def test_asset_batch_matches_scalar(scalar, batch):
+    assert batch(PAIRS).tolist() == [scalar(pair) for pair in PAIRS]
@@ -0,0 +1,60 @@
+# tests/test_xlsx_stream.py - 流式读取 xlsx 与 read_excel 结果一致
+import datetime
+import os
+import sys
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.data_extract import iter_tabular_xlsx_batches
+
+
+@pytest.fixture
+def xlsx_path(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = 'Logs'
+    sheet.append(['User ID', 'Client Version', 'Amount', 'Count', 'Flag', 'Time', 'Port', 'ID Number', 'Ad Number', 'TxID'])
+    for i in range(20):
+        sheet.append([
+            1000 + i,
+            # 前面的批次全是数字，后面才出现 '2.91.1'，整列应为字符串
+            '2.91.1' if i == 17 else str(25200 + i),
+            1.5 if i == 12 else i,                       # 整数中出现浮点数
+            None if i == 15 else i,                      # 整数列中的空值
+            i % 2 == 0,
+            datetime.datetime(2024, 1, 1, 0, i) if i != 3 else None,
+            8080 if i < 10 else 'N/A',                   # 数字单元格后出现文本
+            None if i == 19 else str(350822199302100457 + i * 1000003),   # 有空值的文本数字列按浮点数解析
+            12652232616729542656 + i,                    # 超出 int64 的整数
+            # 批次以 '6e7297327822e0d…' 开头时 pandas 转换数字会崩溃
+            '6e7297327822e0d885b8' if i == 7 else '0x%064x' % i,
+        ])
+    sheet.append([])
+    sheet.append([2000, '25999', 2, 3, True, None, 443, '350822199302100457', 12652232616729542656, '0x65', 'extra'])   # 比表头更宽的行
+    sheet.append([])                                                  # 末尾空行被丢弃
+    path = tmp_path / 'logs.xlsx'
+    workbook.save(path)
+    return path
+
+
+@pytest.mark.parametrize('batch_rows', [1, 3, 7, 100])
+def test_batches_match_read_excel(xlsx_path, batch_rows):
+    expected = pd.read_excel(xlsx_path, sheet_name='Logs', header=0)
+    batches = list(iter_tabular_xlsx_batches(xlsx_path, {'worksheet_name': 'Logs', 'header_row': 1}, batch_rows))
+    got = pd.concat(batches, ignore_index=True)
+
+    pd.testing.assert_frame_equal(got, expected)
+    assert [type(value) for value in got['Client Version']] == [type(value) for value in expected['Client Version']]
+    assert [type(value) for value in got['Port']] == [type(value) for value in expected['Port']]
+
+
+def test_nrows_and_header_row(xlsx_path):
+    source = {'worksheet_name': 'Logs', 'header_row': 2, 'nrows': 8}
+    expected = pd.read_excel(xlsx_path, sheet_name='Logs', header=1, nrows=8)
+    got = pd.concat(list(iter_tabular_xlsx_batches(xlsx_path, source, 3)), ignore_index=True)
+
+    pd.testing.assert_frame_equal(got, expected)